@@ -0,0 +1,209 @@
+"""Performance benchmarks for NeuronUnit.
+
+Benchmarks are written as for airspeed velocity (asv): the methods named
+time_* of the classes in the modules of this package are timed, after an
+untimed setup().  A class may have `params` (a list of values, or a list
+of such lists for several parameters) and `param_names`, in which case
+every method is timed for every combination of the parameters, which are
+also passed to setup().  A setup() raising NotImplementedError skips the
+combination, e.g. because the NEURON backend is not installed.
+
+Run them with
+
+    python -m neuronunit.benchmarks -o results.json
+
+and compare the results of two commits with
+
+    python -m neuronunit.benchmarks --compare before.json results.json
+
+Results are stored as JSON, along with the commit and machine they were
+obtained on, so that regressions show up between commits.
+"""
+
+import datetime
+import importlib
+import inspect
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import traceback
+
+import numpy as np
+
+# Benchmark modules, in the order in which they are run.
+MODULES = ['models', 'rheobase', 'features', 'optimization']
+
+# Every benchmark is timed from the same random state.
+SEED = 0
+
+
+class Benchmark(object):
+    """One time_* method of a benchmark class, for one set of parameters."""
+
+    def __init__(self, module, cls, method, params=()):
+        self.module = module
+        self.cls = cls
+        self.method = method
+        self.params = tuple(params)
+
+    @property
+    def name(self):
+        name = '%s.%s.%s' % (self.module, self.cls.__name__, self.method)
+        if self.params:
+            name += '(%s)' % ', '.join(repr(p) for p in self.params)
+        return name
+
+    @property
+    def param_dict(self):
+        names = getattr(self.cls, 'param_names',
+                        ['param%d' % (i+1) for i in range(len(self.params))])
+        return dict(zip(names, self.params))
+
+    def seed(self):
+        random.seed(SEED)
+        np.random.seed(SEED)
+
+    def run(self, repeat=None, warmup=None):
+        """Time the benchmark, and return its result as a dictionary.
+
+        setup() is called (and the random state reset) before each sample,
+        and teardown() after it.  The first `warmup` samples are discarded,
+        so that e.g. compilation of numba kernels is not timed.  Errors are
+        recorded rather than raised.
+        """
+        repeat = repeat or getattr(self.cls, 'repeat', 5)
+        if warmup is None:
+            warmup = getattr(self.cls, 'warmup', 1)
+        result = {'name': self.name, 'params': self.param_dict,
+                  'samples': [], 'skipped': False, 'error': None}
+        try:
+            for i in range(warmup + repeat):
+                instance = self.cls()
+                self.seed()
+                if hasattr(instance, 'setup'):
+                    instance.setup(*self.params)
+                self.seed()
+                start = time.perf_counter()
+                getattr(instance, self.method)(*self.params)
+                seconds = time.perf_counter() - start
+                if hasattr(instance, 'teardown'):
+                    instance.teardown(*self.params)
+                if i >= warmup:
+                    result['samples'].append(seconds)
+        except NotImplementedError as e:
+            result['skipped'] = True
+            result['error'] = str(e)
+        except Exception:
+            result['error'] = traceback.format_exc()
+        samples = result['samples']
+        if samples and result['error'] is None:
+            result['min'] = min(samples)
+            result['median'] = float(np.median(samples))
+            result['mean'] = float(np.mean(samples))
+        return result
+
+
+def discover(modules=None, match=None):
+    """The Benchmarks of the given modules of this package (by default, all
+    of them), optionally only those whose name contains match."""
+    benchmarks = []
+    for module_name in (modules or MODULES):
+        module = importlib.import_module('.%s' % module_name, __name__)
+        classes = [cls for name, cls in inspect.getmembers(module,
+                                                           inspect.isclass)
+                   if cls.__module__ == module.__name__
+                   and not name.startswith('_')]
+        for cls in sorted(classes, key=lambda cls: cls.__name__):
+            params = getattr(cls, 'params', [])
+            if params and not isinstance(params[0], (list, tuple)):
+                params = [params]
+            methods = sorted(name for name in dir(cls)
+                             if name.startswith('time_'))
+            for method in methods:
+                for combination in itertools.product(*params):
+                    benchmark = Benchmark(module_name, cls, method,
+                                          combination)
+                    if match is None or match in benchmark.name:
+                        benchmarks.append(benchmark)
+    return benchmarks
+
+
+def commit_hash():
+    """The git commit of the working tree, or None if it is not known."""
+    try:
+        out = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                      cwd=os.path.dirname(__file__),
+                                      stderr=subprocess.DEVNULL)
+    except Exception:
+        return None
+    return out.decode().strip()
+
+
+def run(modules=None, match=None, repeat=None, warmup=None, verbose=True):
+    """Run the benchmarks, and return their results with the commit and
+    machine they were obtained on."""
+    # Traces cached on disk by an earlier run would be timed instead of
+    # the simulations.
+    from neuronunit.models.backends import base
+    os.environ.pop('NU_TRACE_CACHE', None)
+    base._trace_cache = None
+
+    results = {}
+    for benchmark in discover(modules, match):
+        result = benchmark.run(repeat=repeat, warmup=warmup)
+        results[benchmark.name] = result
+        if verbose:
+            print(format_result(result))
+            sys.stdout.flush()
+    return {'commit': commit_hash(),
+            'date': datetime.datetime.now().isoformat(),
+            'machine': platform.node(),
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'results': results}
+
+
+def format_result(result):
+    if result['skipped']:
+        status = 'skipped (%s)' % result['error']
+    elif result['error'] is not None:
+        status = 'failed: %s' % result['error'].strip().splitlines()[-1]
+    else:
+        status = '%.4gs (median %.4gs)' % (result['min'], result['median'])
+    return '%-60s %s' % (result['name'], status)
+
+
+def save(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def compare(old, new, factor=1.1):
+    """Benchmarks timed in both old and new results (as returned by run or
+    load), as (name, old seconds, new seconds, ratio) sorted by name, and
+    the names of those more than factor times slower in new.
+
+    The minimum over samples is compared, being the least noisy estimate.
+    """
+    rows, regressions = [], []
+    for name in sorted(set(old['results']) & set(new['results'])):
+        before = old['results'][name].get('min')
+        after = new['results'][name].get('min')
+        if before is None or after is None:
+            continue
+        ratio = after / before if before > 0 else float('inf')
+        rows.append((name, before, after, ratio))
+        if ratio > factor:
+            regressions.append(name)
+    return rows, regressions
@@ -0,0 +1,52 @@
+"""Run the NeuronUnit benchmarks, or compare the results of two runs.
+
+    python -m neuronunit.benchmarks [-k rheobase] [-o results.json]
+    python -m neuronunit.benchmarks --compare before.json after.json
+
+Comparing exits with status 1 if any benchmark got slower by more than
+--factor.
+"""
+
+import argparse
+import sys
+
+from neuronunit import benchmarks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m neuronunit.benchmarks',
+                                     description=__doc__.splitlines()[0])
+    parser.add_argument('-k', dest='match', default=None,
+                        help="only run benchmarks whose name contains this")
+    parser.add_argument('-m', '--module', action='append', default=None,
+                        choices=benchmarks.MODULES,
+                        help="only run the benchmarks of this module")
+    parser.add_argument('-r', '--repeat', type=int, default=None,
+                        help="samples per benchmark (default: per class)")
+    parser.add_argument('-o', '--output', default=None,
+                        help="JSON file to save the results to")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help="compare two JSON result files")
+    parser.add_argument('--factor', type=float, default=1.1,
+                        help="slowdown reported as a regression")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        old, new = [benchmarks.load(path) for path in args.compare]
+        rows, regressions = benchmarks.compare(old, new, factor=args.factor)
+        print('%s -> %s' % (old.get('commit'), new.get('commit')))
+        for name, before, after, ratio in rows:
+            flag = '  <-- slower' if name in regressions else ''
+            print('%-60s %10.4gs %10.4gs %7.2fx%s' % (name, before, after,
+                                                       ratio, flag))
+        return 1 if regressions else 0
+
+    results = benchmarks.run(modules=args.module, match=args.match,
+                             repeat=args.repeat)
+    if args.output:
+        benchmarks.save(results, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Fixed models, stimuli, observations and traces shared by the benchmarks."""
+
+import numpy as np
+import quantities as pq
+from neo import AnalogSignal
+
+from neuronunit.optimization.model_parameters import path_params, \
+    reduced_cells
+
+# Backends simulating the Izhikevich model of model_parameters.reduced_cells;
+# the others simulate their own default cell.
+IZHIKEVICH_BACKENDS = ('RAW', 'NEURON', 'jNeuroML')
+
+# The square current used for single simulations, well above the rheobase
+# of every cell in reduced_cells.
+CURRENT = {'amplitude': 300*pq.pA, 'delay': 100*pq.ms,
+           'duration': 1000*pq.ms}
+
+
+def make_model(backend, cell='RS'):
+    """A ReducedModel of one of reduced_cells, simulated by backend, with
+    the backend's result caches disabled so that every run simulates.
+
+    Raises NotImplementedError (i.e. skips the benchmark) if the backend
+    cannot be loaded, e.g. because its simulator is not installed.
+    """
+    from neuronunit.models.backends import available_backends
+    from neuronunit.models.reduced import ReducedModel
+    from sciunit.models.backends import BackendException
+    if available_backends.get(backend) is None:
+        raise NotImplementedError("the %s backend is not available"
+                                  % backend)
+    try:
+        model = ReducedModel(path_params['model_path'], name=cell,
+                             backend=backend)
+    except BackendException as e:
+        raise NotImplementedError(str(e))
+    if backend in IZHIKEVICH_BACKENDS:
+        model.set_attrs(**reduced_cells[cell])
+    model.get_backend().use_memory_cache = False
+    model.get_backend().use_disk_cache = False
+    return model
+
+
+def observation(mean, std, units, n=10):
+    return {'mean': mean*units, 'std': std*units, 'n': n}
+
+
+def standard_tests():
+    """The standard NeuroElectro test suite of the optimizer, with fixed
+    observations typical of neocortical pyramidal cells.
+
+    Tests are named after their class, as optimization_management expects.
+    """
+    from neuronunit.tests import passive, waveform
+    from neuronunit.tests.fi import RheobaseTestP
+    observations = [
+        (RheobaseTestP, observation(200, 50, pq.pA)),
+        (passive.InputResistanceTest, observation(120, 60, pq.MOhm)),
+        (passive.TimeConstantTest, observation(15, 8, pq.ms)),
+        (passive.CapacitanceTest, observation(150, 80, pq.pF)),
+        (passive.RestingPotentialTest, observation(-68, 6, pq.mV)),
+        (waveform.InjectedCurrentAPWidthTest, observation(1.2, 0.4, pq.ms)),
+        (waveform.InjectedCurrentAPAmplitudeTest, observation(80, 10, pq.mV)),
+        (waveform.InjectedCurrentAPThresholdTest,
+         observation(-45, 5, pq.mV)),
+    ]
+    return [cls(observation=obs, name=cls.__name__)
+            for cls, obs in observations]
+
+
+def canned_trace(duration=3000.0, delay=1000.0, step=2000.0, isi=50.0,
+                 dt=0.025, noise=0.1):
+    """A fixed membrane potential trace: a train of action potentials every
+    isi ms during a current step from delay to delay + step ms, with
+    seeded noise.  Timing feature extraction on it, rather than on a
+    simulated trace, leaves simulation out of the benchmark."""
+    rng = np.random.RandomState(0)
+    t = np.arange(0, duration, dt)
+    v = -65.0 + noise * rng.randn(len(t))
+    in_step = (t >= delay) & (t < delay + step)
+    # Depolarization by the current step, and a Gaussian spike with an
+    # after-hyperpolarization for every spike time.
+    v[in_step] += 5.0
+    for spike in np.arange(delay + isi/2, delay + step, isi):
+        v += 95.0 * np.exp(-0.5 * ((t - spike) / 0.3)**2)
+        after = t > spike
+        v[after] -= 8.0 * np.exp(-(t[after] - spike - 0.5) / 5.0) \
+            * (t[after] > spike + 0.5)
+    return AnalogSignal(v, units=pq.mV, sampling_period=dt*pq.ms)
+
+
+class CannedModel(object):
+    """A model replaying canned_trace, whatever the current injected."""
+
+    def __init__(self, vm=None):
+        self.vm = canned_trace() if vm is None else vm
+
+    def inject_square_current(self, current):
+        pass
+
+    def get_membrane_potential(self):
+        return self.vm
@@ -0,0 +1,67 @@
+"""Benchmarks of spike detection and feature extraction on a canned trace."""
+
+import quantities as pq
+
+from .common import CannedModel, canned_trace
+from neuronunit.capabilities import spike_functions as sf
+
+
+class SpikeFunctions(object):
+    """The spike_functions used by the waveform tests."""
+
+    def setup(self):
+        self.vm = canned_trace()
+        self.waveforms = sf.get_spike_waveforms(self.vm)
+
+    def time_get_spike_indices(self):
+        sf.get_spike_indices(self.vm)
+
+    def time_get_spike_train(self):
+        sf.get_spike_train(self.vm)
+
+    def time_get_spike_waveforms(self):
+        sf.get_spike_waveforms(self.vm)
+
+    def time_spikes2amplitudes(self):
+        sf.spikes2amplitudes(self.waveforms)
+
+    def time_spikes2widths(self):
+        sf.spikes2widths(self.waveforms)
+
+    def time_spikes2thresholds(self):
+        sf.spikes2thresholds(self.waveforms)
+
+
+class Druckmann2013(object):
+    """AP detection and the feature table of Druckmann2013Test, and the
+    predictions of every Druckmann 2013 test sharing them."""
+
+    repeat = 3
+
+    def setup(self):
+        from neuronunit.tests import druckmann2013 as dm
+        dm.Druckmann2013FeatureExtractor.clear_cache()
+        self.model = CannedModel()
+        self.test = dm.AP1AmplitudeTest(1*pq.nA)
+        self.tests = [cls(1*pq.nA) for cls in
+                      [dm.AP12AmplitudeDropTest, dm.AP1SSAmplitudeChangeTest,
+                       dm.AP1AmplitudeTest, dm.AP1WidthHalfHeightTest,
+                       dm.AP1WidthPeakToTroughTest,
+                       dm.AP1RateOfChangePeakToTroughTest, dm.AP1AHPDepthTest,
+                       dm.AP2AmplitudeTest, dm.AP2WidthHalfHeightTest,
+                       dm.AP12AmplitudeChangePercentTest,
+                       dm.AP12HalfWidthChangePercentTest, dm.AP1DelayMeanTest,
+                       dm.Burst1ISIMeanTest, dm.InitialAccommodationMeanTest,
+                       dm.SSAccommodationMeanTest, dm.ISICVTest,
+                       dm.ISIMedianTest, dm.ISIBurstMeanChangeTest]]
+
+    def teardown(self):
+        from neuronunit.tests import druckmann2013 as dm
+        dm.Druckmann2013FeatureExtractor.clear_cache()
+
+    def time_feature_table(self):
+        self.test.get_feature_extractor(self.model).table
+
+    def time_generate_predictions(self):
+        for test in self.tests:
+            test.generate_prediction(self.model)
@@ -0,0 +1,46 @@
+"""Benchmarks of single and batched simulations with each backend."""
+
+from .common import CURRENT, make_model
+from neuronunit.optimization.model_parameters import reduced_cells
+
+
+class Simulation(object):
+    """One 1.2 s simulation of the RS cell receiving a square current."""
+
+    params = ['RAW', 'HH', 'NEURON']
+    param_names = ['backend']
+
+    def setup(self, backend):
+        from neuronunit.models.backends import warm_up
+        warm_up([backend])
+        self.model = make_model(backend)
+
+    def time_simulation(self, backend):
+        self.model.inject_square_current(CURRENT)
+        self.model.get_membrane_potential()
+
+
+class PopulationSimulation(object):
+    """One batched simulation of every cell of reduced_cells, at 5
+    current amplitudes each."""
+
+    params = ['RAW', 'HH']
+    param_names = ['backend']
+
+    def setup(self, backend):
+        from neuronunit.models.backends import warm_up
+        from neuronunit.tests.fi import get_batch_simulator
+        warm_up([backend])
+        make_model(backend)  # Skips the benchmark if the backend is missing
+        self.simulate_population = get_batch_simulator(backend)
+        if backend == 'RAW':
+            cells = list(reduced_cells.values())
+        else:
+            cells = [{}] * len(reduced_cells)
+        amplitudes = [100.0, 200.0, 300.0, 400.0, 500.0]
+        self.attrs = [attrs for attrs in cells for a in amplitudes]
+        self.amplitudes = amplitudes * len(cells)
+
+    def time_simulate_population(self, backend):
+        self.simulate_population(self.attrs, CURRENT,
+                                 amplitudes=self.amplitudes)
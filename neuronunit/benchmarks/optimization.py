@@ -0,0 +1,50 @@
+"""Benchmarks of the evaluation of a model by the standard test suite, and
+of a generation of the genetic algorithm."""
+
+import copy
+
+from .common import make_model, standard_tests
+from neuronunit.optimization.model_parameters import model_params, \
+    reduced_cells
+
+
+class Evaluation(object):
+    """nunit_evaluation of the RS cell by the standard test suite, its
+    rheobase being known."""
+
+    repeat = 3
+
+    def setup(self):
+        from neuronunit.optimization import optimization_management as om
+        from neuronunit.optimization.data_transport_container import DataTC
+        make_model('RAW')
+        dtc = DataTC()
+        dtc.attrs = dict(reduced_cells['RS'])
+        dtc.backend = 'RAW'
+        dtc.tests = standard_tests()
+        dtc = om.dtc_to_rheo(dtc)
+        self.dtc = om.format_test(dtc)
+
+    def time_nunit_evaluation(self):
+        from neuronunit.optimization import optimization_management as om
+        om.nunit_evaluation(copy.copy(self.dtc))
+
+
+class GAGeneration(object):
+    """One generation of SciUnitOptimization (the evaluation of its
+    initial population) over 3 parameters of the RAW model."""
+
+    repeat = 1
+    free_params = ['a', 'b', 'vr']
+
+    def setup(self):
+        from neuronunit.optimization.bp_opt import SciUnitOptimization
+        make_model('RAW')
+        provided_dict = {k: model_params[k] for k in self.free_params}
+        self.optimization = SciUnitOptimization(
+            error_criterion=standard_tests(), backend='RAW',
+            selection='selNSGA', offspring_size=8, seed=1,
+            nparams=len(provided_dict), provided_dict=provided_dict)
+
+    def time_generation(self):
+        self.optimization.run(max_ngen=1)
@@ -0,0 +1,43 @@
+"""Benchmarks of rheobase searches, serial and parallel."""
+
+import quantities as pq
+
+from .common import make_model, observation
+from neuronunit.optimization.model_parameters import reduced_cells
+
+
+class Rheobase(object):
+    """RheobaseTest against RheobaseTestP, on the RS cell."""
+
+    params = ['RheobaseTest', 'RheobaseTestP']
+    param_names = ['test']
+    repeat = 3
+
+    def setup(self, test):
+        from neuronunit.tests import fi
+        self.model = make_model('RAW')
+        self.test = getattr(fi, test)(observation(200, 50, pq.pA))
+
+    def time_generate_prediction(self, test):
+        self.test.generate_prediction(self.model)
+
+
+class PopulationRheobase(object):
+    """One population rheobase search over every cell of reduced_cells,
+    as done for each generation of the GA."""
+
+    repeat = 3
+
+    def setup(self):
+        from neuronunit.optimization.data_transport_container import DataTC
+        make_model('RAW')
+        self.dtcpop = []
+        for attrs in reduced_cells.values():
+            dtc = DataTC()
+            dtc.attrs = dict(attrs)
+            dtc.backend = 'RAW'
+            self.dtcpop.append(dtc)
+
+    def time_find_rheobase_population(self):
+        from neuronunit.tests.fi import find_rheobase_population
+        find_rheobase_population(self.dtcpop)
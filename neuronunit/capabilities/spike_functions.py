@@ -2,11 +2,8 @@
 
 import numpy as np
 import neo
-from elephant.spike_train_generation import threshold_detection
 from quantities import mV, ms
-from numba import jit
 import sciunit
-import math
 
 
 def get_spike_train(vm, threshold=0.0*mV):
@@ -19,10 +16,61 @@ def get_spike_train(vm, threshold=0.0*mV):
     Returns:
      a neo.core.SpikeTrain containing the times of spikes.
     """
+    # elephant is slow to import, and only needed here.
+    from elephant.spike_train_generation import threshold_detection
     spike_train = threshold_detection(vm, threshold=threshold)
     return spike_train
 
 
+def _run_starts(above):
+    """
+    Indices, along the last axis, of the first sample of every run of True
+    values in a boolean array; the same spike times elephant's
+    threshold_detection reports.
+    """
+    starts = above.copy()
+    starts[..., 1:] &= ~above[..., :-1]
+    return starts
+
+
+def _magnitude(x, units):
+    """Raw float value(s) of x in the given units."""
+    if hasattr(x, 'rescale'):
+        x = x.rescale(units)
+    return np.asarray(x, dtype=float)
+
+
+def get_spike_indices(vm, threshold=0.0*mV):
+    """
+    Inputs:
+     vm: a neo.core.AnalogSignal corresponding to a membrane potential trace.
+     threshold: the value (in mV) above which vm has to cross for there
+                to be a spike.  Scalar float.
+
+    Returns:
+     1D numpy array with the sample index of every spike, i.e. of the first
+     sample above threshold, as in get_spike_train.
+    """
+    v = np.asarray(vm.magnitude, dtype=float).ravel()
+    thresh = _magnitude(threshold, vm.units)
+    return np.flatnonzero(_run_starts(v > thresh))
+
+
+def get_spike_counts(vms, threshold=0.0):
+    """
+    Inputs:
+     vms: a 2D numpy array with one membrane potential trace per row,
+          e.g. from a batched simulation.
+     threshold: the value above which vm has to cross for there
+                to be a spike, in the same units as vms.  Scalar float.
+
+    Returns:
+     1D numpy array with the number of threshold crossings per row.
+    """
+    vms = np.atleast_2d(vms)
+    return np.sum(_run_starts(vms > threshold), axis=1)
+
+
 def get_spike_waveforms(vm, threshold=0.0*mV, width=10*ms):
     """
     Membrane potential trace (1D numpy array) to matrix of
@@ -39,42 +87,62 @@ def get_spike_waveforms(vm, threshold=0.0*mV, width=10*ms):
      a neo.core.AnalogSignal where each column contains a membrane potential
      snippets corresponding to one spike.
     """
-    spike_train = threshold_detection(vm, threshold=threshold)
+    v = np.asarray(vm.magnitude, dtype=float).ravel()
+    spikes = get_spike_indices(vm, threshold=threshold)
+    # Half of the window in samples, not necessarily a whole number.
+    half = float((width/2.0*vm.sampling_rate).simplified)
 
-    # Fix for 0-length spike train issue in elephant.
-    try:
-        assert len(spike_train) != 0
-    except TypeError:
-        spike_train = neo.core.SpikeTrain([], t_start=spike_train.t_start,
-                                          t_stop=spike_train.t_stop,
-                                          units=spike_train.units)
-
-    too_short = True
-    too_long = True
+    if not len(spikes):
+        return neo.core.AnalogSignal(np.zeros((int(np.rint(2*half)), 0)),
+                                     units=vm.units,
+                                     sampling_rate=vm.sampling_rate)
 
     # This code checks that you are not asking for a window into an array,
     # with out of bounds indicies.
-    t = spike_train[0]
-    if t-width/2.0 > 0.0*ms:
-        too_short = False
-
-    t = spike_train[-1]
-    if t+width/2.0 < vm.times[-1]:
-        too_long = False
+    # Sample i lies at t_start + i*dt, so these mirror the comparisons of
+    # the first and last spike times against the ends of vm.times.
+    t_start = float(vm.t_start.rescale(vm.sampling_period.units)
+                    / vm.sampling_period)
+    too_short = not spikes[0] - half + t_start > 0.0
+    too_long = not spikes[-1] + half < len(v) - 1
+
+    # Window bounds as time_slice would round them, for the first spike;
+    # every other window has the same length.
     if not too_short and not too_long:
-        snippets = [vm.time_slice(t-width/2, t+width/2) for t in spike_train]
+        lo, hi = np.rint(spikes[0] - half), np.rint(spikes[0] + half)
     elif too_long:
-        snippets = [vm.time_slice(t-width/2, t) for t in spike_train]
-    elif too_short:
-        snippets = [vm.time_slice(t, t+width/2) for t in spike_train]
-
-    result = neo.core.AnalogSignal(np.array(snippets).T.squeeze(),
+        lo, hi = np.rint(spikes[0] - half), spikes[0]
+    else:
+        lo, hi = spikes[0], np.rint(spikes[0] + half)
+    offset = int(lo) - spikes[0]
+    length = int(hi) - int(lo)
+
+    # Gather every snippet at once, one column per spike.
+    index = spikes[np.newaxis, :] + offset + np.arange(length)[:, np.newaxis]
+    index = np.clip(index, 0, len(v) - 1)
+    result = neo.core.AnalogSignal(v[index],
                                    units=vm.units,
                                    sampling_rate=vm.sampling_rate)
 
     return result
 
 
+def _thresholds(s, dvdt):
+    """
+    For every column of the waveform matrix s, with slopes dvdt, the
+    membrane potential at which 1/10 the maximum slope is first reached.
+    Also outputs which columns reached it at all (not so if NaNs).
+    """
+    columns = np.arange(s.shape[1])
+    with np.errstate(invalid='ignore'):
+        trigger = dvdt.max(axis=0)/10
+        reached = dvdt >= trigger
+    found = reached.any(axis=0)
+    x_loc = np.argmax(reached, axis=0)
+    thresh = (s[x_loc, columns]+s[x_loc+1, columns])/2
+    return thresh, found
+
+
 def spikes2amplitudes(spike_waveforms):
     """
     IN:
@@ -85,10 +153,11 @@ def spikes2amplitudes(spike_waveforms):
     """
 
     n_spikes = spike_waveforms.shape[1]
-    ampls = np.array([spike_waveforms[:, i].max() for i in range(n_spikes)])
+    ampls = np.asarray(spike_waveforms.magnitude).max(axis=0) \
+        if n_spikes else np.array([])
     if n_spikes:
         # Add units.
-        ampls = ampls * spike_waveforms[:, 0].units
+        ampls = ampls * spike_waveforms.units
     return ampls
 
 
@@ -102,36 +171,24 @@ def spikes2widths(spike_waveforms):
      at half the maximum amplitude.
     """
     n_spikes = spike_waveforms.shape[1]
-    widths = []
-    for i in range(n_spikes):
-        s = spike_waveforms[:, i].squeeze()
-        try:
-            x_high = int(np.argmax(s))
-            high = s[x_high]
-        except:
-            high = 0
-            for k in s:
-                for i, j in enumerate(k):
-                    if j > high:
-                        high = j
-                        x_high = i
-
-        if x_high > 0:
-            try:  # Use threshold to compute half-max.
-                y = np.array(s)
-                dvdt = np.diff(y)
-                trigger = dvdt.max()/10
-                x_loc = int(np.where(dvdt >= trigger)[0][0])
-                thresh = (s[x_loc]+s[x_loc+1])/2
-                mid = (high+thresh)/2
-            except:  # Use minimum value to compute half-max.
-                sciunit.log(("Could not compute threshold; using pre-spike "
-                             "minimum to compute width"))
-                low = np.min(s[:x_high])
-                mid = (high+low)/2
-            n_samples = sum(s > mid)  # Number of samples above the half-max.
-            widths.append(n_samples)
-    widths = np.array(widths, dtype='float')
+    widths = np.array([], dtype='float')
+    if n_spikes and len(spike_waveforms) > 1:
+        s = np.asarray(spike_waveforms.magnitude, dtype=float)
+        columns = np.arange(n_spikes)
+        x_high = np.argmax(s, axis=0)
+        high = s[x_high, columns]
+        # Use threshold to compute half-max.
+        thresh, found = _thresholds(s, np.diff(s, axis=0))
+        if not found[x_high > 0].all():
+            # Use minimum value to compute half-max.
+            sciunit.log(("Could not compute threshold; using pre-spike "
+                         "minimum to compute width"))
+        pre_spike = np.arange(len(s))[:, np.newaxis] < x_high
+        low = np.where(pre_spike, s, np.inf).min(axis=0)
+        mid = np.where(found, (high+thresh)/2, (high+low)/2)
+        # Number of samples above the half-max.
+        n_samples = np.sum(s > mid, axis=0)
+        widths = n_samples[x_high > 0].astype('float')
     if n_spikes:
         # Convert from samples to time.
         widths = widths*spike_waveforms.sampling_period
@@ -153,17 +210,12 @@ def spikes2thresholds(spike_waveforms):
     """
 
     n_spikes = spike_waveforms.shape[1]
-    thresholds = []
-    for i in range(n_spikes):
-        s = spike_waveforms[:, i].squeeze()
-        s = np.array(s)
-        dvdt = np.diff(s)
-        for j in dvdt:
-            if math.isnan(j):
-                return thresholds * spike_waveforms.units
-
-        trigger = dvdt.max()/10
-        x_loc = np.where(dvdt >= trigger)[0][0]
-        thresh = (s[x_loc]+s[x_loc+1])/2
-        thresholds.append(thresh)
-    return thresholds * spike_waveforms.units
+    if not n_spikes or len(spike_waveforms) < 2:
+        return [] * spike_waveforms.units
+    s = np.asarray(spike_waveforms.magnitude, dtype=float)
+    dvdt = np.diff(s, axis=0)
+    # Only the waveforms before the first one with a NaN slope are kept.
+    nans = np.isnan(dvdt).any(axis=0)
+    n_valid = int(np.argmax(nans)) if nans.any() else n_spikes
+    thresh, _ = _thresholds(s[:, :n_valid], dvdt[:, :n_valid])
+    return thresh * spike_waveforms.units
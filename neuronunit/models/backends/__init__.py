@@ -1,7 +1,18 @@
-"""Neuronunit-specific model backends."""
+"""Neuronunit-specific model backends.
 
-import inspect
+Backend modules are only imported when a backend is asked for by name
+(e.g. by set_backend), not when this package is imported, so that
+`import neuronunit` does not pay for simulators it will never use.
+"""
+
+import importlib
+import logging
+import sys
 import warnings
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
 
 import sciunit.models.backends as su_backends
 from sciunit.utils import PLATFORM, PYTHON_MAJOR_VERSION
@@ -9,52 +20,94 @@ from .base import Backend
 
 warnings.filterwarnings('ignore', message='nested set')
 warnings.filterwarnings('ignore', message='mpi4py')
+logger = logging.getLogger(__name__)
 
-try:
-    from .jNeuroML import jNeuroMLBackend
-except ImportError:
-    jNeuroMLBackend = None
-    print('Could not load jNeuroMLBackend')
+# Backend name -> (module in this package, Backend class in that module).
+BACKEND_MODULES = {
+    'jNeuroML': ('jNeuroML', 'jNeuroMLBackend'),
+    'NEURON': ('neuron', 'NEURONBackend'),
+    'RAW': ('rawpy', 'RAWBackend'),
+    'HH': ('hhrawf', 'HHBackend'),
+    # 'HHpyNN': ('general_pyNN', 'HHpyNNBackend'),
+    'GLIF': ('glif', 'GLIFBackend'),
+}
 
-try:
-    from .neuron import NEURONBackend
-except ImportError:
-    NEURONBackend = None
-    print('Could not load NEURONBackend')
 
-try:
-    from .rawpy import RAWBackend
-except ImportError:
-    RAWBackend = None
-    print('Could not load RAWBackend.')
+class BackendRegistry(Mapping):
+    """The backends known by name, imported the first time they are looked up.
 
-try:
-    from .hhrawf import HHBackend
-except ImportError:
-    HHBackend = None
-    print('Could not load HHBackend.')
+    Looking a backend up also registers it with sciunit, so that models
+    using sciunit's own set_backend can find it.  Backends whose module
+    fails to import (e.g. because a simulator is not installed) are
+    logged once, with the reason, and then behave as missing: looking them
+    up raises a KeyError caused by the original exception.  Since `in`
+    looks a backend up, it also imports it.
+    """
 
-"""
-try:
-    from .general_pyNN import HHpyNNBackend
-except ImportError:
-    HHpyNNBackend = None
-    print('Could not load HHpyNNBackend.')
-except (AttributeError, IOError) as e:
-    if any([x in str(e) for x in ('NEURON', "'hoc.HocObject' object")]):
-        print('Could not load PyNNBackend due to NEURON issues: %s' % str(e))
-    else:
-        raise e
-"""
+    def __init__(self, modules):
+        self.modules = modules
+        self.loaded = {}
+        self.failed = {}
 
-try:
-    from .glif import GLIFBackend
-except Exception as e:
-    print('Could not load GLIFBackend')
+    def load(self, name):
+        """Import, register and return the Backend class called name."""
+        if name in self.loaded:
+            return self.loaded[name]
+        if name in self.failed:
+            raise KeyError(name) from self.failed[name]
+        if name not in self.modules:
+            raise KeyError(name)
+        module_name, class_name = self.modules[name]
+        try:
+            module = importlib.import_module('.%s' % module_name, __name__)
+            cls = getattr(module, class_name)
+        except Exception as e:
+            self.failed[name] = e
+            logger.warning('Could not load %s', class_name, exc_info=True)
+            raise KeyError(name) from e
+        self.loaded[name] = cls
+        su_backends.register_backends({class_name: cls})
+        return cls
+
+    def __getitem__(self, name):
+        return self.load(name)
+
+    def __iter__(self):
+        return iter(self.modules)
+
+    def __len__(self):
+        return len(self.modules)
+
+
+available_backends = BackendRegistry(BACKEND_MODULES)
+_warmed_up = set()
+
+
+def warm_up(names=None):
+    """Compile the numerical kernels of the named backends (by default, of
+    every backend that loads) in this process, if not done yet.
+
+    Meant to run when a worker process starts, e.g. with dask.distributed
+    `client.register_worker_callbacks(warm_up)`, so that the first
+    simulation on every worker is as fast as the rest; see also aot.py.
+    """
+    for name in (names or list(available_backends)):
+        if name in _warmed_up:
+            continue
+        cls = available_backends.get(name)
+        if cls is None:
+            continue
+        module = sys.modules[cls.__module__]
+        if hasattr(module, 'warm_up'):
+            module.warm_up()
+        _warmed_up.add(name)
 
-available_backends = {x.replace('Backend', ''): cls for x, cls
-                      in locals().items()
-                      if inspect.isclass(cls) and
-                      issubclass(cls, Backend)}
 
-su_backends.register_backends(locals())
+def __getattr__(attr):
+    """Resolve e.g. `from neuronunit.models.backends import NEURONBackend`
+    lazily (Python 3.7+), with None for backends that cannot be loaded,
+    as before."""
+    for name, (module_name, class_name) in BACKEND_MODULES.items():
+        if attr == class_name:
+            return available_backends.get(name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, attr))
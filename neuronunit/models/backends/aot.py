@@ -0,0 +1,62 @@
+"""Ahead-of-time compilation of the numerical kernels of the backends.
+
+Numba compiles the kernels on first use, and caches the result on disk
+(in __pycache__, or in $NUMBA_CACHE_DIR), so only the first process to use
+them pays for compilation.  Where even that is unwanted, e.g. on clusters
+whose workers do not share a writable cache directory, run
+
+    python -m neuronunit.models.backends.aot
+
+to build the _kernels extension module once, next to this file.  The
+backends use its functions in place of the JIT compiled kernels, as long
+as the source of the kernels' modules (including the helpers inlined into
+the kernels) has not changed since it was built.
+"""
+
+import json
+import os
+import sys
+
+from .base import kernel_digest
+
+# Kernels are exported with the argument types the backends call them with.
+SIGNATURES = {
+    'rawpy': {
+        'izhikevich': 'f8[:](f8, f8, f8, f8, f8, f8, f8, f8, f8, f8, f8[:], i8)',
+        'get_vm_population': 'f8[:, :](f8[:, :], f8[:], f8[:], f8, i8)',
+    },
+    'hhrawf': {
+        'integrate_population': ('f8[:, :](f8[:, :], f8[:], f8[:], f8[:], '
+                                 'f8, i8, i8, f8[:, :], f8, f8)'),
+    },
+}
+
+
+def build(output_dir=None, verbose=False):
+    """Compile the kernels into the _kernels extension module.
+
+    Outputs the path of the module.
+    """
+    import importlib
+    from numba.pycc import CC
+
+    if output_dir is None:
+        output_dir = os.path.dirname(os.path.abspath(__file__))
+    cc = CC('_kernels')
+    cc.output_dir = output_dir
+    cc.verbose = verbose
+    digests = {}
+    for module_name, kernels in SIGNATURES.items():
+        module = importlib.import_module('.%s' % module_name, __package__)
+        for name, signature in kernels.items():
+            kernel = getattr(module, name)
+            cc.export(name, signature)(kernel.py_func)
+            digests[name] = kernel_digest(kernel)
+    cc.compile()
+    with open(os.path.join(output_dir, '_kernels.json'), 'w') as f:
+        json.dump(digests, f, indent=1, sort_keys=True)
+    return cc.output_file
+
+
+if __name__ == '__main__':
+    print(build(*sys.argv[1:2], verbose=True))
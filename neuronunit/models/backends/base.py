@@ -7,8 +7,14 @@ import copy
 import tempfile
 import pickle
 import importlib
+import inspect
+import importlib.util
 import shelve
 import subprocess
+import hashlib
+import json
+
+import numpy as np
 
 import neuronunit.capabilities as cap
 import quantities as pq
@@ -20,8 +26,8 @@ from sciunit.models.backends import Backend, BackendException
 from sciunit.utils import dict_hash, import_module_from_path, \
                           TemporaryDirectory
 
-# Test for NEURON support in a separate python process
-NEURON_SUPPORT = (os.system("python -c 'import neuron' > /dev/null 2>&1") == 0)  
+# Test for NEURON support without importing it (or spawning a python process)
+NEURON_SUPPORT = importlib.util.find_spec('neuron') is not None
 
 try:
     import pyNN
@@ -29,3 +35,193 @@ try:
 except:
     pyNN = None
     pyNN_SUPPORT = False
+
+
+class TraceCache(object):
+    """A persistent, content-addressed store of simulated membrane potentials.
+
+    Traces are keyed on a stable hash of the backend name, the model
+    attributes, the run parameters and the injected current, and are stored
+    as one compressed .npz file per key, so that any process on the same
+    node that points at the same directory can reuse them. The total size
+    on disk is bounded, least recently used traces are evicted first.
+    """
+
+    def __init__(self, path, max_bytes=2**30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if not os.path.isdir(path):
+            os.makedirs(path, exist_ok=True)
+        self.n_bytes = sum(size for _, _, size in self._entries())
+
+    @staticmethod
+    def _canonical(value):
+        """Reduce a value to something with a stable JSON encoding."""
+        if isinstance(value, dict):
+            return [[str(k), TraceCache._canonical(value[k])]
+                    for k in sorted(value, key=str)]
+        if isinstance(value, (list, tuple)):
+            return [TraceCache._canonical(x) for x in value]
+        if isinstance(value, pq.Quantity):
+            return [TraceCache._canonical(value.magnitude.tolist()),
+                    value.dimensionality.string]
+        if isinstance(value, np.ndarray):
+            return value.tolist()
+        if isinstance(value, (bool, str)) or value is None:
+            return value
+        if isinstance(value, (int, float, np.number)):
+            return repr(float(value))
+        return repr(value)
+
+    def key(self, backend, attrs, run_params, current):
+        """Get the key of a simulation."""
+        description = [backend, self._canonical(attrs),
+                       self._canonical(run_params),
+                       self._canonical(current)]
+        s = json.dumps(description, sort_keys=True).encode('utf-8')
+        return hashlib.sha224(s).hexdigest()
+
+    def _file(self, key):
+        return os.path.join(self.path, '%s.npz' % key)
+
+    def _entries(self):
+        """(access time, path, size) of every trace in the cache."""
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.npz'):
+                path = os.path.join(self.path, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:  # Evicted by another process.
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        return entries
+
+    def get(self, key):
+        """Return the cached AnalogSignal for key, or None if not found."""
+        path = self._file(key)
+        try:
+            with np.load(path) as data:
+                vm = AnalogSignal(data['vm'],
+                                  units=str(data['units']),
+                                  sampling_period=float(data['dt'])*pq.ms)
+            os.utime(path)  # Mark as recently used.
+        except (IOError, OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return vm
+
+    def set(self, key, vm):
+        """Store an AnalogSignal under key."""
+        path = self._file(key)
+        fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, vm=np.asarray(vm.magnitude).ravel(),
+                                units=vm.dimensionality.string,
+                                dt=float(vm.sampling_period.rescale(pq.ms)))
+        # Atomic, so concurrent readers never see a partial trace.
+        os.replace(tmp_path, path)
+        self.n_bytes += os.path.getsize(path)
+        if self.n_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Remove least recently used traces until within max_bytes."""
+        entries = sorted(self._entries())
+        self.n_bytes = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self.n_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except OSError:
+                pass
+            self.n_bytes -= size
+
+    def clear(self):
+        """Remove every trace from the cache."""
+        for _, path, _ in self._entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self.n_bytes = 0
+
+    @property
+    def stats(self):
+        """Hit and miss counters for this process."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'bytes': self.n_bytes}
+
+
+_trace_cache = None
+
+
+def get_trace_cache():
+    """Get the trace cache shared by the backends of this process.
+
+    Disabled (None) unless set_trace_cache was called, or the NU_TRACE_CACHE
+    environment variable names a cache directory; the environment variable
+    is inherited by worker processes, so they all share one cache.
+    NU_TRACE_CACHE_BYTES optionally bounds its size.
+    """
+    global _trace_cache
+    if _trace_cache is None and os.environ.get('NU_TRACE_CACHE'):
+        max_bytes = int(os.environ.get('NU_TRACE_CACHE_BYTES', 2**30))
+        _trace_cache = TraceCache(os.environ['NU_TRACE_CACHE'],
+                                  max_bytes=max_bytes)
+    return _trace_cache
+
+
+def set_trace_cache(path, max_bytes=2**30):
+    """Enable the trace cache for this process and its future workers."""
+    global _trace_cache
+    os.environ['NU_TRACE_CACHE'] = path
+    os.environ['NU_TRACE_CACHE_BYTES'] = str(max_bytes)
+    _trace_cache = TraceCache(path, max_bytes=max_bytes)
+    return _trace_cache
+
+
+def scratch_dir():
+    """Directory for per-run scratch files, e.g. writable copies of model
+    files: $NU_SCRATCH_DIR, else /dev/shm (in memory, and private to each
+    node) if available, else the default temporary directory (None)."""
+    path = os.environ.get('NU_SCRATCH_DIR')
+    if path:
+        return path
+    if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK):
+        return '/dev/shm'
+    return None
+
+
+def kernel_digest(kernel):
+    """A digest of the source of the whole module defining a numba kernel.
+
+    The module rather than the kernel alone, as the helper functions the
+    kernel calls (and e.g. constants) are compiled into it too.
+    """
+    module = sys.modules[kernel.py_func.__module__]
+    source = inspect.getsource(module).encode('utf-8')
+    return hashlib.sha1(source).hexdigest()
+
+
+def compiled_kernel(kernel):
+    """The ahead-of-time compiled version of a numba kernel, if the _kernels
+    extension module has been built (see aot.py) from the current source of
+    the kernel's module; else the kernel itself, compiled on first use (and
+    cached on disk by numba)."""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    try:
+        with open(os.path.join(directory, '_kernels.json')) as f:
+            digests = json.load(f)
+        if digests.get(kernel.__name__) != kernel_digest(kernel):
+            return kernel
+        module = importlib.import_module('neuronunit.models.backends._kernels')
+        return getattr(module, kernel.__name__)
+    except (IOError, OSError, ValueError, ImportError, AttributeError):
+        return kernel
@@ -4,7 +4,8 @@ from neo import AnalogSignal
 import neuronunit.capabilities as cap
 import numpy as np
 from neuronunit.models.backends import parse_glif
-from neuronunit.models.backends.base import Backend
+from neuronunit.models.backends.base import Backend, get_trace_cache
+from neuronunit import tracing
 import quantities as qt
 import quantities as pq
 
@@ -176,11 +177,19 @@ class GLIFBackend(Backend):
         """
         self.tstop = float(stop_time.rescale(pq.ms))
 
+    @tracing.traced('simulate', backend='GLIF')
     def inject_square_current(self, current):
         if 'injected_square_current' in current.keys():
             c = current['injected_square_current']
         else:
             c = current
+        cache = get_trace_cache()
+        if cache is not None:
+            key = cache.key('GLIF', self.model.attrs,
+                            getattr(self.model, 'run_params', {}), c)
+            self.vM = cache.get(key)
+            if self.vM is not None:
+                return self.vM
         stop = float(c['delay'])+float(c['duration'])
         start = float(c['delay'])
         duration = float(c['duration'])
@@ -197,4 +206,6 @@ class GLIFBackend(Backend):
 
         vms = AnalogSignal(vm,units = V,sampling_period =  dt * s)
         self.vM = vms
+        if cache is not None:
+            cache.set(key, vms)
         return vms
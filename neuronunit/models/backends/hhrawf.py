@@ -1,7 +1,6 @@
 
 
-from scipy.integrate import odeint
-from numba import jit
+from numba import jit, njit
 import numpy as np
 
 # Set random seed (for reproducibility)
@@ -10,8 +9,8 @@ import numpy as np
 import io
 import math
 import pdb
-from numba import jit
 from .base import *
+from neuronunit import tracing
 import quantities as qt
 from quantities import mV, ms, s
 
@@ -36,33 +35,32 @@ def Id(t,delay,duration,tmax,amplitude):
 # Sodium potential (mV)
 # Leak potential (mV)
 
-@jit
+@njit(cache=True)
 def alpha_m(V):
     """Channel gating kinetics. Functions of membrane voltage"""
     return 0.1*(V+40.0)/(1.0 - np.exp(-(V+40.0) / 10.0))
-@jit
+@njit(cache=True)
 def beta_m(V):
     """Channel gating kinetics. Functions of membrane voltage"""
     return 4.0*np.exp(-(V+65.0) / 18.0)
-@jit
+@njit(cache=True)
 def alpha_h(V):
     """Channel gating kinetics. Functions of membrane voltage"""
     return 0.07*np.exp(-(V+65.0) / 20.0)
-@jit
+@njit(cache=True)
 def beta_h(V):
     """Channel gating kinetics. Functions of membrane voltage"""
     return 1.0/(1.0 + np.exp(-(V+35.0) / 10.0))
-@jit
+@njit(cache=True)
 def alpha_n(V):
     """Channel gating kinetics. Functions of membrane voltage"""
     return 0.01*(V+55.0)/(1.0 - np.exp(-(V+55.0) / 10.0))
-@jit
+@njit(cache=True)
 def beta_n(V):
     """Channel gating kinetics. Functions of membrane voltage"""
     return 0.125*np.exp(-(V+65) / 80.0)
 
 
-@jit
 def dALLdt(X, t, attrs):
     """
     Integrate
@@ -100,31 +98,238 @@ def dALLdt(X, t, attrs):
     return dVdt, dmdt, dhdt, dndt
 
 
-def get_vm(attrs):
+# Voltage grid (mV) of the gating rate lookup tables.
+V_MIN = -150.0
+V_MAX = 100.0
+V_STEP = 0.01
+# Longest integration step (ms); output samples are split into substeps.
+MAX_STEP = 0.01
+
+
+def rate_tables(v_min=V_MIN, v_max=V_MAX, v_step=V_STEP):
+    '''
+    Tabulate the six gating rate functions on a voltage grid.
+    Outputs a (6 x N_voltages) array, with rows alpha_m, beta_m, alpha_h,
+    beta_h, alpha_n, beta_n, for voltages v_min, v_min+v_step, ..., v_max.
+    The 0/0 points of alpha_m and alpha_n are filled in by interpolation.
+    '''
+    V = v_min + v_step*np.arange(int(round((v_max - v_min)/v_step)) + 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Plain numpy, rather than compiling the functions just for this.
+        table = np.array([f.py_func(V) for f in (alpha_m, beta_m, alpha_h,
+                                                 beta_h, alpha_n, beta_n)])
+    for row in table:
+        bad = ~np.isfinite(row)
+        row[bad] = np.interp(V[bad], V[~bad], row[~bad])
+    return table
+
+
+RATE_TABLE = rate_tables()
+
+
+@njit(cache=True)
+def _relax(table, row, j, f, x, dt):
+    """Advance a gating variable with rates in rows row, row+1 of the
+    lookup table by dt, exactly (as its equation is linear for fixed V)."""
+    a = table[row, j] + f*(table[row, j+1] - table[row, j])
+    b = table[row+1, j] + f*(table[row+1, j+1] - table[row+1, j])
+    x_inf = a/(a+b)
+    return x_inf + (x - x_inf)*np.exp(-dt*(a+b))
+
+
+@njit(cache=True)
+def _gates(table, v_min, v_step, V, m, h, n, dt):
+    """Advance the gating variables m, h, n by dt at a fixed voltage V."""
+    x = (V - v_min)/v_step
+    j = min(max(int(np.floor(x)), 0), table.shape[1] - 2)
+    f = min(max(x - j, 0.0), 1.0)
+    return (_relax(table, 0, j, f, m, dt), _relax(table, 2, j, f, h, dt),
+            _relax(table, 4, j, f, n, dt))
+
+
+@njit(cache=True)
+def integrate_population(params, amplitudes, stimulus, Y0, dt, n_sub,
+                         stop_on_spikes, table, v_min, v_step):
+    '''
+    Exponential (Rush-Larsen) integration of N_models HH neurons, with the
+    gating variables staggered half a step from the voltage, which makes it
+    second order accurate.
+    params: (N_models x N_params), columns ordered as in PARAM_NAMES.
+    amplitudes: injected current of each model (uA/cm^2), scaled by
+    stimulus, the unit current during every integration step.
+    Y0: initial (V, m, h, n).  Every n_sub steps of dt is one output sample.
+    stop_on_spikes: if > 0, stop at the first output sample by which every
+    model has fired that many spikes.
+    Rates are linearly interpolated in the lookup table of rate_tables.
+    Outputs: an (N_models x N_samples) voltage matrix in mV.
+    '''
+    n_models = params.shape[0]
+    n_out = stimulus.shape[0]//n_sub + 1
+    vm = np.empty((n_models, n_out))
+    V = np.full(n_models, Y0[0])
+    m = np.empty(n_models)
+    h = np.empty(n_models)
+    n = np.empty(n_models)
+    for i in range(n_models):
+        m[i], h[i], n[i] = _gates(table, v_min, v_step,
+                                  Y0[0], Y0[1], Y0[2], Y0[3], dt/2)
+    vm[:, 0] = V
+    n_spikes = np.zeros(n_models, dtype=np.int64)
+    for k in range(1, n_out):
+        for step in range((k-1)*n_sub, k*n_sub):
+            I = stimulus[step]
+            for i in range(n_models):
+                C_m, E_L, E_K, E_Na, g_K, g_Na, g_L = params[i]
+                # For fixed conductances, V relaxes exponentially towards
+                # the conductance weighted mean of the reversal potentials.
+                G_Na = g_Na * m[i]**3 * h[i]
+                G_K = g_K * n[i]**4
+                G = G_Na + G_K + g_L
+                E = (G_Na*E_Na + G_K*E_K + g_L*E_L + amplitudes[i]*I)/G
+                V[i] = E + (V[i] - E)*np.exp(-dt*G/C_m)
+                m[i], h[i], n[i] = _gates(table, v_min, v_step,
+                                          V[i], m[i], h[i], n[i], dt)
+        vm[:, k] = V
+        if stop_on_spikes > 0:
+            done = True
+            for i in range(n_models):
+                if vm[i, k] > 0.0 and vm[i, k-1] <= 0.0:
+                    n_spikes[i] += 1
+                if n_spikes[i] < stop_on_spikes:
+                    done = False
+            if done:
+                return vm[:, :k+1]
+    return vm
+
+
+def integrate(params, amplitudes, T, delay, duration, stop_on_spikes=None):
+    '''
+    Simulate models with parameters params (see attrs_to_params) receiving
+    the square pulses amplitudes*Id(t, delay, duration, ...), sampled at the
+    evenly spaced times T (starting at 0).
+    Outputs: an (N_models x N_samples) voltage matrix in mV.
+    '''
+    dt_out = T[1] - T[0]
+    n_sub = int(np.ceil(dt_out/MAX_STEP - 1e-9))
+    dt = dt_out/n_sub
+    t = dt*np.arange((len(T) - 1)*n_sub)
+    stimulus = ((t > delay) & (t < delay + duration)).astype(float)
+    return _integrate_population(np.ascontiguousarray(params, dtype=float),
+                                np.asarray(amplitudes, dtype=float),
+                                stimulus, np.array([-65.0, 0.05, 0.6, 0.32]),
+                                dt, n_sub, int(stop_on_spikes or 0),
+                                RATE_TABLE, V_MIN, V_STEP)
+
+
+# The ahead-of-time compiled kernel, where built (see aot.py).
+_integrate_population = compiled_kernel(integrate_population)
+
+
+def get_vm(attrs, stop_on_spikes=None):
     '''
     dt determined by
     Apply Hodgkin Huxley equation corresponding to point as model
     This function can't get too pythonic (functional), it needs to be a simple loop for
     numba/jit to understand it.
+    stop_on_spikes: see integrate_population.
     '''
-    # State (Vm, n, m, h)
-    # saturation value
-    #vr = attrs['vr']
-    Y = [-65.0, 0.05, 0.6, 0.32]
-    # Solve ODE system
+    # State (Vm, n, m, h) starts at [-65.0, 0.05, 0.6, 0.32], see integrate.
     T = attrs['T']
     dt = attrs['dt']
-    Vy = odeint(dALLdt, Y, T, args=(attrs,))
-
-    volts = [ v[0] for v in Vy ]
+    delay,duration,tmax,amplitude = attrs['I']
+    volts = integrate(attrs_to_params([attrs]), [amplitude], T, delay,
+                      duration, stop_on_spikes=stop_on_spikes)[0]
     vm = AnalogSignal(volts,
                  units = mV,
                  sampling_period = dt * ms)
     return vm
 
 
+# Column order of the parameter matrix consumed by simulate_population.
+PARAM_NAMES = ('C_m', 'E_L', 'E_K', 'E_Na', 'g_K', 'g_Na', 'g_L')
+PARAM_DEFAULTS = {'g_K': 36.0, 'g_Na': 120.0, 'g_L': 0.3, 'C_m': 1.0,
+                  'E_L': -54.387, 'E_K': -77.0, 'E_Na': 50.0}
+
+
+def attrs_to_params(attrs_list):
+    '''
+    Pack a list of model attribute dictionaries into an
+    (N_models x N_params) array, with columns ordered as in PARAM_NAMES.
+    '''
+    params = np.empty((len(attrs_list), len(PARAM_NAMES)))
+    for i, attrs in enumerate(attrs_list):
+        for j, name in enumerate(PARAM_NAMES):
+            params[i, j] = float(attrs.get(name, PARAM_DEFAULTS[name]))
+    return params
+
+
+def dALLdt_population(X, t, params, amplitudes, I):
+    """
+    Vectorized counterpart of dALLdt, for N_models stacked into one state
+    vector X = [V_0..V_n, m_0..m_n, h_0..h_n, n_0..n_n].
+    Model i receives amplitudes[i] during the pulse described by I.
+    """
+    n_models = len(amplitudes)
+    V = X[0:n_models]
+    m = X[n_models:2*n_models]
+    h = X[2*n_models:3*n_models]
+    n = X[3*n_models:4*n_models]
+    C_m, E_L, E_K, E_Na, g_K, g_Na, g_L = params.T
+    delay,duration,T = I
+    Iext = amplitudes * Id(t,delay,duration,T,1.0)
+
+    I_Na = g_Na * m**3 * h * (V - E_Na)
+    I_K = g_K  * n**4 * (V - E_K)
+    I_L = g_L * (V - E_L)
+
+    dVdt = (Iext - I_Na - I_K - I_L) / C_m
+    dmdt = alpha_m(V)*(1.0-m) - beta_m(V)*m
+    dhdt = alpha_h(V)*(1.0-h) - beta_h(V)*h
+    dndt = alpha_n(V)*(1.0-n) - beta_n(V)*n
+    return np.concatenate((dVdt, dmdt, dhdt, dndt))
+
+
+@tracing.traced(backend='HH')
+def simulate_population(attrs_list, current, amplitudes=None,
+                        stop_on_spikes=None):
+    '''
+    Population level counterpart of HHBackend.inject_square_current.
+    Every model (and every amplitude) is integrated in a single call of
+    the compiled integrator.
+    stop_on_spikes, as the run parameter of the same name, ends the
+    simulation once every model has fired that many spikes.
+    Outputs: an (N_models x T) voltage matrix in mV.
+    '''
+    if 'injected_square_current' in current.keys():
+        c = current['injected_square_current']
+    else:
+        c = current
+    duration = float(c['duration'])
+    delay = float(c['delay'])
+    tmax = delay + duration + 200.0
+    T = np.linspace(0.0, tmax, 10000)
+    if amplitudes is None:
+        amplitudes = [float(c['amplitude'])]*len(attrs_list)
+    amplitudes = np.array([float(x) for x in amplitudes])
+    params = attrs_to_params(attrs_list)
+    return integrate(params, amplitudes, T, delay, duration,
+                     stop_on_spikes=stop_on_spikes)
+
+
+def warm_up():
+    '''
+    Compile the kernels of this backend (or load them from numba's cache),
+    e.g. when a worker process starts, so that its first simulation is as
+    fast as the others.
+    '''
+    integrate(attrs_to_params([PARAM_DEFAULTS]), [0.0],
+              np.linspace(0.0, 1.0, 3), 0.0, 1.0)
+
+
 class HHBackend(Backend):
 
+    simulate_population = staticmethod(simulate_population)
+
     def init_backend(self, attrs = None, cell_name = 'alice', current_src_name = 'hannah', DTC = None):
         backend = 'HH'
         super(HHBackend,self).init_backend()
@@ -182,6 +387,7 @@ class HHBackend(Backend):
         return results
 
 
+    @tracing.traced('simulate', backend='HH')
     def inject_square_current(self, current):#, section = None, debug=False):
         """Inputs: current : a dictionary with exactly three items, whose keys are: 'amplitude', 'delay', 'duration'
         Example: current = {'amplitude':float*pq.pA, 'delay':float*pq.ms, 'duration':float*pq.ms}}
@@ -195,6 +401,13 @@ class HHBackend(Backend):
             c = current['injected_square_current']
         else:
             c = current
+        cache = get_trace_cache()
+        if cache is not None:
+            key = cache.key('HH', self.model.attrs,
+                            getattr(self.model, 'run_params', {}), c)
+            self.vM = cache.get(key)
+            if self.vM is not None:
+                return self.vM
         amplitude = float(c['amplitude'])
         duration = float(c['duration'])#/dt#/dt.rescale('ms')
         delay = float(c['delay'])#/dt#.rescale('ms')
@@ -212,5 +425,10 @@ class HHBackend(Backend):
         #print(attrs['C_m'])
         #print(attrs.keys())
 
-        self.vM  = get_vm(attrs)
+        # Opt-in early termination, e.g. model.set_run_params(stop_on_spikes=1)
+        # when only the presence of spikes matters.
+        stop_on_spikes = getattr(self.model, 'run_params', {}).get('stop_on_spikes')
+        self.vM  = get_vm(attrs, stop_on_spikes=stop_on_spikes)
+        if cache is not None:
+            cache.set(key, self.vM)
         return self.vM
@@ -2,12 +2,208 @@
 
 import os
 import io
+import atexit
+import queue
+import shutil
+import subprocess
 import tempfile
+import threading
+from datetime import datetime
 
 from pyneuroml import pynml
 
 from sciunit.utils import redirect_stdout
-from .base import Backend
+from .base import Backend, scratch_dir
+from neuronunit import tracing
+
+# A minimal jNeuroML server: reads the path of one LEMS file per line from
+# stdin, runs it (writing its output files to the working directory, as
+# `jnml <file> -nogui` would), and answers OK or ERROR on stdout.  Launched as
+# a single-file source program (Java 11+), with the jNeuroML jar on the
+# class path, so that one JVM serves many simulations.
+SERVER_SOURCE = """
+import java.io.*;
+import org.lemsml.jlems.core.sim.Sim;
+import org.neuroml.export.utils.Utils;
+
+public class JNeuroMLServer {
+    public static void main(String[] args) throws Exception {
+        try {
+            Class.forName("org.lemsml.jlems.io.out.FileResultWriterFactory")
+                 .getMethod("initialize").invoke(null);
+        } catch (Exception e) {
+        }
+        BufferedReader in = new BufferedReader(
+            new InputStreamReader(System.in));
+        PrintStream out = System.out;
+        System.setOut(System.err);
+        String line;
+        while ((line = in.readLine()) != null) {
+            try {
+                Sim sim = Utils.readLemsNeuroMLFile(
+                    new File(line).getAbsoluteFile());
+                sim.build();
+                sim.run();
+                out.println("OK");
+            } catch (Throwable e) {
+                out.println("ERROR " + e.toString().replace('\\n', ' '));
+            }
+            out.flush();
+        }
+    }
+}
+"""
+
+
+class JNeuroMLWorker(object):
+    """One long-lived JVM running JNeuroMLServer, in its own directory.
+
+    A simulation not answered within timeout seconds is taken to have
+    stalled, and the JVM is killed.
+    """
+
+    def __init__(self, max_memory='400M', timeout=600):
+        self.timeout = timeout
+        self.dir = tempfile.mkdtemp(prefix='jnml_', dir=scratch_dir())
+        source = os.path.join(self.dir, 'JNeuroMLServer.java')
+        with open(source, 'w') as f:
+            f.write(SERVER_SOURCE)
+        jar_path = pynml.get_path_to_jnml_jar()
+        self.process = subprocess.Popen(
+            ['java', '-Xmx%s' % max_memory, '-Djava.awt.headless=true',
+             '-cp', jar_path, source],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, cwd=self.dir,
+            universal_newlines=True)
+        # Replies are read by a thread, so that waiting for one can time out.
+        self.replies = queue.Queue()
+        reader = threading.Thread(target=self._read_replies)
+        reader.daemon = True
+        reader.start()
+
+    def _read_replies(self):
+        for line in self.process.stdout:
+            self.replies.put(line.strip())
+        self.replies.put(None)  # The JVM exited.
+
+    @property
+    def alive(self):
+        return self.process.poll() is None
+
+    def run(self, lems_file_path):
+        """Run a LEMS file, and return its recorded traces.
+
+        Output files are read back, and removed, right away.
+        """
+        t_run = datetime.now()
+        self.process.stdin.write(os.path.abspath(lems_file_path) + '\n')
+        self.process.stdin.flush()
+        try:
+            reply = self.replies.get(timeout=self.timeout)
+        except queue.Empty:
+            self.process.kill()
+            raise RuntimeError("jNeuroML server did not reply on %s within "
+                               "%s s" % (lems_file_path, self.timeout))
+        if reply != 'OK':
+            raise RuntimeError("jNeuroML server failed on %s: %s" %
+                               (lems_file_path, reply or 'no reply'))
+        return pynml.reload_saved_data(lems_file_path, base_dir=self.dir,
+                                       t_run=t_run, plot=False,
+                                       simulator='jNeuroML',
+                                       remove_dat_files_after_load=True)
+
+    def close(self):
+        if self.alive:
+            self.process.stdin.close()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class JNeuroMLPool(object):
+    """A bounded pool of long-lived jNeuroML JVMs.
+
+    Starting a JVM takes about a second, often longer than the simulation
+    itself, so workers are started on demand (at most size of them) and
+    then reused; a caller waits when all of them are busy.  Workers that
+    fail are discarded, and their directories removed.  If no simulation
+    has succeeded yet when one fails, the server evidently cannot work here
+    (e.g. no Java 11+) and the pool disables itself.
+    """
+
+    def __init__(self, size=1, max_memory='400M', timeout=600):
+        self.size = size or 1
+        self.max_memory = max_memory
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+        self.workers = []
+        self.lock = threading.Lock()
+        self.n_runs = 0
+        self.disabled = False
+
+    def _acquire(self):
+        with self.lock:
+            if self.idle.empty() and len(self.workers) < self.size:
+                worker = JNeuroMLWorker(max_memory=self.max_memory,
+                                        timeout=self.timeout)
+                self.workers.append(worker)
+                return worker
+        return self.idle.get()
+
+    def _discard(self, worker):
+        worker.close()
+        with self.lock:
+            self.workers.remove(worker)
+
+    def run(self, lems_file_path):
+        """Run a LEMS file on the next free worker, and return its traces."""
+        worker = self._acquire()
+        try:
+            results = worker.run(lems_file_path)
+        except Exception:
+            self._discard(worker)
+            if not self.n_runs:
+                self.disabled = True
+            raise
+        self.n_runs += 1
+        self.idle.put(worker)
+        return results
+
+    def close(self):
+        """Stop every worker."""
+        with self.lock:
+            workers, self.workers = self.workers, []
+        for worker in workers:
+            worker.close()
+        self.idle = queue.LifoQueue()
+
+
+_pool = None
+
+
+def get_jnml_pool():
+    """Get the jNeuroML worker pool of this process, or None if disabled.
+
+    The pool is opt-in: its size is $NU_JNML_POOL_SIZE, by default 0, which
+    disables it (every simulation then runs its own jnml process).  Each
+    worker is a JVM of up to 400 MB, and every process (e.g. every dask
+    worker) has a pool of its own, so 1 is usually enough.  A missing `java`
+    executable, or a server that cannot run (see JNeuroMLPool), disables it
+    too.  Simulations not answered within $NU_JNML_TIMEOUT seconds (default
+    600) are given up, and their JVM killed.
+    """
+    global _pool
+    if _pool is None:
+        size = int(os.environ.get('NU_JNML_POOL_SIZE', 0))
+        if size <= 0 or shutil.which('java') is None:
+            return None
+        _pool = JNeuroMLPool(size=size,
+                             timeout=float(os.environ.get('NU_JNML_TIMEOUT',
+                                                          600)))
+        atexit.register(_pool.close)
+    return None if _pool.disabled else _pool
 
 
 class jNeuroMLBackend(Backend):
@@ -47,19 +243,29 @@ class jNeuroMLBackend(Backend):
         self.model.run_params['dt'] = dt
         self.set_run_params()
 
+    @tracing.traced('simulate', backend='jNeuroML')
     def _backend_run(self):
         """Run the simulation."""
+        self.model.write_lems_files()
+        pool = None if self.model.skip_run else get_jnml_pool()
+        if pool is not None:
+            try:
+                return pool.run(self.model.lems_file_path)
+            except Exception as e:
+                # Run one jnml process for this simulation instead, as
+                # before, e.g. to report its errors.
+                print("jNeuroML server failed (%s), running jnml" % e)
         f = pynml.run_lems_with_jneuroml
-        self.exec_in_dir = tempfile.mkdtemp()
         lems_path = os.path.dirname(self.model.orig_lems_file_path)
-        with redirect_stdout(self.stdout):
+        with tempfile.TemporaryDirectory(dir=scratch_dir()) as exec_in_dir, \
+                redirect_stdout(self.stdout):
             results = f(self.model.lems_file_path,
                         paths_to_include=[lems_path],
                         skip_run=self.model.skip_run,
                         nogui=self.model.run_params['nogui'],
                         load_saved_data=True,
                         plot=False,
-                        exec_in_dir=self.exec_in_dir,
+                        exec_in_dir=exec_in_dir,
                         exit_on_fail=False,
                         verbose=self.model.run_params['v'])
         if results is None or not results:
@@ -1,12 +1,226 @@
 import io
 import math
 import pdb
+import shutil
 from numba import jit
 
+import numpy as np
+from neo.core import IrregularlySampledSignal
+
 from sciunit.utils import redirect_stdout
-from .base import os, copy, subprocess
-from .base import pq, AnalogSignal, NEURON_SUPPORT, neuron, h, pynml
+from .base import os, copy, subprocess, tempfile, hashlib, platform
+from .base import pq, AnalogSignal, NEURON_SUPPORT, pynml
 from .base import Backend, BackendException, import_module_from_path
+from neuronunit import tracing
+
+if NEURON_SUPPORT:
+    import neuron
+    from neuron import h
+else:
+    neuron = None
+    h = None
+
+
+def hoc_vector_to_numpy(vector):
+    """View a hoc Vector as a numpy array, without copying when possible.
+
+    Vector.as_numpy() shares the Vector's memory, so the result is only valid
+    until the Vector is resized or freed, copy it to keep it longer.
+    Older NEURON versions, without as_numpy(), get a copy instead.
+    """
+    try:
+        return vector.as_numpy()
+    except AttributeError:
+        return np.array(vector.to_python())
+
+
+def resample(times, values, dt):
+    """Linearly interpolate a variable time step trace onto a fixed grid.
+
+    The grid starts at times[0] and has a sample every dt, up to and
+    including times[-1].
+    """
+    n_samples = int(np.floor((times[-1] - times[0]) / dt + 1e-9)) + 1
+    fixed_times = times[0] + dt * np.arange(n_samples)
+    return np.interp(fixed_times, times, values)
+
+
+def mechanism_dirs(directory):
+    """Names of the subdirectories of directory holding mechanisms compiled
+    by nrnivmodl, one per architecture (e.g. x86_64)."""
+    names = set()
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        for lib_dir in (path, os.path.join(path, '.libs')):
+            if os.path.isdir(lib_dir) and \
+                    any(x.startswith('libnrnmech') for x in os.listdir(lib_dir)):
+                names.add(name)
+    return names
+
+
+class NEURONArtifactCache(object):
+    """A shared store of LEMS->NEURON conversions and compiled mechanisms.
+
+    Converting a LEMS model with jNeuroML and compiling its mod files with
+    nrnivmodl takes long, and was repeated by every worker and every run.
+    Here the results are keyed on the content of the LEMS file and of every
+    NML file it includes, and on the NEURON version, and stored once per
+    key: generated files (_nrn.py, .mod, .hoc) are copied into a model's
+    directory, compiled mechanism directories (e.g. x86_64/) are symlinked.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(path):
+            os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def neuron_version():
+        return getattr(neuron, '__version__', 'none')
+
+    def key(self, file_paths, version=None):
+        """Get the key of a conversion of the given model files."""
+        if version is None:
+            version = self.neuron_version()
+        digest = hashlib.sha224()
+        digest.update(('%s %s' % (version, platform.machine())).encode())
+        for file_path in file_paths:
+            digest.update(os.path.basename(file_path).encode())
+            with open(file_path, 'rb') as f:
+                digest.update(hashlib.sha224(f.read()).digest())
+        return digest.hexdigest()
+
+    def _dir(self, key):
+        return os.path.join(self.path, key)
+
+    def __contains__(self, key):
+        return os.path.isdir(self._dir(key))
+
+    def restore(self, key, model_dir):
+        """Put the artifacts stored under key into model_dir.
+
+        Returns False, and changes nothing, if there are none.
+        """
+        if not self.install(key, model_dir):
+            self.misses += 1
+            return False
+        self.hits += 1
+        return True
+
+    def install(self, key, model_dir):
+        """Put the artifacts stored under key into model_dir, like restore()
+        but without counting a hit or miss."""
+        entry = self._dir(key)
+        if not os.path.isdir(entry):
+            return False
+        for name in os.listdir(entry):
+            source = os.path.join(entry, name)
+            target = os.path.join(model_dir, name)
+            if os.path.isdir(source):
+                if os.path.realpath(target) == os.path.realpath(source):
+                    continue
+                if os.path.islink(target) or os.path.isfile(target):
+                    os.remove(target)
+                elif os.path.isdir(target):
+                    shutil.rmtree(target)
+                try:
+                    os.symlink(source, target)
+                except FileExistsError:  # Linked by another process.
+                    pass
+            else:
+                fd, tmp_path = tempfile.mkstemp(dir=model_dir, suffix='.tmp')
+                os.close(fd)
+                shutil.copy2(source, tmp_path)
+                os.replace(tmp_path, target)
+        return True
+
+    def build(self, key, file_paths, model_dir, generate):
+        """Generate the artifacts of the model files file_paths (the LEMS
+        file first) with generate(lems_file_path, directory), and store them
+        under key.
+
+        generate runs in a fresh directory holding copies of the model files
+        only (at their paths relative to model_dir), and exactly what it
+        writes there is stored, never files written to the shared model_dir
+        by other models or processes.  Returns whether key is stored.
+        """
+        build_dir = tempfile.mkdtemp(dir=self.path, suffix='.build')
+        try:
+            copies, inputs = [], set()
+            for file_path in file_paths:
+                name = os.path.relpath(file_path, model_dir)
+                if name.startswith(os.pardir):
+                    name = os.path.basename(file_path)
+                copy = os.path.join(build_dir, name)
+                os.makedirs(os.path.dirname(copy), exist_ok=True)
+                shutil.copy2(file_path, copy)
+                copies.append(copy)
+                inputs.add(name.split(os.sep)[0])
+            generate(copies[0], build_dir)
+            generated = set(os.listdir(build_dir)) - inputs
+            if generated:
+                self.store(key, build_dir, generated)
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+        return key in self
+
+    def store(self, key, directory, names):
+        """Store the named files and directories of directory under key."""
+        if key in self:
+            return
+        tmp_dir = tempfile.mkdtemp(dir=self.path, suffix='.tmp')
+        for name in names:
+            source = os.path.join(directory, name)
+            if os.path.isdir(source):
+                shutil.copytree(source, os.path.join(tmp_dir, name),
+                                symlinks=True)
+            elif os.path.isfile(source):
+                shutil.copy2(source, tmp_dir)
+        try:
+            # Atomic, so other processes never see a partial entry.
+            os.rename(tmp_dir, self._dir(key))
+        except OSError:  # Stored by another process meanwhile.
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def clear(self):
+        """Remove every entry from the cache."""
+        for name in os.listdir(self.path):
+            shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    @property
+    def stats(self):
+        """Hit and miss counters for this process."""
+        return {'hits': self.hits, 'misses': self.misses}
+
+
+_artifact_cache = None
+
+
+def get_artifact_cache():
+    """Get the LEMS->NEURON artifact cache shared by this process.
+
+    It lives in the directory named by the NU_NEURON_CACHE environment
+    variable, which worker processes inherit, or in
+    ~/.cache/neuronunit/neuron by default. Set NU_NEURON_CACHE to an empty
+    string to disable it.
+    """
+    global _artifact_cache
+    path = os.environ.get('NU_NEURON_CACHE',
+                          os.path.join(os.path.expanduser('~'), '.cache',
+                                       'neuronunit', 'neuron'))
+    if not path:
+        return None
+    if _artifact_cache is None or _artifact_cache.path != path:
+        _artifact_cache = NEURONArtifactCache(path)
+    return _artifact_cache
+
+
+def set_artifact_cache(path):
+    """Use the artifact cache in path for this process and its workers."""
+    os.environ['NU_NEURON_CACHE'] = path
+    return get_artifact_cache()
 
 
 class NEURONBackend(Backend):
@@ -139,20 +353,28 @@ class NEURONBackend(Backend):
             self.cvode = self.h.CVode()
             self.cvode.active(1 if method == "variable" else 0)
 
-    def get_membrane_potential(self):
+    def get_membrane_potential(self, fixed_step=True):
         """Get a membrane potential traces from the simulation.
 
         Must destroy the hoc vectors that comprise it.
 
+        Args:
+            fixed_step (bool): if False, and the variable time step method
+                is active, return the trace at the time points CVODE chose,
+                rather than resampling it.
+
         Returns:
-            neo.core.AnalogSignal: the membrane potential trace
+            neo.core.AnalogSignal: the membrane potential trace, or a
+                neo.core.IrregularlySampledSignal (see fixed_step)
         """
         if self.h.cvode.active() == 0:
             dt = float(copy.copy(self.h.dt))
-            fixed_signal = copy.copy(self.h.vVector.to_python())
+            fixed_signal = np.array(hoc_vector_to_numpy(self.h.vVector))
+        elif not fixed_step:
+            return self.get_variable_step_signal()
         else:
             dt = float(copy.copy(self.fixedTimeStep))
-            fixed_signal = copy.copy(self.get_variable_step_analog_signal())
+            fixed_signal = self.get_variable_step_analog_signal()
 
         self.h.dt = dt
         self.fixedTimeStep = float(1.0/dt)
@@ -160,53 +382,22 @@ class NEURONBackend(Backend):
                             units=pq.mV,
                             sampling_period=dt*pq.ms)
 
+    def get_variable_step_signal(self):
+        """Get the variable dt trace as recorded, without interpolation."""
+        times = np.array(hoc_vector_to_numpy(self.tVector))
+        potentials = np.array(hoc_vector_to_numpy(self.vVector))
+        return IrregularlySampledSignal(times*pq.ms, potentials,
+                                        units=pq.mV)
+
     def get_variable_step_analog_signal(self):
         """Convert variable dt array values to fixed dt array.
 
-        Uses linear interpolation.
+        Uses linear interpolation, over all samples at once.
         """
-        # Fixed dt potential
-        fPots = []
-        fDt = self.fixedTimeStep
-        # Variable dt potential
-        vPots = self.vVector.to_python()
-        # Variable dt times
-        vTimes = self.tVector.to_python()
-        duration = vTimes[len(vTimes)-1]
-        # Fixed and Variable dt times
-        fTime = vTime = vTimes[0]
-        # Index of variable dt time array
-        vIndex = 0
-        # Advance the fixed dt position
-        while fTime <= duration:
-
-            # If v and f times are exact, no interpolation needed
-            if fTime == vTime:
-                fPots.append(vPots[vIndex])
-
-            # Interpolate between the two nearest vdt times
-            else:
-
-                # Increment vdt time until it surpases the fdt time
-                while fTime > vTime and vIndex < len(vTimes):
-                    vIndex += 1
-                    vTime = vTimes[vIndex]
-
-                # Once surpassed, use the new vdt time and t-1
-                # for interpolation
-                vIndexMinus1 = max(0, vIndex-1)
-                vTimeMinus1 = vTimes[vIndexMinus1]
-
-                fPot = self.linearInterpolate(vTimeMinus1, vTime,
-                                              vPots[vIndexMinus1],
-                                              vPots[vIndex], fTime)
-
-                fPots.append(fPot)
-
-            # Go to the next fdt time step
-            fTime += fDt
-
-        return fPots
+        # Variable dt times and potentials, viewed in place.
+        vTimes = hoc_vector_to_numpy(self.tVector)
+        vPots = hoc_vector_to_numpy(self.vVector)
+        return resample(vTimes, vPots, self.fixedTimeStep)
 
     def linearInterpolate(self, tStart, tEnd, vStart, vEnd, tTarget):
         """Perform linear interpolation."""
@@ -231,6 +422,24 @@ class NEURONBackend(Backend):
         with redirect_stdout(self.stdout):
             neuron.load_mechanisms(self.neuron_model_dir)
 
+    def generate_neuron_files(self, lems_file_path, directory, verbose=True):
+        """Convert a LEMS model to NEURON (_nrn.py, .mod and .hoc files) in
+        directory, and compile its mechanisms there with nrnivmodl."""
+        pynml.run_lems_with_jneuroml_neuron(
+            lems_file_path,
+            skip_run=False,
+            nogui=True,
+            load_saved_data=False,
+            only_generate_scripts=True,
+            plot=False,
+            show_plot_already=False,
+            exec_in_dir=directory,
+            verbose=verbose,
+            exit_on_fail=False)
+        nrnivmodl_flags = []
+        subprocess.run(["cd %s; nrnivmodl" % directory] + nrnivmodl_flags,
+                       shell=True)
+
     def load_model(self, verbose=True):
         """Load a NEURON model.
 
@@ -249,26 +458,25 @@ class NEURONBackend(Backend):
         NEURON_file_path = '{0}_nrn.py'.format(base_name)
         self.neuron_model_dir = os.path.dirname(self.model.orig_lems_file_path)
         assert os.path.isdir(self.neuron_model_dir)
-        if not os.path.exists(NEURON_file_path):
-            pynml.run_lems_with_jneuroml_neuron(
-                self.model.orig_lems_file_path,
-                skip_run=False,
-                nogui=True,
-                load_saved_data=False,
-                only_generate_scripts=True,
-                plot=False,
-                show_plot_already=False,
-                exec_in_dir=self.neuron_model_dir,
-                verbose=verbose,
-                exit_on_fail=False)
-            # use a different process to call NEURONS compiler nrnivmodl in the
-            # background if the NEURON_file_path does not yet exist.
-            nrnivmodl_flags = []
-            subprocess.run(["cd %s; nrnivmodl" % self.neuron_model_dir] +
-                           nrnivmodl_flags,
-                           shell=True)
-            print(os.environ['NEURON_HOME'])
-            print(self.neuron_model_dir)
+        cache = get_artifact_cache()
+        key = None
+        if cache is not None:
+            key = cache.key([self.model.orig_lems_file_path] +
+                            self.model.get_nml_paths(original=True))
+        if key is not None and cache.restore(key, self.neuron_model_dir):
+            # Converted and compiled before, by this or another process.
+            self.load_mechanisms()
+        elif key is not None:
+            generate = lambda lems_file_path, directory: \
+                self.generate_neuron_files(lems_file_path, directory, verbose)
+            if cache.build(key, [self.model.orig_lems_file_path] +
+                           self.model.get_nml_paths(original=True),
+                           self.neuron_model_dir, generate):
+                cache.install(key, self.neuron_model_dir)
+            self.load_mechanisms()
+        elif not os.path.exists(NEURON_file_path):
+            self.generate_neuron_files(self.model.orig_lems_file_path,
+                                       self.neuron_model_dir, verbose)
             self.load_mechanisms()
         elif os.path.realpath(os.getcwd()) != \
                 os.path.realpath(self.neuron_model_dir):
@@ -432,17 +640,50 @@ class NEURONBackend(Backend):
         if debug:
             self.neuron.h.psection()
 
+        # Opt-in early termination, e.g. model.set_run_params(stop_on_spikes=1)
+        # when only the presence of spikes matters.
+        self.set_stop_on_spikes(getattr(self.model, 'run_params', {})
+                                .get('stop_on_spikes'))
         self._backend_run()
 
+    def set_stop_on_spikes(self, n_spikes=None):
+        """Stop the next run once the soma has fired n_spikes spikes.
+
+        A NetCon watches the somatic membrane potential, and counts its
+        upward crossings of 0 mV (the default spike threshold of neuronunit),
+        when the count reaches n_spikes, it sets stoprun, so that run()
+        returns, and the recorded vectors end, at that spike.
+
+        Args:
+            n_spikes (int): number of spikes to stop at,
+                None or 0 to run the full protocol.
+        """
+        self.spike_watcher = None
+        if not n_spikes:
+            return
+        h = self.h
+        soma = h.RS_pop[0]
+        netcon = h.NetCon(soma(0.5)._ref_v, None, sec=soma)
+        netcon.threshold = 0.0
+        n_fired = [0]
+
+        def on_spike():
+            n_fired[0] += 1
+            if n_fired[0] >= n_spikes:
+                h.stoprun = 1
+
+        netcon.record(on_spike)
+        # Keep references, NEURON drops unreferenced NetCons.
+        self.spike_watcher = (netcon, on_spike)
+
+    @tracing.traced('simulate', backend='NEURON')
     def _backend_run(self):
         self.h('run()')
         results = {}
         # Prepare NEURON vectors for quantities/sciunit
         # By rescaling voltage to milli volts, and time to milli seconds.
-        results['vm'] = [float(x/1000.0) for x in
-                         copy.copy(self.neuron.h.v_v_of0.to_python())]
-        results['t'] = [float(x/1000.0) for x in
-                        copy.copy(self.neuron.h.v_time.to_python())]
+        results['vm'] = hoc_vector_to_numpy(self.neuron.h.v_v_of0)/1000.0
+        results['t'] = hoc_vector_to_numpy(self.neuron.h.v_time)/1000.0
         results['run_number'] = results.get('run_number', 0) + 1
 
         return results
@@ -1,9 +1,10 @@
 import io
 import math
 import pdb
-from numba import jit
+from numba import jit, njit
 import numpy as np
 from .base import *
+from neuronunit import tracing
 import quantities as qt
 from quantities import mV, ms, s
 #import matplotlib.pyplot as plt
@@ -17,18 +18,18 @@ hc['vr'] = -65.2261863636364
 hc['vPeak'] = hc['vr'] + 86.364525297619
 hc['C'] = 89.7960714285714
 
-@jit
-def get_vm(C=89.7960714285714, a=0.01, b=15, c=-60, d=10, k=1.6, vPeak=(86.364525297619-65.2261863636364), vr=-65.2261863636364, vt=-50, dt=0.030, Iext=[]):
+@njit(cache=True)
+def izhikevich(C, a, b, c, d, k, vPeak, vr, vt, dt, Iext, stop_on_spikes):
     '''
-    dt determined by
-    Apply izhikevich equation as model
-    This function can't get too pythonic (functional), it needs to be a simple loop for
-    numba/jit to understand it.
+    The numerical kernel of get_vm: integrate the izhikevich equation for
+    the stimulus Iext (a float array).  Outputs the voltage array, in the
+    same scale as get_vm.
     '''
     N = len(Iext)
     v = np.zeros(N)
     u = np.zeros(N)
     v[0] = vr
+    spikes = 0
     for m in range(0,N-1):
         vT = v[m]+ (dt/2) * (k*(v[m] - vr)*(v[m] - vt)-u[m] + Iext[m])/C;
         v[m+1] = vT + (dt/2)  * (k*(v[m] - vr)*(v[m] - vt)-u[m] + Iext[m])/C;
@@ -38,15 +39,175 @@ def get_vm(C=89.7960714285714, a=0.01, b=15, c=-60, d=10, k=1.6, vPeak=(86.36452
             v[m] = vPeak;# % padding the spike amplitude
             v[m+1] = c;# % membrane voltage reset
             u[m+1] = u[m+1] + d;# % recovery variable update
-    v = np.divide(v, 1000.0)
+            spikes += 1
+            if stop_on_spikes and spikes >= stop_on_spikes:
+                v = v[:m+2]
+                break
+    return np.divide(v, 1000.0)
+
+
+def get_vm(C=89.7960714285714, a=0.01, b=15, c=-60, d=10, k=1.6, vPeak=(86.364525297619-65.2261863636364), vr=-65.2261863636364, vt=-50, dt=0.030, Iext=[], stop_on_spikes=0):
+    '''
+    dt determined by
+    Apply izhikevich equation as model
+    The integration itself is done by the compiled izhikevich kernel,
+    which only takes floats and arrays.
+    If stop_on_spikes is non zero, integration stops (and the trace ends)
+    on the reset that follows that many spikes.
+    '''
+    v = _izhikevich(float(C), float(a), float(b), float(c), float(d),
+                   float(k), float(vPeak), float(vr), float(vt), float(dt),
+                   np.asarray(Iext, dtype=float), int(stop_on_spikes or 0))
     vm = AnalogSignal(v,
                  units = mV,
                  sampling_period = dt * ms)
     return vm
 
+# Column order of the parameter matrix consumed by get_vm_population.
+PARAM_NAMES = ('C', 'a', 'b', 'c', 'd', 'k', 'vPeak', 'vr', 'vt')
+PARAM_DEFAULTS = {'C': 89.7960714285714, 'a': 0.01, 'b': 15, 'c': -60,
+                  'd': 10, 'k': 1.6,
+                  'vPeak': (86.364525297619-65.2261863636364),
+                  'vr': -65.2261863636364, 'vt': -50}
+
+
+def attrs_to_params(attrs_list):
+    '''
+    Pack a list of model attribute dictionaries into an
+    (N_models x N_params) array, with columns ordered as in PARAM_NAMES.
+    Missing attributes fall back to the get_vm defaults.
+    '''
+    params = np.empty((len(attrs_list), len(PARAM_NAMES)))
+    for i, attrs in enumerate(attrs_list):
+        for j, name in enumerate(PARAM_NAMES):
+            params[i, j] = float(attrs.get(name, PARAM_DEFAULTS[name]))
+    return params
+
+
+def get_pulse(delay, duration, tMax, dt):
+    '''
+    A unit amplitude square pulse sampled at dt, indexed the same way as
+    RAWBackend.inject_square_current, so that amplitude * pulse is the Iext
+    that inject_square_current would have built.
+    '''
+    N = int(tMax/dt)
+    pulse = np.zeros(N)
+    delay_ind = int((delay/tMax)*N)
+    duration_ind = int((duration/tMax)*N)
+    pulse[delay_ind:delay_ind+duration_ind-1] = 1.0
+    return pulse
+
+
+@njit(cache=True)
+def get_vm_population(params, pulse, amplitudes, dt=0.025, stop_on_spikes=0):
+    '''
+    Integrate many Izhikevich models at once.
+    params is (N_models x N_params), ordered as in PARAM_NAMES,
+    every model shares the same stimulus waveform pulse and model i
+    receives amplitudes[i] * pulse.
+    Returns an (N_models x T) voltage matrix in the same scale as get_vm.
+    The update rule is identical to get_vm, the only difference is that the
+    state is a vector of models rather than a scalar.
+    If stop_on_spikes is non zero, a model is no longer integrated after
+    that many spikes (its trace holds the reset value from then on), and
+    the matrix ends as soon as every model has stopped.
+    '''
+    n_models = params.shape[0]
+    N = len(pulse)
+    vm = np.zeros((n_models, N))
+    v = np.empty(n_models)
+    u = np.zeros(n_models)
+    spikes = np.zeros(n_models, dtype=np.int64)
+    C = params[:, 0]
+    a = params[:, 1]
+    b = params[:, 2]
+    c = params[:, 3]
+    d = params[:, 4]
+    k = params[:, 5]
+    vPeak = params[:, 6]
+    vr = params[:, 7]
+    vt = params[:, 8]
+    for i in range(n_models):
+        v[i] = vr[i]
+        vm[i, 0] = vr[i]
+    running = n_models
+    last = N - 1
+    for m in range(0, N-1):
+        for i in range(n_models):
+            if stop_on_spikes and spikes[i] >= stop_on_spikes:
+                vm[i, m+1] = v[i]
+                continue
+            I = amplitudes[i] * pulse[m]
+            dv = k[i]*(v[i] - vr[i])*(v[i] - vt[i]) - u[i] + I
+            v_next = v[i] + (dt/2) * dv/C[i]
+            v_next = v_next + (dt/2) * dv/C[i]
+            u_next = u[i] + dt * a[i]*(b[i]*(v_next - vr[i]) - u[i])
+            if v_next >= vPeak[i]:
+                vm[i, m] = vPeak[i]
+                v_next = c[i]
+                u_next = u_next + d[i]
+                spikes[i] += 1
+                if stop_on_spikes and spikes[i] >= stop_on_spikes:
+                    running -= 1
+            v[i] = v_next
+            u[i] = u_next
+            vm[i, m+1] = v_next
+        if running == 0:
+            last = m + 1
+            break
+    return vm[:, :last+1] / 1000.0
+
+
+@tracing.traced(backend='RAW')
+def simulate_population(attrs_list, current, amplitudes=None, dt=0.025,
+                        stop_on_spikes=None):
+    '''
+    Population level counterpart of RAWBackend.inject_square_current.
+    Inputs: a list of model attribute dictionaries, a square current
+    dictionary shared by every model (as for inject_square_current) and
+    optionally one amplitude per model, which overrides current['amplitude'].
+    stop_on_spikes, as the run parameter of the same name, ends each model's
+    simulation after that many spikes.
+    Outputs: an (N_models x T) voltage matrix sampled at dt, from a single
+    call to get_vm_population.
+    '''
+    if 'injected_square_current' in current.keys():
+        c = current['injected_square_current']
+    else:
+        c = current
+    duration = float(c['duration'])
+    delay = float(c['delay'])
+    tMax = delay + duration + 200.0
+    pulse = get_pulse(delay, duration, tMax, dt)
+    if amplitudes is None:
+        amplitudes = [float(c['amplitude'])]*len(attrs_list)
+    amplitudes = np.array([float(x) for x in amplitudes])
+    params = attrs_to_params(attrs_list)
+    return _get_vm_population(params, pulse, amplitudes, float(dt),
+                              int(stop_on_spikes or 0))
+
+
+# Ahead-of-time compiled kernels, where built (see aot.py).
+_izhikevich = compiled_kernel(izhikevich)
+_get_vm_population = compiled_kernel(get_vm_population)
+
+
+def warm_up():
+    '''
+    Compile the kernels of this backend (or load them from numba's cache),
+    e.g. when a worker process starts, so that its first simulation is as
+    fast as the others.
+    '''
+    pulse = get_pulse(1.0, 1.0, 3.0, 0.025)
+    get_vm(dt=0.025, Iext=pulse)
+    simulate_population([PARAM_DEFAULTS],
+                        {'amplitude': 0.0, 'delay': 1.0, 'duration': 1.0})
+
 
 class RAWBackend(Backend):
 
+    simulate_population = staticmethod(simulate_population)
+
     def init_backend(self, attrs = None, cell_name = 'alice', current_src_name = 'hannah', DTC = None):
         backend = 'RAW'
         super(RAWBackend,self).init_backend()
@@ -94,6 +255,7 @@ class RAWBackend(Backend):
         self.model.attrs.update(attrs)
 
 
+    @tracing.traced('simulate', backend='RAW')
     def inject_square_current(self, current):#, section = None, debug=False):
         """Inputs: current : a dictionary with exactly three items, whose keys are: 'amplitude', 'delay', 'duration'
         Example: current = {'amplitude':float*pq.pA, 'delay':float*pq.ms, 'duration':float*pq.ms}}
@@ -108,6 +270,13 @@ class RAWBackend(Backend):
             c = current['injected_square_current']
         else:
             c = current
+        cache = get_trace_cache()
+        if cache is not None:
+            key = cache.key('RAW', self.model.attrs,
+                            getattr(self.model, 'run_params', {}), c)
+            self.vM = cache.get(key)
+            if self.vM is not None:
+                return self.vM
         amplitude = float(c['amplitude'])
         duration = float(c['duration'])#/dt#/dt.rescale('ms')
         delay = float(c['delay'])#/dt#.rescale('ms')
@@ -116,18 +285,17 @@ class RAWBackend(Backend):
         tMax = self.tstop
 
         dt = 0.025
-        N = int(tMax/dt)
-        Iext = np.zeros(N)
-        delay_ind = int((delay/tMax)*N)
-        duration_ind = int((duration/tMax)*N)
-
-        Iext[0:delay_ind-1] = 0.0
-        Iext[delay_ind:delay_ind+duration_ind-1] = amplitude
-        Iext[delay_ind+duration_ind::] = 0.0
+        Iext = amplitude * get_pulse(delay, duration, tMax, dt)
 
         attrs['Iext'] = Iext
         attrs['dt'] = dt
+        # Opt-in early termination, e.g. model.set_run_params(stop_on_spikes=1)
+        # when only the presence of spikes matters.
+        attrs['stop_on_spikes'] = int(getattr(self.model, 'run_params', {})
+                                      .get('stop_on_spikes') or 0)
         self.vM  = get_vm(**attrs)
+        if cache is not None:
+            cache.set(key, self.vM)
 
         return self.vM
 
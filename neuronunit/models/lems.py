@@ -17,6 +17,7 @@ import neuronunit.capabilities as cap
 from pyneuroml import pynml
 from sciunit.utils import TemporaryDirectory
 from sciunit.models.runnable import RunnableModel
+from .backends.base import scratch_dir
 
 
 class LEMSModel(RunnableModel):
@@ -55,6 +56,32 @@ class LEMSModel(RunnableModel):
 
     from_url = None
 
+    # Parsed model files, and the edits to them not yet written to disk.
+    # Not pickled; rebuilt from the files on demand.
+    _parsed_trees = None
+    _parsed_nodes = None
+    _dirty_paths = None
+
+    def _init_parsed_trees(self):
+        if self._parsed_trees is None:
+            self._parsed_trees = {}
+            self._parsed_nodes = {}
+            self._dirty_paths = set()
+
+    def set_backend(self, backend):
+        """Set the simulation backend, importing it first if needed.
+
+        NeuronUnit backends are only imported (and registered with sciunit)
+        the first time they are asked for by name.
+        """
+        from .backends import available_backends
+        name = backend
+        if isinstance(backend, (tuple, list)) and len(backend):
+            name = backend[0]
+        if isinstance(name, str):
+            available_backends.get(name)
+        super(LEMSModel, self).set_backend(backend)
+
     def url_to_path(self, possible_url, base=None):
         """Check for a URL and download the contents.
 
@@ -102,64 +129,110 @@ class LEMSModel(RunnableModel):
         """Create a temporary, writable copy of the original LEMS file.
 
         Used so that e.g. edits can be made to it programatically before
-        simulation.
+        simulation.  The copy is made in scratch_dir(), i.e. in memory
+        where possible.
         """
         if name is None:
             name = self.name
         if not hasattr(self, 'temp_dir'):
-            self.temp_dir = TemporaryDirectory()
+            self.temp_dir = TemporaryDirectory(dir=scratch_dir())
         lems_copy_path = os.path.join(self.temp_dir.name,
                                       '%s.xml' % name)
         shutil.copy2(self.orig_lems_file_path, lems_copy_path)
+        self.forget_parsed_trees(lems_copy_path)
         nml_paths = self.get_nml_paths(original=True)
         for orig_nml_path in nml_paths:
             new_nml_path = os.path.join(self.temp_dir.name,
                                         os.path.basename(orig_nml_path))
             shutil.copy2(orig_nml_path, new_nml_path)
+            self.forget_parsed_trees(new_nml_path)
         if self.attrs:
             self.set_lems_attrs(path=lems_copy_path)
         if use:
             self.lems_file_path = lems_copy_path
         return lems_copy_path
 
+    def get_parsed_tree(self, path):
+        """Get the parsed XML tree of a model file.
+
+        Each file is only parsed once, and then kept in memory; edits made
+        to the tree (e.g. by set_lems_attrs) are only written back to the
+        file by write_lems_files.
+        """
+        self._init_parsed_trees()
+        if path not in self._parsed_trees:
+            if path.endswith('.nml'):
+                self._parsed_trees[path] = nml.nml.parsexml_(path)
+            else:
+                self._parsed_trees[path] = etree.parse(path)
+        return self._parsed_trees[path]
+
+    def get_parsed_nodes(self, path, match):
+        """Get the elements of a model file matching an ElementPath, e.g.
+        'pulseGenerator'.
+
+        Lookups are cached, so editing the same nodes repeatedly (once per
+        parameter set or stimulus) does not search the tree each time.
+        """
+        tree = self.get_parsed_tree(path)
+        if (path, match) not in self._parsed_nodes:
+            self._parsed_nodes[(path, match)] = tree.findall(match)
+        return self._parsed_nodes[(path, match)]
+
+    def forget_parsed_trees(self, *paths):
+        """Drop the cached trees of the given files (or of all files),
+        e.g. because they were replaced on disk."""
+        self._init_parsed_trees()
+        for path in (paths or list(self._parsed_trees)):
+            self._parsed_trees.pop(path, None)
+            self._dirty_paths.discard(path)
+            for key in [key for key in self._parsed_nodes if key[0] == path]:
+                del self._parsed_nodes[key]
+
+    def get_model_file_paths(self, path=None):
+        """The LEMS file (by default lems_file_path) and the NML files it
+        includes, the latter located next to it."""
+        if path is None:
+            path = self.lems_file_path
+        nml_paths = self.get_nml_paths(lems_tree=self.get_parsed_tree(path),
+                                       absolute=False)
+        return [path] + [os.path.join(os.path.dirname(path), x)
+                         for x in nml_paths]
+
     def get_parsed_trees(self):
         """Get a dictionary of parsed XML trees for each model file."""
-        lems_tree = etree.parse(self.lems_file_path)
-        trees = {self.lems_file_path: lems_tree}
-        nml_paths = self.get_nml_paths(lems_tree=lems_tree)
-        trees.update({x: nml.nml.parsexml_(x) for x in nml_paths})
-        return trees
+        return {x: self.get_parsed_tree(x)
+                for x in self.get_model_file_paths()}
 
     def set_lems_attrs(self, path=None):
-        """Set attribite equivalents in the LEMS file and write it to disk."""
-        if path is None:
-            path = self.lems_file_path
-        paths = [path] + self.get_nml_paths()
-        for p in paths:
-            tree = etree.parse(p)
+        """Set attribite equivalents in the LEMS file (in memory)."""
+        for p in self.get_model_file_paths(path):
             for key1, value1 in self.attrs.items():
-                nodes = tree.findall(key1)
+                nodes = self.get_parsed_nodes(p, key1)
                 for node in nodes:
                     for key2, value2 in value1.items():
                         node.attrib[key2] = value2
-            tree.write(p)
+                if nodes:
+                    self._dirty_paths.add(p)
 
     def set_lems_run_params(self, verbose=False):
-        """Set run_param equivalents in the LEMS file and write it to disk."""
-        trees = self.get_parsed_trees()
+        """Set run_param equivalents in the LEMS file (in memory)."""
 
         # NeuronUnit->LEMS attribute mapping
         mapping = {'t_stop': 'length', 'dt': 'step'}
         # Edit NML files.
-        for file_path, tree in trees.items():
+        for file_path in self.get_model_file_paths():
             for key, value in self.run_params.items():
                 if key in ['t_stop', 'dt']:
-                    simulations = tree.findall('Simulation')
+                    simulations = self.get_parsed_nodes(file_path,
+                                                        'Simulation')
                     for sim in simulations:
                         value_in_ms = float(value.rescale(pq.ms))
                         sim.attrib[mapping[key]] = '%fms' % value_in_ms
+                        self._dirty_paths.add(file_path)
                 elif key == 'injected_square_current':
-                    pulse_generators = tree.findall('pulseGenerator')
+                    pulse_generators = self.get_parsed_nodes(file_path,
+                                                             'pulseGenerator')
                     for pg in pulse_generators:
                         for attr in ['delay', 'duration', 'amplitude']:
                             if attr in value:
@@ -167,8 +240,24 @@ class LEMSModel(RunnableModel):
                                     print('Setting %s to %f' %
                                           (attr, value[attr]))
                                 pg.attrib[attr] = '%s' % value[attr]
+                        self._dirty_paths.add(file_path)
+
+    def write_lems_files(self):
+        """Write the model files edited in memory back to disk.
+
+        Simulators that read the model files (e.g. jNeuroML) call this
+        before each run; files that were not edited are not rewritten.
+        """
+        self._init_parsed_trees()
+        for path in sorted(self._dirty_paths):
+            self._parsed_trees[path].write(path)
+        self._dirty_paths.clear()
 
-            tree.write(file_path)
+    def __getstate__(self):
+        """Write pending edits first, as the parsed trees holding them are
+        not part of the state of a copy or pickle, which reads the files."""
+        self.write_lems_files()
+        return super(LEMSModel, self).__getstate__()
 
     def has_pulse_generator(self, tree=None):
         """Return True if this model instance contains a pulse generator.
@@ -7,6 +7,7 @@ import quantities as pq
 import neuronunit.capabilities as cap
 from .lems import LEMSModel
 from .static import ExternalModel
+from .backends import available_backends
 import neuronunit.capabilities.spike_functions as sf
 
 
@@ -26,22 +26,45 @@ class StaticModel(sciunit.Model,
             raise TypeError('vm must be a neo.core.AnalogSignal')
 
         self.vm = vm
+        self._APs = None
 
     def get_membrane_potential(self, **kwargs):
         """Return the Vm passed into the class constructor."""
         return self.vm
 
     def get_APs(self, **run_params):
-        """Return the APs, if any, contained in the static waveform."""
+        """Return the APs, if any, contained in the static waveform.
+        They are only extracted once, since the waveform never changes."""
+        if self._APs is None:
+            vm = self.get_membrane_potential(**run_params)
+            self._APs = sf.get_spike_waveforms(vm)
+        return self._APs
+
+    def get_spike_train(self, **run_params):
+        """Return the spike train contained in the static waveform."""
         vm = self.get_membrane_potential(**run_params)
-        waveforms = sf.get_spike_waveforms(vm)
-        return waveforms
+        return sf.get_spike_train(vm)
 
     def inject_square_current(self, current):
         """Static model always returns the same waveform.
         This method is for compatibility only."""
         pass
 
+    def set_run_params(self, **run_params):
+        """Static model always returns the same waveform.
+        This method is for compatibility only."""
+        pass
+
+    def set_stop_time(self, t_stop):
+        """Static model always returns the same waveform.
+        This method is for compatibility only."""
+        pass
+
+    def get_backend(self):
+        """Static model has no backend, it handles backend calls itself.
+        This method is for compatibility only."""
+        return self
+
 
 class ExternalModel(sciunit.Model,
                     cap.ProducesMembranePotential,
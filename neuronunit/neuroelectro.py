@@ -29,17 +29,19 @@ width = x.mean # Mean Spike width reported across all matching papers.
 ...
 """
 
+import os
 import json
+import sqlite3
+import threading
 from pprint import pprint
-import shelve
-import hashlib
-import pickle
+from concurrent.futures import ThreadPoolExecutor
 import requests
 try:  # Python 2
     from urllib import urlencode
+    from urlparse import urljoin
     from urllib2 import urlopen, URLError
 except ImportError:  # Python 3
-    from urllib.parse import urlencode
+    from urllib.parse import urlencode, urljoin
     from urllib.request import urlopen, URLError
 
 import numpy as np
@@ -91,6 +93,232 @@ class Article:
     pmid = None
 
 
+class NeuroElectroStore(object):
+    """A local SQLite store of neuroelectro.org records.
+
+    prefetch() downloads every summary ('nes') and data map ('nedm') record
+    of a list of neurons, concurrently, after which queries about those
+    neurons (e.g. by NeuroElectroSummary.get_values, and so by
+    VmTest.neuroelectro_summary_observation) are answered from the store,
+    without any network round trip.  Other API responses are kept by URL.
+    In offline mode, queries the store cannot answer raise
+    NeuroElectroError rather than going to neuroelectro.org.
+    """
+
+    kinds = ('nes', 'nedm')
+
+    def __init__(self, path, offline=False, timeout=30):
+        self.path = path
+        self.offline = offline
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS records (
+                kind TEXT, n_id INTEGER, n_nlex TEXT, n_name TEXT,
+                e_id INTEGER, e_name TEXT, json TEXT);
+            CREATE INDEX IF NOT EXISTS records_nlex ON records (kind, n_nlex);
+            CREATE INDEX IF NOT EXISTS records_n ON records (kind, n_id);
+            CREATE TABLE IF NOT EXISTS neurons (
+                kind TEXT, field TEXT, value TEXT,
+                PRIMARY KEY (kind, field, value));
+            CREATE TABLE IF NOT EXISTS responses (
+                url TEXT PRIMARY KEY, json TEXT);
+            """)
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def fetch(self, url):
+        """The JSON object at url, from neuroelectro.org."""
+        if self.offline:
+            raise NeuroElectroError("%s is not in the local store, and the "
+                                    "store is offline" % url)
+        try:
+            return json.loads(urlopen(url, None, self.timeout).read()
+                              .decode('utf-8'))
+        except URLError as e:
+            raise NeuroElectroError(getattr(e, 'reason', str(e)))
+
+    def fetch_all(self, url):
+        """Every object of a (paged) API list, starting at url."""
+        objects = []
+        while url:
+            page = self.fetch(url)
+            objects += page.get('objects', [])
+            next_url = (page.get('meta') or {}).get('next')
+            url = urljoin(DOMAIN, next_url) if next_url else None
+        return objects
+
+    @staticmethod
+    def neuron_fields(neuron):
+        """The (field, value) pairs identifying a neuron, as set in a Neuron
+        or in a dictionary."""
+        if not isinstance(neuron, dict):
+            neuron = {key: getattr(neuron, key, None)
+                      for key in ('id', 'nlex_id', 'name')}
+        fields = []
+        for field in ('id', 'nlex_id', 'name'):
+            value = neuron.get(field)
+            if value is not None:
+                value = str(value).lower() if field == 'name' else str(value)
+                fields.append((field, value))
+        return fields
+
+    @staticmethod
+    def _parts(kind, obj):
+        """The neuron and ephys property described by an API object."""
+        if kind == 'nes':
+            return obj.get('n') or {}, obj.get('e') or {}
+        return ((obj.get('ncm') or {}).get('n') or {},
+                (obj.get('ecm') or {}).get('e') or {})
+
+    def prefetch(self, neurons, workers=8, refresh=False):
+        """Download the records of every neuron (a dictionary with an
+        'nlex_id', 'id' or 'name', or just a NeuroLex ID), with up to
+        workers concurrent requests.  Neurons already in the store are
+        skipped, unless refresh.  Returns the number of records."""
+        neurons = [{'nlex_id': n} if isinstance(n, str) else n
+                   for n in neurons]
+        if not refresh:
+            neurons = [n for n in neurons if not all(self.has_neuron(kind, n)
+                                                     for kind in self.kinds)]
+        jobs = []
+        for neuron in neurons:
+            # Query by one identifier of the neuron, the most specific.
+            field, value = sorted(self.neuron_fields(neuron),
+                                  key=lambda f: ('nlex_id', 'id',
+                                                 'name').index(f[0]))[0]
+            query = {{'id': 'n', 'nlex_id': 'nlex', 'name': 'n__name'}[field]:
+                     neuron[field], 'limit': 999}
+            for kind in self.kinds:
+                url = '%s%s/?%s' % (API_URL, kind, urlencode(query))
+                jobs.append((kind, neuron, url))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(lambda job: self.fetch_all(job[2]),
+                                        jobs))
+        count = 0
+        for (kind, neuron, url), objects in zip(jobs, results):
+            self.add(kind, neuron, objects)
+            count += len(objects)
+        return count
+
+    def add(self, kind, neuron, objects):
+        """Store all the objects of kind of a neuron, replacing any stored
+        before."""
+        fields = set(self.neuron_fields(neuron))
+        rows = []
+        for obj in objects:
+            n, e = self._parts(kind, obj)
+            fields.update(self.neuron_fields(n))
+            rows.append((kind, n.get('id'), n.get('nlex_id'),
+                         (n.get('name') or '').lower(), e.get('id'),
+                         (e.get('name') or '').lower(), json.dumps(obj)))
+        with self.lock:
+            for field, value in fields:
+                column = {'id': 'n_id', 'nlex_id': 'n_nlex',
+                          'name': 'n_name'}[field]
+                self.conn.execute("DELETE FROM records WHERE kind = ? AND "
+                                  "%s = ?" % column, (kind, value))
+            self.conn.executemany("INSERT INTO records VALUES "
+                                  "(?, ?, ?, ?, ?, ?, ?)", rows)
+            self.conn.executemany("INSERT OR IGNORE INTO neurons VALUES "
+                                  "(?, ?, ?)", [(kind,) + f for f in fields])
+            self.conn.commit()
+
+    def has_neuron(self, kind, neuron):
+        """Whether the records of kind of neuron were prefetched."""
+        for field, value in self.neuron_fields(neuron):
+            if self.conn.execute("SELECT 1 FROM neurons WHERE kind = ? AND "
+                                 "field = ? AND value = ?",
+                                 (kind, field, value)).fetchone():
+                return True
+        return False
+
+    def query(self, kind, neuron, ephysprop):
+        """The stored objects of kind matching neuron and ephysprop (as set
+        on a NeuroElectroData), or None if neuron was not prefetched."""
+        if not self.has_neuron(kind, neuron):
+            return None
+        clauses, values = ['kind = ?'], [kind]
+        for column, value in [('n_id', neuron.id), ('n_nlex', neuron.nlex_id),
+                              ('n_name', neuron.name), ('e_id', ephysprop.id),
+                              ('e_name', ephysprop.name)]:
+            if value is not None:
+                clauses.append('%s = ?' % column)
+                values.append(str(value).lower() if column.endswith('name')
+                              else value)
+        rows = self.conn.execute("SELECT json FROM records WHERE %s "
+                                 "ORDER BY rowid" % ' AND '.join(clauses),
+                                 values).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def get_response(self, url):
+        row = self.conn.execute("SELECT json FROM responses WHERE url = ?",
+                                (url,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_response(self, url, json_object):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES "
+                              "(?, ?)", (url, json.dumps(json_object)))
+            self.conn.commit()
+
+    def ephysprops(self):
+        """Every ephys property of the NeuroElectro ontology."""
+        url = API_URL + 'e/?limit=999'
+        objects = self.get_response(url)
+        if objects is None:
+            objects = self.fetch_all(url)
+            self.set_response(url, objects)
+        return objects
+
+    def pooled_observations(self):
+        """The pooled observation of every (neuron, ephys property) pair of
+        the stored nedm records; see pooled_observations()."""
+        rows = self.conn.execute("SELECT json FROM records WHERE kind = "
+                                 "'nedm' ORDER BY rowid").fetchall()
+        return pooled_observations([json.loads(row[0]) for row in rows])
+
+
+_store = None
+
+
+def get_store():
+    """The NeuroElectroStore of this process, at $NU_NEUROELECTRO_STORE,
+    else at ~/.cache/neuronunit/neuroelectro.sqlite; offline if
+    $NU_NEUROELECTRO_OFFLINE is set."""
+    global _store
+    if _store is None:
+        path = os.environ.get('NU_NEUROELECTRO_STORE',
+                              os.path.join(os.path.expanduser('~'), '.cache',
+                                           'neuronunit', 'neuroelectro.sqlite'))
+        offline = bool(os.environ.get('NU_NEUROELECTRO_OFFLINE'))
+        _store = NeuroElectroStore(path, offline=offline)
+    return _store
+
+
+def set_store(path, offline=False):
+    """Use the store at path, for this process and its future workers."""
+    global _store
+    os.environ['NU_NEUROELECTRO_STORE'] = path
+    if offline:
+        os.environ['NU_NEUROELECTRO_OFFLINE'] = '1'
+    else:
+        os.environ.pop('NU_NEUROELECTRO_OFFLINE', None)
+    _store = NeuroElectroStore(path, offline=offline)
+    return _store
+
+
+def prefetch(neurons, workers=8, refresh=False):
+    """Download the records of neurons into the store, see
+    NeuroElectroStore.prefetch."""
+    return get_store().prefetch(neurons, workers=workers, refresh=refresh)
+
+
 class NeuroElectroData(object):
     """Abstract class based on neuroelectro.org data using that site's API."""
 
@@ -187,28 +415,44 @@ class NeuroElectroData(object):
             self.json_object = json.loads(html)
         return self.json_object
 
+    kind = None  # The API endpoint, i.e. 'nes' or 'nedm'.
+
+    def get_local_objects(self, params=None):
+        """The matching objects in the local store, or None if the store
+        cannot answer this query (see NeuroElectroStore.prefetch)."""
+        if self.kind is None or any(value is not None for key, value
+                                    in (params or {}).items()
+                                    if key != 'limit'):
+            return None
+        return get_store().query(self.kind, self.neuron, self.ephysprop)
+
     def get_values(self, params=None, quiet=False):
         """Get values from neuroelectro.org.
 
         We will use 'params' in the future to specify metadata
         (e.g. temperature) that neuroelectro.org will provide.
+        Neurons prefetched into the local store (see prefetch) are looked
+        up there; otherwise, if cached, responses are kept in the store.
         """
-        db = shelve.open('neuroelectro-cache') if self.cached else {}
-        contents = (self.__class__, self.neuron, self.ephysprop,params)
-        if DUMP:
-            pickled = pickle.dumps(contents)
-        identifier = hashlib.sha224(pickled).hexdigest()
-        if not quiet:
-            print("Getting %s%s data values from neuroelectro.org"
-                  % ("cached " if identifier in db else "",
-                      self.ephysprop.name))
-        if identifier in db:
-            print("Using cached value.")
-            self.json_object = json.loads(db[identifier])
+        objects = self.get_local_objects(params=params)
+        if objects is not None:
+            self.json_object = {'objects': objects}
         else:
-            self.get_json(params=params, quiet=quiet)
-            if DUMP:
-                db[identifier] = json.dumps(self.json_object)
+            url = self.make_url(params=params)
+            cached = self.cached and get_store().get_response(url)
+            if not quiet:
+                print("Getting %s%s data values from neuroelectro.org"
+                      % ("cached " if cached else "", self.ephysprop.name))
+            if cached:
+                self.json_object = cached
+            elif get_store().offline:
+                raise NeuroElectroError("No %s data for this neuron in the "
+                                        "local store, which is offline"
+                                        % self.ephysprop.name)
+            else:
+                self.get_json(params=params, quiet=quiet)
+                if self.cached and DUMP:
+                    get_store().set_response(url, self.json_object)
         if 'objects' in self.json_object:
             data = self.json_object['objects']
         else:
@@ -222,8 +466,6 @@ class NeuroElectroData(object):
         # For now, we are just going to take the first match.
         # If neuron_id and ephysprop_id where both specified,
         # there should be only one anyway.
-        if self.cached:
-            db.close()
         return self.api_data
 
     def check(self):
@@ -239,6 +481,7 @@ class NeuroElectroDataMap(NeuroElectroData):
     """Class for getting single reported values from neuroelectro.org."""
 
     url = API_URL+'nedm/'
+    kind = 'nedm'
     article = Article()
     require_attrs = ['val', 'sem']
 
@@ -258,6 +501,13 @@ class NeuroElectroDataMap(NeuroElectroData):
         url += '&'+urlencode(query)
         return url
 
+    def get_local_objects(self, params=None):
+        """As for NeuroElectroData; values of one article are not looked up
+        in the local store."""
+        if self.article.id is not None or self.article.pmid is not None:
+            return None
+        return super(NeuroElectroDataMap, self).get_local_objects(params)
+
     def get_values(self, params=None, quiet=False):
         """Get values from neuroelectro.org.
 
@@ -266,7 +516,8 @@ class NeuroElectroDataMap(NeuroElectroData):
         """
         data = super(NeuroElectroDataMap, self).get_values(params=params,
                                                            quiet=quiet)
-        if data:
+        # All matches (a list) are handled by NeuroElectroPooledSummary.
+        if data and self.get_one_match:
             self.neuron.name = data['ncm']['n']['name']
             # Set the neuron name from the json data.
             self.ephysprop.name = data['ecm']['e']['name']
@@ -284,6 +535,7 @@ class NeuroElectroSummary(NeuroElectroData):
     """
 
     url = API_URL+'nes/'
+    kind = 'nes'
     require_attrs = ['mean', 'std']
 
     def get_values(self, params=None, quiet=False):
@@ -314,6 +566,145 @@ class NeuroElectroSummary(NeuroElectroData):
         return observation
 
 
+# Pooling of the values reported by articles ('nedm' records), column-wise.
+# Missing values are NaN.
+
+def records_table(records):
+    """Columns of nedm records: the neuron (NeuroLex ID, else id) and ephys
+    property (name) of each, its mean (normalized where available), SEM
+    and SD (whichever was reported), N and source."""
+    def value(item, normalized, raw):
+        x = item.get(normalized)
+        x = item.get(raw) if x is None else x
+        return np.nan if x is None else x
+    errs = np.array([value(item, 'err_norm', 'err') for item in records],
+                    dtype=float)
+    is_sem = np.array([item.get('error_type') == 'sem' for item in records],
+                      dtype=bool)
+    neurons = [item['ncm']['n'] for item in records]
+    return {
+        'neuron': np.array([n.get('nlex_id') or str(n.get('id'))
+                            for n in neurons], dtype=object),
+        'ephysprop': np.array([item['ecm']['e']['name'].lower()
+                               for item in records], dtype=object),
+        'mean': np.array([value(item, 'val_norm', 'val') for item in records],
+                         dtype=float),
+        'sem': np.where(is_sem, errs, np.nan),
+        'std': np.where(is_sem, np.nan, errs),
+        'n': np.array([np.nan if item.get('n') is None else item['n']
+                       for item in records], dtype=float),
+        'source': np.array([item.get('source') for item in records],
+                           dtype=object),
+    }
+
+
+def table_line(table, i, filled=True):
+    """Row i of a records_table, as printed by get_pooled_stats."""
+    line = {column: float(table[column][i])
+            for column in ('mean', 'std', 'sem', 'n')}
+    if filled:
+        line['n'] = int(line['n'])
+        line['source'] = table['source'][i]
+    return line
+
+
+def group_median(values, groups, n_groups):
+    """The median of the non-NaN values of each group (NaN if none), with
+    groups numbered 0 to n_groups - 1."""
+    valid = ~np.isnan(values)
+    order = np.lexsort((values[valid], groups[valid]))
+    v = values[valid][order]
+    counts = np.bincount(groups[valid], minlength=n_groups)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    medians = np.full(n_groups, np.nan)
+    has = counts > 0
+    lo = starts[has] + (counts[has] - 1) // 2
+    hi = starts[has] + counts[has] // 2
+    medians[has] = (v[lo] + v[hi]) / 2.0
+    return medians
+
+
+def fill_missing_ns(ns, groups=None, n_groups=1):
+    """The Ns, with missing ones the median N of their group (rounded
+    down), or 1 if no N of the group was reported, so that all means
+    weigh equally."""
+    groups = np.zeros(len(ns), dtype=int) if groups is None else groups
+    medians = np.floor(group_median(ns, groups, n_groups))
+    medians[np.isnan(medians)] = 1
+    return np.where(np.isnan(ns), medians[groups], ns)
+
+
+def fill_missing_sems_stds(sems, stds, ns, groups=None, n_groups=1):
+    """SEMs and SDs, each computed from the other where missing, and else
+    the median SD of their group; NaN if no SD or SEM of the group was
+    reported."""
+    groups = np.zeros(len(ns), dtype=int) if groups is None else groups
+    root_n = np.sqrt(ns)
+    sems = np.where(np.isnan(sems), stds / root_n, sems)
+    stds = np.where(np.isnan(stds), sems * root_n, stds)
+    medians = group_median(stds, groups, n_groups)
+    missing = np.isnan(stds)
+    stds = np.where(missing, medians[groups], stds)
+    sems = np.where(missing, stds / root_n, sems)
+    return sems, stds
+
+
+def pool(table, by=None):
+    """Pool the values of a records_table, filling in missing values (in
+    place), for every group of rows with the same values in the columns by
+    (by default, one group of every row).
+
+    Each mean is weighted by its N, and each SD by its N - 1:
+    grand_mean = SUM( N[i]*Mean[i] ) / SUM(N[i])
+    grand_std = SQRT( SUM( (N[i]-1)*std[i]^2 ) / SUM(N[i]-1) )
+    Returns the groups (one tuple of values of by each), and the pooled
+    mean, std, sem and n of each, as arrays; the std (and sem) of groups
+    without any SD or SEM is NaN.
+    """
+    if by:
+        keys = list(zip(*[table[column] for column in by]))
+        index = {}
+        groups = np.array([index.setdefault(key, len(index))
+                           for key in keys], dtype=int)
+        names = list(index)
+    else:
+        groups = np.zeros(len(table['mean']), dtype=int)
+        names = [()]
+    n_groups = len(names)
+    ns = fill_missing_ns(table['n'], groups, n_groups)
+    sems, stds = fill_missing_sems_stds(table['sem'], table['std'], ns,
+                                        groups, n_groups)
+    table['n'], table['sem'], table['std'] = ns, sems, stds
+
+    n_sum = np.bincount(groups, weights=ns, minlength=n_groups)
+    mean = np.bincount(groups, weights=ns * table['mean'],
+                       minlength=n_groups) / n_sum
+    dof = np.bincount(groups, weights=ns - 1, minlength=n_groups)
+    std = np.sqrt(np.bincount(groups, weights=(ns - 1) * stds**2,
+                              minlength=n_groups) / dof)
+    return {'groups': names, 'mean': mean, 'std': std,
+            'sem': std / np.sqrt(n_sum), 'n': n_sum}
+
+
+def pooled_observations(records):
+    """The pooled observation, as given by NeuroElectroPooledSummary, of
+    every (neuron, ephys property) pair of nedm records, in one pass.
+
+    Returns a dictionary from (neuron, ephys property) pairs, neurons by
+    NeuroLex ID (else id) and properties by lower case name, to
+    observations; pairs without any SD or SEM are left out."""
+    if not len(records):
+        return {}
+    stats = pool(records_table(records), by=('neuron', 'ephysprop'))
+    observations = {}
+    for i, group in enumerate(stats['groups']):
+        if not np.isnan(stats['std'][i]):
+            observations[group] = {'mean': stats['mean'][i],
+                                   'std': stats['std'][i],
+                                   'n': int(stats['n'][i])}
+    return observations
+
+
 class NeuroElectroPooledSummary(NeuroElectroDataMap):
     """Class for getting summary values from neuroelectro.org.
 
@@ -380,109 +771,74 @@ class NeuroElectroPooledSummary(NeuroElectroDataMap):
 
     def get_pooled_stats(self, data, quiet=True):
         """Get pooled statistics from the data."""
-        lines = []
-        means = []
-        sems = []
-        stds = []
-        ns = []
-        sources = []
-
+        table = records_table(data)
         if not quiet:
             print("Raw Values")
+            for i in range(len(table['mean'])):
+                print(table_line(table, i, filled=False))
 
-        # Collect raw values for each paper from NeuroElectro
-        for item in data:
-
-            err_is_sem = item['error_type'] == "sem"  # SEM or std
-            err = (item['err_norm'] if item['err_norm'] is not None
-                   else item['err'])
-
-            sem = err if err_is_sem else None
-            std = err if not err_is_sem else None
-            mean = (item['val_norm'] if item['val_norm'] is not None
-                    else item['val'])
-            n = item['n']
-            source = item['source']
-
-            means.append(mean)
-            sems.append(sem)
-            stds.append(std)
-            ns.append(n)
-            sources.append(source)
-
-            if not quiet:
-                print({'mean': mean, 'std': std, 'sem': sem, 'n': n})
-
-        # Fill in missing values
-        self.fill_missing_ns(ns)
-        self.fill_missing_sems_stds(sems, stds, ns)
+        stats = pool(table)
+        if np.isnan(stats['std'][0]):
+            # Perhaps the median std of all cells for this property could
+            # be used. However, NE API nes interface does not support summary
+            # prop values without specifying the neuron id
+            msg = 'No StDevs or SEMs reported for "%s" property "%s"'
+            msg = msg % (self.neuron_name, self.ephysprop_name)
+            raise NotImplementedError(msg)
 
+        lines = []
         if not quiet:
             print("---------------------------------------------------")
             print("Filled in Values (computed or median where missing)")
+            for i in range(len(table['mean'])):
+                lines.append(table_line(table, i))
+                print(lines[-1])
 
-            for i, _ in enumerate(means):
-                line = {'mean': means[i], 'std': stds[i], 'sem': sems[i],
-                        'n': ns[i], "source": sources[i]}
-                lines.append(line)
-                print(line)
-
-        # Compute the weighted grand_mean
-        # grand_mean  = SUM( N[i]*Mean[i] ) / SUM(N[i])
-        # grand_std = SQRT( SUM( (N[i]-1)*std[i]^2 ) / SUM(N[i]-1) )
-
-        ns_np = np.array(ns)
-        means_np = np.array(means)
-        stds_np = np.array(stds)
-        n_sum = ns_np.sum()
-
-        grand_mean = np.sum(ns_np * means_np) / n_sum
-        grand_std = np.sqrt(np.sum((ns_np-1)*(stds_np**2))/np.sum(ns_np-1))
-        grand_sem = grand_std / np.sqrt(n_sum)
-
-        return {'mean': grand_mean, 'sem': grand_sem, 'std': grand_std,
-                'n': n_sum, 'items': lines}
+        return {'mean': stats['mean'][0], 'sem': stats['sem'][0],
+                'std': stats['std'][0], 'n': int(stats['n'][0]),
+                'items': lines}
 
     def fill_missing_ns(self, ns):
         """Fill in the missing N's with median N."""
-        none_free_ns = np.array(ns)[ns != np.array(None)]
-
-        if none_free_ns:
-            n_median = int(np.median(none_free_ns))
-        else:
-            n_median = 1  # If no N's reported at all, weigh all means equally
-
-        for i, _ in enumerate(ns):
-            if ns[i] is None:
-                ns[i] = n_median
+        filled = fill_missing_ns(np.array(ns, dtype=float))
+        ns[:] = [int(n) for n in filled]
 
     def fill_missing_sems_stds(self, sems, stds, ns):
         """Fill in computable sems/stds."""
-        for i, _ in enumerate(sems):
-
-            # Check if sem or std is computable
-            if sems[i] is None and stds[i] is not None:
-                sems[i] = stds[i] / np.sqrt(ns[i])
-
-            if stds[i] is None and sems[i] is not None:
-                stds[i] = sems[i] * np.sqrt(ns[i])
-
-        # Fill in the remaining missing using median std
-        none_free_stds = np.array(stds)[stds != np.array(None)]
-
-        if none_free_stds:
-            std_median = np.median(none_free_stds)
-
-        else:  # If no stds or SEMs reported at all, raise error
-
-            # Perhaps the median std of all cells for this property could
-            # be used. However, NE API nes interface does not support summary
-            # prop values without specifying the neuron id
+        sems_, stds_ = fill_missing_sems_stds(np.array(sems, dtype=float),
+                                              np.array(stds, dtype=float),
+                                              np.array(ns, dtype=float))
+        if np.isnan(stds_).any():
             msg = 'No StDevs or SEMs reported for "%s" property "%s"'
             msg = msg % (self.neuron_name, self.ephysprop_name)
             raise NotImplementedError(msg)
+        sems[:] = sems_.tolist()
+        stds[:] = stds_.tolist()
 
-        for i, _ in enumerate(stds):
-            if stds[i] is None:
-                stds[i] = std_median
-                sems[i] = std_median / np.sqrt(ns[i])
+
+def main(argv=None):
+    """Prefetch the records of neurons into the local store, e.g.
+
+        python -m neuronunit.neuroelectro nifext_50 sao830368389
+    """
+    import argparse
+    parser = argparse.ArgumentParser(
+        prog='python -m neuronunit.neuroelectro',
+        description="Download the NeuroElectro records of neurons into a "
+                    "local store, for offline test construction.")
+    parser.add_argument('nlex_ids', nargs='+', metavar='NLEX_ID',
+                        help="NeuroLex IDs of the neurons")
+    parser.add_argument('--store', default=None,
+                        help="SQLite file (default: $NU_NEUROELECTRO_STORE "
+                             "or ~/.cache/neuronunit/neuroelectro.sqlite)")
+    parser.add_argument('--workers', type=int, default=8,
+                        help="concurrent requests")
+    args = parser.parse_args(argv)
+    store = set_store(args.store) if args.store else get_store()
+    count = store.prefetch(args.nlex_ids, workers=args.workers)
+    print("Stored %d records of %d neurons in %s"
+          % (count, len(args.nlex_ids), store.path))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,15 @@
+"""NeuronUnit interface to NeuroML-DB.org.
+
+Waveforms of a model are downloaded concurrently by
+NeuroMLDBModel.fetch_waveforms(), and kept, resampled, in an on-disk cache
+of float32 arrays at $NU_NEUROMLDB_CACHE (by default,
+~/.cache/neuronunit/neuromldb), so that they are downloaded once.
+"""
+
+import os
 import sys, json, quantities
-from scipy.interpolate import interp1d
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from neo import AnalogSignal
 from neuronunit.models.static import StaticModel
@@ -10,6 +20,74 @@ if sys.version_info[0] >= 3:
 else:
     import urllib
 
+
+class WaveformCache(object):
+    """A directory of resampled waveforms, one .npy file of float32 values
+    per waveform and resolution."""
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def file(self, waveform_id, resolution_ms):
+        return os.path.join(self.path, '%s-%gms.npy' % (waveform_id,
+                                                        resolution_ms))
+
+    def get(self, waveform_id, resolution_ms):
+        """The cached values, or None."""
+        try:
+            return np.load(self.file(waveform_id, resolution_ms))
+        except (IOError, ValueError):
+            return None
+
+    def put(self, waveform_id, resolution_ms, values):
+        path = self.file(waveform_id, resolution_ms)
+        # Written aside, then renamed, so that readers never see a partial file.
+        tmp = '%s.%d-%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as f:
+            np.save(f, np.asarray(values, dtype=np.float32))
+        os.replace(tmp, path)
+
+
+_cache = None
+
+
+def get_cache():
+    """The WaveformCache of this process, at $NU_NEUROMLDB_CACHE, else at
+    ~/.cache/neuronunit/neuromldb."""
+    global _cache
+    if _cache is None:
+        _cache = WaveformCache(os.environ.get(
+            'NU_NEUROMLDB_CACHE', os.path.join(os.path.expanduser('~'),
+                                               '.cache', 'neuronunit',
+                                               'neuromldb')))
+    return _cache
+
+
+def set_cache(path):
+    """Use the cache at path, for this process and its future workers."""
+    global _cache
+    os.environ['NU_NEUROMLDB_CACHE'] = path
+    _cache = WaveformCache(path)
+    return _cache
+
+
+def decode_csv(text):
+    """The values of a comma-separated list of numbers, as the API returns."""
+    return np.fromstring(text, dtype=float, sep=',')
+
+
+def resample(t, values, resolution_ms):
+    """values at times t (ms, irregularly sampled, as the API returns),
+    linearly interpolated every resolution_ms from the first time, as
+    float32."""
+    if np.any(np.diff(t) < 0):
+        order = np.argsort(t, kind='stable')
+        t, values = t[order], values[order]
+    regular = np.arange(t[0], t[-1], resolution_ms)
+    return np.interp(regular, t, values).astype(np.float32)
+
+
 class NeuroMLDBModel:
     def __init__(self, model_id = "NMLCL000086"):
         self.model_id = model_id
@@ -18,8 +96,14 @@ class NeuroMLDBModel:
         self.waveforms = None
 
         self.waveform_signals = {}
+        self.waveform_arrays = {}  # Resampled values, by (ID, resolution)
         self.url_responses = {}
 
+    def __setstate__(self, state):
+        # Models pickled before waveform_arrays existed do not have it.
+        state.setdefault('waveform_arrays', {})
+        self.__dict__.update(state)
+
     def read_api_url(self, url):
         if url not in self.url_responses:
             response = urllib.urlopen(url).read()
@@ -40,48 +124,66 @@ class NeuroMLDBModel:
 
         return self.waveforms
 
+    def fetch_waveform_array(self, waveform_id, resolution_ms = 0.01):
+        """The values of a waveform, regularly resampled, from memory, else
+        the on-disk cache, else the API."""
+        key = (waveform_id, resolution_ms)
+        if key not in self.waveform_arrays:
+            cache = get_cache()
+            values = cache.get(waveform_id, resolution_ms)
+            if values is None:
+                data = self.read_api_url(self.api_url + "waveform?id=" + str(waveform_id))
+
+                # Interpolate to regularly sampled series (API returns irregularly sampled)
+                values = resample(decode_csv(data["Times"]),
+                                  decode_csv(data["Variable_Values"]),
+                                  resolution_ms)
+                cache.put(waveform_id, resolution_ms, values)
+            self.waveform_arrays[key] = values
+
+        return self.waveform_arrays[key]
+
+    def fetch_waveforms(self, waveform_ids=None, resolution_ms = 0.01, workers=8):
+        """Fetch waveforms (by default, every Voltage waveform of the model)
+        into memory and the on-disk cache, with up to workers concurrent
+        downloads."""
+        if waveform_ids is None:
+            waveform_ids = [w["ID"] for w in self.fetch_waveform_list()
+                            if w["Variable_Name"] == "Voltage"]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(lambda waveform_id: self.fetch_waveform_array(
+                waveform_id, resolution_ms), waveform_ids))
+
     def fetch_waveform_as_AnalogSignal(self, waveform_id, resolution_ms = 0.01, units = "mV"):
 
         # If signal not in cache
         if waveform_id not in self.waveform_signals:
-            # Load api URL into Python
-            data = self.read_api_url(self.api_url + "waveform?id=" + str(waveform_id))
+            signal = self.fetch_waveform_array(waveform_id, resolution_ms)
 
-            # Get time and signal values (from CSV format)
-            t = np.array(data["Times"].split(','),float)
-            signal = np.array(data["Variable_Values"].split(','),float)
-
-            # Interpolate to regularly sampled series (API returns irregularly sampled)
-            sig = interp1d(t,signal,fill_value="extrapolate")
-            signal = sig(np.arange(min(t),max(t),resolution_ms))
-
-            # Convert to neo.AnalogSignal
-            signal = AnalogSignal(signal,units=units, sampling_period=resolution_ms*quantities.ms)
-
-            starts_from_ss = next(w for w in self.waveforms if w["ID"] == waveform_id)["Starts_From_Steady_State"] == 1
+            starts_from_ss = next(w for w in self.fetch_waveform_list() if w["ID"] == waveform_id)["Starts_From_Steady_State"] == 1
 
             if starts_from_ss:
-                rest_wave = self.get_steady_state_waveform()
+                # The same resting values prefix every such waveform.
+                rest_wave = self.fetch_waveform_array(self.get_steady_state_waveform_id(), resolution_ms)
+                signal = np.concatenate((rest_wave, signal))
 
-                t = np.concatenate((rest_wave.times, signal.times + rest_wave.t_stop)) * quantities.s
-                v = np.concatenate((np.array(rest_wave), np.array(signal))) * quantities.mV
+            # Convert to neo.AnalogSignal
+            self.waveform_signals[waveform_id] = AnalogSignal(signal.astype(float), units=units, sampling_period=resolution_ms*quantities.ms)
 
-                signal = AnalogSignal(v, units=units, sampling_period=resolution_ms * quantities.ms)
+        return self.waveform_signals[waveform_id]
 
-            self.waveform_signals[waveform_id] = signal
+    def get_steady_state_waveform_id(self):
+        for w in self.fetch_waveform_list():
+            if w["Protocol_ID"] == "STEADY_STATE" and w["Variable_Name"] == "Voltage":
+                return w["ID"]
 
-        return self.waveform_signals[waveform_id]
+        raise Exception("Did not find the resting waveform." +
+                        " See " + self.api_url + "model?id=" + self.model_id +
+                        " for the list of available model waveforms.")
 
     def get_steady_state_waveform(self):
         if not hasattr(self, "steady_state_waveform") or self.steady_state_waveform is None:
-            for w in self.waveforms:
-                if w["Protocol_ID"] == "STEADY_STATE" and w["Variable_Name"] == "Voltage":
-                    self.steady_state_waveform = self.fetch_waveform_as_AnalogSignal(w["ID"])
-                    return self.steady_state_waveform
-
-            raise Exception("Did not find the resting waveform." +
-                            " See " + self.api_url + "model?id=" + self.model_id +
-                            " for the list of available model waveforms.")
+            self.steady_state_waveform = self.fetch_waveform_as_AnalogSignal(self.get_steady_state_waveform_id())
 
         return self.steady_state_waveform
 
@@ -138,9 +240,12 @@ class NeuroMLDBModel:
 
 
 class NeuroMLDBStaticModel(StaticModel):
-    def __init__(self, model_id, **params):
+    def __init__(self, model_id, prefetch=False, **params):
         self.nmldb_model = NeuroMLDBModel(model_id)
         self.nmldb_model.fetch_waveform_list()
+        if prefetch:
+            # Download every Voltage waveform now, concurrently.
+            self.nmldb_model.fetch_waveforms()
 
     def inject_square_current(self, current):
         self.vm = self.nmldb_model.get_waveform_by_current(current["amplitude"])
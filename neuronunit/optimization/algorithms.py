@@ -20,9 +20,15 @@ Copyright (c) 2016, EPFL/Blue Brain Project
 
 
 
+import os
 import random
 import logging
+import time
+import multiprocessing
+import concurrent.futures
 
+import cloudpickle
+import dask
 import deap.algorithms
 import deap.tools
 import pickle
@@ -30,6 +36,7 @@ import numpy
 
 import copy
 from neuronunit.optimization import optimization_management as om
+from neuronunit import tracing
 
 import pdb
 import math
@@ -71,11 +78,25 @@ def _update_history_and_hof(halloffame,pf, history, population,td):
     return (halloffame,pf)
 
 
-def _record_stats(stats, logbook, gen, population, invalid_count):
+def _record_stats(stats, logbook, gen, population, invalid_count,
+                  surrogate=None):
     '''Update the statistics with the new population'''
-    record = stats.compile(population) if stats is not None else {}
+    # The population is empty while every evaluation so far has been lost.
+    record = stats.compile(population) if stats and population else {}
+    if surrogate is not None:
+        record.update(surrogate.record())
+    if tracing.enabled():
+        # Calls, wall and CPU seconds of each stage since the last record.
+        record['spans'] = tracing.record()
     logbook.record(gen=gen, nevals=invalid_count, **record)
 
+def _with_lost(submitted, evaluated):
+    '''The evaluated individuals, and the submitted ones missing from them,
+    i.e. those for which no rheobase was found'''
+    genes = set(tuple(numpy.ravel(ind)) for ind in evaluated)
+    return list(evaluated) + [ind for ind in submitted
+                              if tuple(numpy.ravel(ind)) not in genes]
+
 def gene_bad(offspring):
     gene_bad = False
     for o in offspring:
@@ -104,6 +125,17 @@ def _get_elite(halloffame, nelite):
     else:
         return list()
 
+def _register_selection(toolbox, selection):
+    '''Register the selection operator called selection as toolbox.select'''
+    set_ = False
+    if str('selIBEA') == selection:
+        toolbox.register("select",tools.selIBEA)
+        set_ = True
+    if str('selNSGA') == selection:
+        toolbox.register("select",selNSGA2)
+        set_ = True
+    assert set_ == True
+
 def eaAlphaMuPlusLambdaCheckpoint(
         population,
         toolbox,
@@ -119,7 +151,13 @@ def eaAlphaMuPlusLambdaCheckpoint(
         cp_filename = None,
         continue_cp = False,
         selection = 'selNSGA2',
-        td=None):
+        td=None,
+        surrogate=None):
+    '''
+    If a surrogate (see surrogate.Surrogate) is given, it is trained on every
+    evaluated individual, and only the offspring it deems most promising are
+    evaluated.
+    '''
     print(halloffame,pf)
     gen_vs_pop = []
 
@@ -140,37 +178,45 @@ def eaAlphaMuPlusLambdaCheckpoint(
         gen_vs_pop.append(population)
         logbook = deap.tools.Logbook()
         logbook.header = ['gen', 'nevals'] + (stats.fields if stats else [])
+        if surrogate is not None:
+            logbook.header += surrogate.fields
         history = deap.tools.History()
 
         # TODO this first loop should be not be repeated !
+        submitted = [ind for ind in population if not ind.fitness.valid]
+        start = time.time()
         invalid_ind = _evaluate_invalid_fitness(toolbox, population)
+        if surrogate is not None:
+            surrogate.update(_with_lost(submitted, invalid_ind),
+                             time.time() - start)
         invalid_count = len(invalid_ind)
         gen_vs_hof = []
         halloffame, pf = _update_history_and_hof(halloffame, pf, history, population, td)
 
         gen_vs_hof.append(halloffame)
-        _record_stats(stats, logbook, start_gen, population, invalid_count)
+        _record_stats(stats, logbook, start_gen, population, invalid_count,
+                      surrogate)
     # Begin the generational process
     for gen in range(start_gen + 1, ngen + 1):
         offspring = _get_offspring(parents, toolbox, cxpb, mutpb)
+        if surrogate is not None:
+            offspring = surrogate.screen(offspring)
 
 
         assert len(offspring)>0
         population = parents + offspring
         gen_vs_pop.append(population)
 
+        submitted = [ind for ind in offspring if not ind.fitness.valid]
+        start = time.time()
         invalid_count = _evaluate_invalid_fitness(toolbox, offspring)
+        if surrogate is not None:
+            surrogate.update(_with_lost(submitted, invalid_count),
+                             time.time() - start)
         halloffame, pf = _update_history_and_hof(halloffame,pf, history, population, td)
-        _record_stats(stats, logbook, gen, population, invalid_count)
-        set_ = False
-
-        if str('selIBEA') == selection:
-            toolbox.register("select",tools.selIBEA)
-            set_ = True
-        if str('selNSGA') == selection:
-            toolbox.register("select",selNSGA2)
-            set_ = True
-        assert set_ == True
+        _record_stats(stats, logbook, gen, population, invalid_count,
+                      surrogate)
+        _register_selection(toolbox, selection)
 
         elite = _get_elite(halloffame, nelite)
         gen_vs_pop.append(copy.copy(population))
@@ -204,3 +250,292 @@ def eaAlphaMuPlusLambdaCheckpoint(
 
 
     return population, halloffame, pf, logbook, history, gen_vs_pop
+
+
+def _evaluate_batch(evaluate, individuals):
+    '''Evaluate individuals with toolbox.evaluate, e.g. on a worker
+
+    Returns the evaluated individuals with their fitness set; individuals that
+    could not be evaluated, i.e. for which no rheobase was found, are dropped.
+    Any other error is raised.
+    '''
+    try:
+        evaluated, fitnesses = evaluate(individuals)
+    except om.RheobaseNotFound:
+        logger.debug('Could not evaluate %s', individuals, exc_info=True)
+        return []
+    for ind, fit in zip(evaluated, fitnesses):
+        ind.fitness.values = fit
+    return [ind for ind in evaluated if ind.fitness.valid]
+
+
+def _evaluate_on_worker(evaluate, individuals, pid):
+    '''_evaluate_batch on a worker of an executor; evaluate may be pickled
+
+    The dask collections that evaluations compute (e.g. in transport.evaluate
+    and fi.find_rheobase) are computed synchronously, in the worker: it is
+    already one of many evaluating in parallel, and would otherwise start a
+    pool of processes of its own, or, on a dask.distributed worker, wait for
+    tasks of its own on the cluster. In a worker process, i.e. not the
+    optimizer's process pid, that holds for every later task too.
+    '''
+    if isinstance(evaluate, bytes):
+        evaluate = cloudpickle.loads(evaluate)
+    if os.getpid() != pid:
+        dask.config.set(scheduler='synchronous')
+        return _evaluate_batch(evaluate, individuals)
+    with dask.config.set(scheduler='synchronous'):
+        return _evaluate_batch(evaluate, individuals)
+
+
+_worker_evaluate = None
+
+
+def _init_worker(evaluate):
+    '''Set up a process of the default executor, given toolbox.evaluate
+    pickled, which is then sent to each worker once rather than per task'''
+    global _worker_evaluate
+    _worker_evaluate = cloudpickle.loads(evaluate)
+    dask.config.set(scheduler='synchronous')
+
+
+def _evaluate_in_pool(individuals):
+    return _evaluate_batch(_worker_evaluate, individuals)
+
+
+class _InFlight(object):
+    '''Evaluations submitted to an executor, collected as they complete
+
+    The executor is either a dask.distributed Client, whose as_completed is
+    used, or a concurrent.futures Executor; by default (None) a pool of
+    max_workers processes, each evaluating one batch at a time, with a
+    NEURON (and dask) of its own. More evaluations can be submitted while
+    earlier ones are still running.
+    '''
+
+    def __init__(self, executor, evaluate, max_workers=None):
+        self.own_executor = executor is None
+        if self.own_executor:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers, initializer=_init_worker,
+                initargs=(cloudpickle.dumps(evaluate),))
+        self.executor = executor
+        self.evaluate = evaluate
+        self.pid = os.getpid()
+        # Future -> (individuals, time submitted)
+        self.pending = {}
+        self.dask = hasattr(executor, 'scheduler_info')
+        if self.dask:
+            from dask.distributed import as_completed
+            self.completed = as_completed()
+        elif not self.own_executor:
+            self.evaluate = cloudpickle.dumps(evaluate)
+
+    def __len__(self):
+        return len(self.pending)
+
+    def submit(self, individuals):
+        if self.dask:
+            future = self.executor.submit(_evaluate_on_worker, self.evaluate,
+                                          individuals, self.pid, pure=False)
+            self.completed.add(future)
+        elif self.own_executor:
+            future = self.executor.submit(_evaluate_in_pool, individuals)
+        else:
+            future = self.executor.submit(_evaluate_on_worker, self.evaluate,
+                                          individuals, self.pid)
+        self.pending[future] = (individuals, time.time())
+
+    def next_done(self):
+        '''Wait for any evaluation to finish, and return the individuals
+        submitted, those evaluated, and the time it took'''
+        if self.dask:
+            future = next(self.completed)
+        else:
+            done, _ = concurrent.futures.wait(
+                self.pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            future = next(iter(done))
+        individuals, start = self.pending.pop(future)
+        return individuals, future.result(), time.time() - start
+
+    def close(self):
+        if self.own_executor:
+            for future in self.pending:
+                future.cancel()
+            self.executor.shutdown(wait=False)
+
+
+def _breed(population, toolbox, cxpb, mutpb, surrogate=None):
+    '''Offspring of two parents drawn from the population, to be evaluated
+
+    With a surrogate, enough pairs of parents are drawn for about two
+    offspring to pass its screening.
+    '''
+    n_pairs = 1
+    if surrogate is not None and surrogate.ready:
+        n_pairs = int(math.ceil(1.0 / surrogate.fraction))
+    offspring = []
+    for i in range(n_pairs):
+        parents = random.sample(population, min(2, len(population)))
+        offspring += _get_offspring(parents, toolbox, cxpb, mutpb)
+    for child in offspring:
+        del child.fitness.values
+    if surrogate is not None:
+        offspring = surrogate.screen(offspring)
+    return offspring
+
+
+def _end_generation(gen, nevals, population, stats, logbook, gen_vs_pop,
+                    halloffame, pf, history, cp_filename, cp_frequency,
+                    surrogate):
+    '''Record the statistics, and write a checkpoint if one is due'''
+    _record_stats(stats, logbook, gen, population, nevals, surrogate)
+    gen_vs_pop.append(copy.copy(population))
+    logger.info(logbook.stream)
+    if(cp_filename and cp_frequency and
+       gen % cp_frequency == 0):
+        cp = dict(population=population,
+                  generation=gen,
+                  halloffame=halloffame,
+                  pf=pf,
+                  history=history,
+                  logbook=logbook,
+                  rndstate=random.getstate())
+        pickle.dump(cp, open(cp_filename, "wb"))
+        logger.debug('Wrote checkpoint to %s', cp_filename)
+
+
+def eaAlphaMuPlusLambdaAsync(
+        population,
+        toolbox,
+        mu,
+        cxpb,
+        mutpb,
+        ngen,
+        stats = None,
+        halloffame = None,
+        pf=None,
+        cp_frequency = 1,
+        cp_filename = None,
+        continue_cp = False,
+        selection = 'selNSGA',
+        td=None,
+        client=None,
+        max_in_flight=None,
+        surrogate=None,
+        batch_size=None):
+    '''Steady-state eaAlphaMuPlusLambdaCheckpoint, without a barrier at the
+    end of each generation.
+
+    Individuals are evaluated in batches of batch_size (by default mu over
+    max_in_flight, so that a generation's worth are in flight), each batch by
+    one call of toolbox.evaluate, which thus still searches for the rheobase
+    of a batch at once. max_in_flight batches (by default one per core) are
+    evaluated at any time, on client: a dask.distributed Client or a
+    concurrent.futures Executor of processes, by default a pool of
+    max_in_flight processes. As soon as a batch is evaluated its individuals
+    join the population, hall of fame and Pareto front, the population is cut
+    back to mu by selection, and offspring of the population take its place
+    in flight.
+
+    The number of evaluations is the same as for ngen generations of
+    eaAlphaMuPlusLambdaCheckpoint, and every mu evaluations count as a
+    generation in the logbook, gen_vs_pop and checkpoints, so the results are
+    interchangeable.
+
+    Individuals without a rheobase are dropped, and om.RheobaseNotFound is
+    raised if that leaves none; any other error of toolbox.evaluate ends the
+    run.
+
+    If a surrogate (see surrogate.Surrogate) is given, it is trained on every
+    evaluated individual, and only the offspring it deems most promising are
+    evaluated.
+    '''
+    _register_selection(toolbox, selection)
+    if max_in_flight is None:
+        max_in_flight = multiprocessing.cpu_count()
+    if batch_size is None:
+        batch_size = max(1, mu // max_in_flight)
+    gen_vs_pop = []
+
+    if continue_cp:
+        # A file name has been given, then load the data from the file;
+        # evaluations that were in flight are bred again.
+        cp = pickle.load(open(cp_filename, "rb"))
+        population = cp["population"]
+        start_gen = cp["generation"]
+        halloffame = cp["halloffame"]
+        pf = cp["pf"]
+        logbook = cp["logbook"]
+        history = cp["history"]
+        random.setstate(cp["rndstate"])
+        unevaluated = []
+        budget = (ngen - start_gen) * mu
+    else:
+        start_gen = 0
+        logbook = deap.tools.Logbook()
+        logbook.header = ['gen', 'nevals'] + (stats.fields if stats else [])
+        if surrogate is not None:
+            logbook.header += surrogate.fields
+        history = deap.tools.History()
+        unevaluated = [ind for ind in population if not ind.fitness.valid]
+        population = [ind for ind in population if ind.fitness.valid]
+        budget = len(unevaluated) + (ngen - 1) * mu
+
+    in_flight = _InFlight(client, toolbox.evaluate, max_in_flight)
+    offspring = []
+    gen = start_gen
+    submitted = 0
+    nevals = 0
+    try:
+        while True:
+            # Keep max_in_flight batches in evaluation, starting with the
+            # initial population.
+            while len(in_flight) < max_in_flight and submitted < budget:
+                batch = []
+                while len(batch) < min(batch_size, budget - submitted):
+                    if unevaluated:
+                        batch.append(unevaluated.pop(0))
+                    elif population:
+                        while not offspring:
+                            offspring = _breed(population, toolbox, cxpb,
+                                               mutpb, surrogate)
+                        batch.append(offspring.pop(0))
+                    else:
+                        # Nothing to breed from until a batch is evaluated.
+                        break
+                if not batch:
+                    break
+                in_flight.submit(batch)
+                submitted += len(batch)
+            if not len(in_flight):
+                break
+
+            submitted_ind, evaluated, seconds = in_flight.next_done()
+            nevals += len(submitted_ind)
+            if surrogate is not None:
+                surrogate.update(_with_lost(submitted_ind, evaluated), seconds)
+            if evaluated:
+                population = population + evaluated
+                halloffame, pf = _update_history_and_hof(
+                    halloffame, pf, history, evaluated, td)
+                if len(population) > mu:
+                    population = toolbox.select(population, mu)
+            while nevals >= mu:
+                gen += 1
+                _end_generation(gen, mu, population, stats, logbook,
+                                gen_vs_pop, halloffame, pf, history,
+                                cp_filename, cp_frequency, surrogate)
+                nevals -= mu
+        if nevals:
+            gen += 1
+            _end_generation(gen, nevals, population, stats, logbook,
+                            gen_vs_pop, halloffame, pf, history,
+                            cp_filename, cp_frequency, surrogate)
+    finally:
+        in_flight.close()
+    if not population:
+        raise om.RheobaseNotFound('All %d evaluations were lost'
+                                  % (submitted,))
+
+    return population, halloffame, pf, logbook, history, gen_vs_pop
@@ -22,6 +22,7 @@ Copyright (c) 2016, EPFL/Blue Brain Project
 # pylint: disable=R0912, R0914
 from neuronunit.optimization import optimization_management
 
+import os
 import random
 import logging
 import functools
@@ -161,7 +162,7 @@ class SciUnitOptimization(bluepyopt.optimisations.Optimisation):
         return mps, tl
 
     def setnparams(self, nparams = 10, provided_dict = None):
-        self.params = optimization_management.create_subset(nparams = nparams,provided_dict = provided_dict)
+        self.params = optimization_management.create_subset(nparams = nparams,boundary_dict = provided_dict)
         self.nparams = len(self.params)
         self.params , self.td = self.transdict(self.params)
         return self.params, self.td
@@ -177,10 +178,10 @@ class SciUnitOptimization(bluepyopt.optimisations.Optimisation):
     def grid_sample_init(self, nparams):
         from neuronunit.optimization import exhaustive_search as es
         npoints = self.offspring_size ** (1.0/len(list(self.params)))
-        npoints = np.ceil(npoints)
+        npoints = int(np.ceil(npoints))
         nparams = len(self.params)
         provided_keys = list(self.params.keys())
-        dic_grid, _ = es.create_grid(npoints = npoints, provided_keys = self.params)
+        dic_grid = es.create_grid(mp_in = self.params, npoints = npoints, free_params = self.params)
         delta = int(np.abs(len(dic_grid) - (npoints ** len(list(self.params)))))
         pop = []
 
@@ -307,8 +308,30 @@ class SciUnitOptimization(bluepyopt.optimisations.Optimisation):
             offspring_size=None,
             continue_cp=False,
             cp_filename=None,
-            cp_frequency=0):
-        """Run optimisation"""
+            cp_frequency=0,
+            asynchronous=False,
+            client=None,
+            max_in_flight=None,
+            surrogate=None,
+            trace=None,
+            batch_size=None):
+        """Run optimisation
+
+        With asynchronous=True, individuals are evaluated in batches of
+        batch_size, max_in_flight batches at a time, on client (a
+        dask.distributed Client, by default a pool of processes; see
+        algorithms.eaAlphaMuPlusLambdaAsync), rather than a generation at a
+        time, so that no core waits for the slowest model of a generation.
+
+        With surrogate=True (or a surrogate.Surrogate), offspring are
+        screened by a surrogate model trained on the evaluated individuals,
+        and only the most promising are evaluated.
+
+        With trace (a path), the time spent in each stage of the evaluation
+        (rheobase searches, simulations, predictions, scoring, dask) is
+        recorded, per generation in the logbook, and as a Chrome trace
+        written to trace; see neuronunit.tracing.
+        """
         # Allow run function to override offspring_size
         # TODO probably in the future this should not be an object field anymore
         # keeping for backward compatibility
@@ -325,22 +348,62 @@ class SciUnitOptimization(bluepyopt.optimisations.Optimisation):
         stats.register("std", numpy.std)
         stats.register("min", numpy.min)
         stats.register("max", numpy.max)
-        pop, hof, pf, log, history, gen_vs_pop = algorithms.eaAlphaMuPlusLambdaCheckpoint(
-            pop,
-            self.toolbox,
-            offspring_size,
-            self.cxpb,
-            self.mutpb,
-            max_ngen,
-            stats=stats,
-            halloffame=hof,
-            pf=pf,
-            nelite=self.elite_size,
-            cp_frequency=cp_frequency,
-            continue_cp=continue_cp,
-            cp_filename=cp_filename,
-            selection = self.selection,
-            td = self.td)
+        if surrogate is True:
+            from neuronunit.optimization.surrogate import Surrogate
+            surrogate = Surrogate([np.min(self.params[v]) for v in self.td],
+                                  [np.max(self.params[v]) for v in self.td],
+                                  seed=self.seed)
+        if trace is not None:
+            from neuronunit import tracing
+            was_tracing = tracing.enabled()
+            trace_dir = tracing.enable(os.environ.get('NU_TRACE'))
+            if client is not None and hasattr(client, 'run'):
+                # Workers of a dask.distributed cluster already running.
+                client.run(tracing.enable, trace_dir)
+        try:
+            if asynchronous:
+                pop, hof, pf, log, history, gen_vs_pop = algorithms.eaAlphaMuPlusLambdaAsync(
+                    pop,
+                    self.toolbox,
+                    offspring_size,
+                    self.cxpb,
+                    self.mutpb,
+                    max_ngen,
+                    stats=stats,
+                    halloffame=hof,
+                    pf=pf,
+                    cp_frequency=cp_frequency,
+                    continue_cp=continue_cp,
+                    cp_filename=cp_filename,
+                    selection = self.selection,
+                    td = self.td,
+                    client = client,
+                    max_in_flight = max_in_flight,
+                    surrogate = surrogate,
+                    batch_size = batch_size)
+            else:
+                pop, hof, pf, log, history, gen_vs_pop = algorithms.eaAlphaMuPlusLambdaCheckpoint(
+                    pop,
+                    self.toolbox,
+                    offspring_size,
+                    self.cxpb,
+                    self.mutpb,
+                    max_ngen,
+                    stats=stats,
+                    halloffame=hof,
+                    pf=pf,
+                    nelite=self.elite_size,
+                    cp_frequency=cp_frequency,
+                    continue_cp=continue_cp,
+                    cp_filename=cp_filename,
+                    selection = self.selection,
+                    td = self.td,
+                    surrogate = surrogate)
+        finally:
+            if trace is not None:
+                tracing.write_chrome_trace(trace)
+                if not was_tracing:
+                    tracing.disable()
 
         # insert the initial HOF value back in.
         td = self.td
@@ -9,6 +9,7 @@ from collections import OrderedDict
 from neuronunit.optimization.model_parameters import model_params
 from neuronunit.optimization import data_transport_container
 from neuronunit.optimization.optimization_management import nunit_evaluation, update_deap_pop
+from neuronunit.optimization.optimization_management import RheobaseNotFound
 from neuronunit.optimization.optimization_management import update_dtc_pop
 import numpy as np
 from collections import OrderedDict
@@ -16,6 +17,7 @@ from collections import OrderedDict
 
 import copy
 from copy import deepcopy
+import itertools
 import math
 
 import dask.bag as db
@@ -42,7 +44,6 @@ class WSListIndividual(list):
         super(WSListIndividual, self).__init__(*args, **kwargs)
 
 
-@jit
 def reduce_params(model_params,nparams):
     key_list = list(model_params.keys())
     reduced_key_list = key_list[0:nparams]
@@ -122,7 +123,6 @@ def sample_points(iter_dict, npoints=2):
     return replacement
 '''
 
-@jit
 def update_dtc_grid(item_of_iter_list):
 
     dtc = data_transport_container.DataTC()
@@ -132,7 +132,6 @@ def update_dtc_grid(item_of_iter_list):
     dtc.evaluated = False
     dtc.backend = 'NEURON'
     return dtc
-@jit
 def create_a_map(subset):
     maps = {}
     for k,v in subset.items():
@@ -228,7 +227,6 @@ def create_grid(mp_in = None, npoints = 3, free_params = None, ga = None):
     grid = list(ParameterGrid(subset))
     return grid
 
-@jit
 def tfg2i(x, y, z):
     '''
     translate_float_grid_to_index
@@ -263,7 +261,6 @@ def tfc2i(x, y, z,err):
 
 
 
-@jit
 def transdict(dictionaries):
     from collections import OrderedDict
     mps = OrderedDict()
@@ -321,31 +318,320 @@ def run_simple_grid(npoints, tests, ranges, free_params, hold_constant = None):
                 grid_results.extend(results)
     return grid_results
 
-def run_grid(npoints, tests, provided_keys = None, hold_constant = None, ranges=None):
-    subset = mp_in[provided_keys]
-
-    consumable_ ,td = build_chunk_grid(npoints,provided_keys)
-    cnt = 0
-    grid_results = []
-    if type(hold_constant) is not type(None):
-        td, hc = add_constant(hold_constant,consumable_,td)
-    consumable = iter(consumable_)
-    use_cache = None
-    s = None
-
-    for sub_pop in consumable:
-        results = update_deap_pop(sub_pop, tests, td)
-        if type(results) is not None:
-            grid_results.extend(results)
+def grid_subset(npoints, ranges, free_params):
+    '''
+    The sample points of each free parameter, npoints evenly spaced between
+    the bounds of its range, as in run_simple_grid.
+    '''
+    subset = OrderedDict()
+    for k,v in ranges.items():
+        if k in free_params:
+            subset[k] = ( np.min(ranges[k]),np.max(ranges[k]) )
+    return sample_points(subset, npoints = npoints)
 
-        if type(use_cache) is not type(None):
-            if type(s) is not type(None):
-                s['consumable'] = consumable
-                s['cnt'] = cnt
-                s['grid_results'] = grid_results
-                s['sub_pop'] = sub_pop
-        cnt += 1
-        print('done_block_of_N_cells: ',cnt)
-    if type(s) is not type(None):
-        s.close()
-    return grid_results
+def grid_chunks(subset, chunk_size = None, done = ()):
+    '''
+    Lazily yield (chunk index, grid points) for consecutive chunks of the
+    grid of subset, skipping the chunk indices in done.
+    Grid points are only built as their chunk is reached: ParameterGrid
+    can address a point by its index without listing the whole grid, so
+    memory does not grow with the number of free parameters.
+    chunk_size defaults to the number of workers (npartitions).
+    '''
+    if chunk_size is None:
+        chunk_size = npartitions
+    grid = ParameterGrid(subset)
+    nchunks = int(math.ceil(len(grid)/float(chunk_size)))
+    for c in range(nchunks):
+        if c in done:
+            continue
+        stop = min(len(grid), (c+1)*chunk_size)
+        yield c, [ grid[i] for i in range(c*chunk_size, stop) ]
+
+class GridLedger(object):
+    '''
+    A persistent record of the chunks of a grid search that have finished,
+    and of their results, in a shelve at path.
+    Each chunk's results are written as soon as it finishes, so a search
+    that is interrupted can resume from the chunks still to do.
+    The grid a ledger belongs to (its sample points and chunk size) is
+    stored with it, so that results of different grids are never mixed;
+    without a subset, an existing ledger is opened to read its results.
+    '''
+    def __init__(self, path, subset = None, chunk_size = None):
+        self.path = path
+        self.shelf = shelve.open(path)
+        if subset is None:
+            return
+        grid = (list(subset.items()), chunk_size)
+        if '__grid__' not in self.shelf:
+            self.shelf['__grid__'] = grid
+            self.shelf.sync()
+        elif self.shelf['__grid__'] != grid:
+            self.shelf.close()
+            raise ValueError('%s holds the results of a different grid'
+                             % path)
+
+    @property
+    def done(self):
+        '''The indices of the finished chunks'''
+        return set(int(k) for k in self.shelf.keys() if k != '__grid__')
+
+    def record(self, chunk, results):
+        '''
+        Mark a chunk as finished, storing a compact (attrs, scores, rheobase)
+        tuple for each individual evaluated.
+        '''
+        self.shelf[str(chunk)] = [ (dict(p.dtc.attrs), dict(p.dtc.scores),
+                                    p.dtc.rheobase) for p in results
+                                   if getattr(p,'dtc',None) is not None ]
+        self.shelf.sync()
+
+    def results(self):
+        '''Yield a DataTC for every individual evaluated, chunk by chunk'''
+        for c in sorted(self.done):
+            for attrs, scores, rheobase in self.shelf[str(c)]:
+                dtc = data_transport_container.DataTC()
+                dtc.attrs = attrs
+                dtc.scores = scores
+                dtc.rheobase = rheobase
+                dtc.evaluated = True
+                dtc.get_ss()
+                yield dtc
+
+    def close(self):
+        self.shelf.close()
+
+def run_streaming_grid(npoints, tests, ranges, free_params, path,
+                       hold_constant = None, chunk_size = None):
+    '''
+    Like run_simple_grid, but with bounded memory, and resumable.
+    Grid points are generated chunk by chunk (see grid_chunks), each chunk
+    is evaluated as a population, and its results are written to the ledger
+    at path (see GridLedger) as soon as it finishes. Calling this again with
+    the same arguments after an interruption only evaluates the chunks that
+    had not finished.
+    Outputs a generator of the DataTCs of every grid point evaluated.
+    '''
+    if chunk_size is None:
+        chunk_size = npartitions
+    subset = grid_subset(npoints, ranges, free_params)
+    ledger = GridLedger(path, subset, chunk_size)
+    try:
+        for c, grid_points in grid_chunks(subset, chunk_size, ledger.done):
+            if type(hold_constant) is not type(None):
+                for g in grid_points:
+                    g.update(hold_constant)
+            td = list(grid_points[0].keys())
+            consumable = [ WSListIndividual(g.values()) for g in grid_points ]
+            results = update_deap_pop(consumable, tests, td)
+            ledger.record(c, results)
+            print('done_block_of_N_cells: ',c)
+    finally:
+        ledger.close()
+    return load_grid_results(path)
+
+def load_grid_results(path):
+    '''Yield a DataTC for every individual in the grid ledger at path'''
+    ledger = GridLedger(path)
+    try:
+        for dtc in ledger.results():
+            yield dtc
+    finally:
+        ledger.close()
+
+def run_grid(npoints, tests, provided_keys = None, hold_constant = None, ranges = None, cache = None):
+    '''
+    Grid search over the provided_keys of ranges (by default every model
+    parameter), checkpointed chunk by chunk to the ledger at cache, so that
+    it resumes where it stopped if run again (see run_streaming_grid).
+    '''
+    if ranges is None:
+        ranges = model_params
+    if provided_keys is None:
+        provided_keys = list(ranges.keys())
+    if cache is None:
+        cache = 'grid_%d_%s.shelve' % (npoints, '_'.join(sorted(provided_keys)))
+    return list(run_streaming_grid(npoints, tests, ranges, provided_keys,
+                                   cache, hold_constant = hold_constant))
+
+class GridFitness(object):
+    '''The errors of a grid point, in the form of a DEAP fitness'''
+    def __init__(self, values):
+        self.values = tuple(values)
+        self.valid = True
+
+class GridCell(object):
+    '''
+    A box of an adaptive grid, between two corners on the lattice of the
+    finest resolution the grid can reach (see AdaptiveGrid).
+    '''
+    def __init__(self, lo, hi, depth):
+        self.lo = tuple(lo)
+        self.hi = tuple(hi)
+        self.depth = depth
+        self.children = []
+
+    def corners(self):
+        return list(itertools.product(*zip(self.lo, self.hi)))
+
+    def contains(self, index):
+        return all(l <= i <= h for l, i, h in zip(self.lo, index, self.hi))
+
+    def split(self):
+        '''Divide the cell in two along every dimension'''
+        mid = tuple((l + h)//2 for l, h in zip(self.lo, self.hi))
+        halves = [ ((l, m), (m, h)) for l, m, h in zip(self.lo, mid, self.hi) ]
+        self.children = [ GridCell([b[0] for b in box], [b[1] for b in box],
+                                   self.depth + 1)
+                          for box in itertools.product(*halves) ]
+        return self.children
+
+class AdaptiveGrid(object):
+    '''
+    A sparse, multi-resolution grid over the ranges of some parameters.
+    It starts as a coarse grid of npoints per parameter, whose cells can be
+    split in two along every dimension up to max_depth times.
+    Grid points are addressed by their integer coordinates on the lattice of
+    the finest resolution, so points shared by neighbouring cells are only
+    evaluated once; points holds the DataTC of each evaluated point (None if
+    no rheobase was found), and cells the root cells of the tree.
+    population() can be used wherever the results of run_simple_grid are
+    (e.g. results_analysis.min_max), and genealogy_history numbers them as
+    that of a DEAP History does.
+    A parameter with equal bounds (i.e. held fixed) has a single value, at
+    lattice coordinate 0.
+    '''
+    def __init__(self, bounds, npoints = 3, max_depth = 3):
+        self.td = list(bounds.keys())
+        self.lower = np.array([ np.min(bounds[k]) for k in self.td ], dtype=float)
+        self.upper = np.array([ np.max(bounds[k]) for k in self.td ], dtype=float)
+        self.max_depth = max_depth
+        self.step = 2**max_depth
+        self.resolution = (npoints - 1)*self.step
+        self.points = OrderedDict()
+        starts = range(0, self.resolution, self.step)
+        self.cells = [ GridCell(lo, [l + self.step for l in lo], 0)
+                       for lo in itertools.product(*[starts]*len(self.td)) ]
+
+    def attrs(self, index):
+        '''The parameter values of the point at lattice coordinates index'''
+        values = self.lower + (self.upper - self.lower)*np.array(index)/float(self.resolution)
+        return OrderedDict(zip(self.td, values.tolist()))
+
+    def error(self, index):
+        '''The summed error of an evaluated point, None if it has none'''
+        dtc = self.points.get(index)
+        if dtc is None or not dtc.scores:
+            return None
+        dtc.get_ss()
+        return dtc.summed
+
+    def leaves(self, cells = None):
+        for cell in (self.cells if cells is None else cells):
+            if cell.children:
+                for leaf in self.leaves(cell.children):
+                    yield leaf
+            else:
+                yield cell
+
+    def locate(self, attrs):
+        '''The finest cell containing a point, given its parameter values'''
+        x = np.array([ float(attrs[k]) for k in self.td ])
+        width = self.upper - self.lower
+        fixed = width == 0
+        width[fixed] = 1.0
+        index = np.rint((x - self.lower)/width*self.resolution)
+        index[fixed] = 0
+        cells = self.cells
+        cell = None
+        while cells:
+            cell = next((c for c in cells if c.contains(index)), None)
+            if cell is None:
+                return None
+            cells = cell.children
+        return cell
+
+    def population(self):
+        '''The evaluated points, as individuals carrying their DataTC'''
+        pop = []
+        for index, dtc in self.points.items():
+            if dtc is None or not dtc.scores:
+                continue
+            ind = WSListIndividual(self.attrs(index).values())
+            ind.dtc = dtc
+            ind.rheobase = dtc.rheobase
+            ind.fitness = GridFitness(dtc.scores.values())
+            pop.append(ind)
+        return pop
+
+    @property
+    def genealogy_history(self):
+        return dict(enumerate(self.population()))
+
+    def minimum(self):
+        '''The DataTC of the evaluated point of lowest summed error'''
+        errors = [ (self.error(i), i) for i in self.points ]
+        errors = [ e for e in errors if e[0] is not None ]
+        return self.points[min(errors)[1]] if errors else None
+
+def evaluate_grid_points(grid, indices, tests, hold_constant = None, chunk_size = None):
+    '''
+    Evaluate the points of an adaptive grid at the lattice coordinates
+    indices, chunk_size (by default, one per worker) at a time.
+    '''
+    if chunk_size is None:
+        chunk_size = npartitions
+    indices = [ i for i in indices if i not in grid.points ]
+    for chunk in chunks(indices, chunk_size):
+        grid_points = [ grid.attrs(i) for i in chunk ]
+        if type(hold_constant) is not type(None):
+            for g in grid_points:
+                g.update(hold_constant)
+        td = list(grid_points[0].keys())
+        consumable = [ WSListIndividual(g.values()) for g in grid_points ]
+        try:
+            update_deap_pop(consumable, tests, td)
+        except RheobaseNotFound:
+            # No rheobase for any model in the chunk.
+            pass
+        for i, ind in zip(chunk, consumable):
+            grid.points[i] = getattr(ind, 'dtc', None)
+
+def run_adaptive_grid(npoints, tests, ranges, free_params, hold_constant = None,
+                      max_depth = 3, error_quantile = 0.25, gradient_quantile = 0.9):
+    '''
+    Like run_simple_grid, but only refining the grid where it matters.
+    The grid starts with npoints per free parameter. At every level, each
+    cell is split in two along every dimension (at most max_depth times) if
+    its lowest corner error is among the lowest error_quantile of the cells
+    at that level, or if the spread of its corner errors (the gradient
+    across it) is among the top 1 - gradient_quantile. Points with no
+    rheobase count as the worst error seen.
+    Outputs an AdaptiveGrid.
+    '''
+    bounds = OrderedDict()
+    for k,v in ranges.items():
+        if k in free_params:
+            bounds[k] = ( np.min(ranges[k]),np.max(ranges[k]) )
+    grid = AdaptiveGrid(bounds, npoints = npoints, max_depth = max_depth)
+    cells = grid.cells
+    while cells:
+        corners = OrderedDict((c, None) for cell in cells for c in cell.corners())
+        evaluate_grid_points(grid, corners.keys(), tests, hold_constant)
+        errors = [ grid.error(i) for i in grid.points ]
+        errors = [ e for e in errors if e is not None ]
+        if not errors or cells[0].depth == max_depth:
+            break
+        worst = np.max(errors)
+        corner_errors = []
+        for cell in cells:
+            e = [ grid.error(c) for c in cell.corners() ]
+            corner_errors.append([ worst if x is None else x for x in e ])
+        low = np.quantile([ np.min(e) for e in corner_errors ], error_quantile)
+        spreads = [ np.max(e) - np.min(e) for e in corner_errors ]
+        steep = np.quantile(spreads, gradient_quantile)
+        cells = [ child for cell, e, spread in zip(cells, corner_errors, spreads)
+                  if np.min(e) <= low or (spread >= steep and spread > 0)
+                  for child in cell.split() ]
+    return grid
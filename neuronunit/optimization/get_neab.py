@@ -29,14 +29,16 @@ def neuroelectro_summary_observation(neuron,ontology):
 import urllib.request, json
 
 def get_obs(pipe):
-    with urllib.request.urlopen("https://neuroelectro.org/api/1/e/") as url:
-        ontologies = json.loads(url.read().decode())
-        #print(ontologies)
-    #with urllib.request.urlopen("https://neuroelectro.org/api/1/e/") as url:
-    #    ontologies = json.loads(url.read().decode())
+    # Download every record of the neurons at once, concurrently, so that
+    # each observation below is looked up in the local store.
+    try:
+        neuroelectro.prefetch(pipe)
+    except neuroelectro.NeuroElectroError:
+        pass  # Each observation is then looked up on its own.
+    ontologies = neuroelectro.get_store().ephysprops()
     obs = []
     for p in pipe:
-        for l in ontologies['objects']:
+        for l in ontologies:
             obs.append(neuroelectro_summary_observation(p,l))
     return obs
 
@@ -101,6 +103,10 @@ def get_neuron_criteria(cell_id,file_name = None):#,observation = None):
                      waveform.InjectedCurrentAPAmplitudeTest,
                      waveform.InjectedCurrentAPThresholdTest]#,
     observations = {}
+    try:
+        neuroelectro.prefetch([cell_id])
+    except neuroelectro.NeuroElectroError:
+        pass  # Each test's observation is then looked up on its own.
     for index, t in enumerate(test_classes):
         try:
             obs = t.neuroelectro_summary_observation(cell_id)
@@ -51,7 +51,6 @@ class WSFloatIndividual(float):
         self.rheobase = None
         super(WSFloatIndividual, self).__init__()
 
-@jit
 def write_opt_to_nml(path,param_dict):
     '''
     Write optimimal simulation parameters back to NeuroML.
@@ -5,6 +5,7 @@ import dask.bag as db
 import pandas as pd
 from neuronunit import tests
 from neuronunit.models.reduced import ReducedModel
+from neuronunit.models.static import StaticModel
 from neuronunit.optimization.model_parameters import model_params, path_params
 import numpy
 from neuronunit.optimization import model_parameters as modelp
@@ -19,6 +20,8 @@ from pyneuroml import pynml
 
 from deap import base
 from neuronunit.optimization.data_transport_container import DataTC
+from neuronunit.optimization import transport
+from neuronunit import tracing
 
 
 import os
@@ -41,6 +44,9 @@ logger = logging.getLogger('__main__')
 
 from neuronunit.tests.fi import RheobaseTestP# as discovery
 from neuronunit.tests.fi import RheobaseTest# as discovery
+from neuronunit.tests.fi import find_rheobase_population, get_batch_simulator
+from neuronunit.tests.fi import RHEOBASE_MEMO
+from neuronunit.tests.fi import DEFAULT_INJECTED_SQUARE_CURRENT
 
 import dask.bag as db
 # The rheobase has been obtained seperately and cannot be db mapped.
@@ -67,7 +73,6 @@ def mint_generic_model(backend):
     LEMS_MODEL_PATH = path_params['model_path']
     return ReducedModel(LEMS_MODEL_PATH,name = str('vanilla'),backend = str(backend))
 
-@jit
 def write_opt_to_nml(path,param_dict):
     '''
     Write optimimal simulation parameters back to NeuroML.
@@ -93,16 +98,18 @@ def write_opt_to_nml(path,param_dict):
     return
 
 
-def bridge_judge(test_and_models):
+def bridge_judge(test_and_models, model = None):
     # Temporarily patch sciunit judge code, which seems to be broken.
-    #
-    #
+    # An already simulated model (see protocol_models) can be passed in,
+    # otherwise a new one is minted from the dtc.
     (test, dtc) = test_and_models
     obs = test.observation
-    backend_ = dtc.backend
-    model = mint_generic_model(backend_)
-    model.set_attrs(**dtc.attrs)
-    pred = test.generate_prediction(model)
+    if model is None:
+        backend_ = dtc.backend
+        model = mint_generic_model(backend_)
+        model.set_attrs(**dtc.attrs)
+    with tracing.span('generate_prediction', test=test.name):
+        pred = test.generate_prediction(model)
     if pred is not None:
         if hasattr(dtc,'prediction'):# is not None:
             dtc.prediction[test] = pred
@@ -118,7 +125,8 @@ def bridge_judge(test_and_models):
 
 
         #dtc.prediction = pred
-        score = test.compute_score(obs,pred)
+        with tracing.span('compute_score', test=test.name):
+            score = test.compute_score(obs,pred)
         if not hasattr(dtc,'agreement'):
             dtc.agreement = None
             dtc.agreement = {}
@@ -155,6 +163,7 @@ def get_rh(dtc,rtest):
     return dtc
 
 
+@tracing.traced('rheobase')
 def dtc_to_rheo(dtc):
     # If  test taking data, and objects are present (observations etc).
     # Take the rheobase test and store it in the data transport container.
@@ -168,33 +177,66 @@ def dtc_to_rheo(dtc):
 
     if len(rtest):
         rtest = rtest[0]
+        # Don't leave the memo on the test, which is shipped to workers.
+        rtest.memo = RHEOBASE_MEMO
+        try:
+            dtc.rheobase = rtest.generate_prediction(model)
+        finally:
+            rtest.memo = None
+        dtc = rheo_to_scores(dtc,rtest)
 
-        dtc.rheobase = rtest.generate_prediction(model)
-        #print(dtc.rheobase)
-        if dtc.rheobase is not None and dtc.rheobase !=-1.0:
-            dtc.rheobase = dtc.rheobase['value']
-            obs = rtest.observation
-            score = rtest.compute_score(obs,dtc.rheobase)
-            dtc.scores[str('RheobaseTestP')] = 1.0 - score.norm_score
-
-            if dtc.score is not None:
-                dtc = score_proc(dtc,rtest,copy.copy(score))
+    else:
+        # otherwise, if no observation is available, or if rheobase test score is not desired.
+        # Just generate rheobase predictions, giving the models the freedom of rheobase
+        # discovery without test taking.
+        dtc = get_rh(dtc,rtest)
+    return dtc
 
-            rtest.params['injected_square_current']['amplitude'] = dtc.rheobase
 
-        else:
-            dtc.rheobase = - 1.0
-            dtc.scores[str('RheobaseTestP')] = 1.0
+def rheo_to_scores(dtc,rtest):
+    # Score a rheobase prediction, stored in dtc.rheobase, against rtest.
+    if dtc.rheobase is not None and dtc.rheobase !=-1.0:
+        dtc.rheobase = dtc.rheobase['value']
+        obs = rtest.observation
+        score = rtest.compute_score(obs,dtc.rheobase)
+        dtc.scores[str('RheobaseTestP')] = 1.0 - score.norm_score
 
+        if dtc.score is not None:
+            dtc = score_proc(dtc,rtest,copy.copy(score))
 
+        # Tests built from NeuroElectro observations carry no current yet.
+        rtest.params.setdefault('injected_square_current',
+                                DEFAULT_INJECTED_SQUARE_CURRENT.copy()
+                                )['amplitude'] = dtc.rheobase
 
     else:
-        # otherwise, if no observation is available, or if rheobase test score is not desired.
-        # Just generate rheobase predictions, giving the models the freedom of rheobase
-        # discovery without test taking.
-        dtc = get_rh(dtc,rtest)
+        dtc.rheobase = - 1.0
+        dtc.scores[str('RheobaseTestP')] = 1.0
     return dtc
 
+@tracing.traced('rheobase_population')
+def dtcpop_to_rheo(dtcpop):
+    # Population level version of dtc_to_rheo for backends that can
+    # simulate many models at once (RAW, HH).
+    # The rheobase brackets of every individual are narrowed together,
+    # so that each step of the search is a single batched simulation for
+    # the whole generation, rather than one simulation per individual.
+    for dtc in dtcpop:
+        dtc.scores = {}
+        dtc.score = {}
+    dtcpop = find_rheobase_population(dtcpop, memo=RHEOBASE_MEMO)
+    for dtc in dtcpop:
+        if dtc.rheobase is not None and dtc.rheobase != -1:
+            dtc.rheobase = {'value': float(dtc.rheobase)*pq.pA}
+        else:
+            dtc.rheobase = None
+        rtest = [ t for t in dtc.tests if str('RheobaseTestP') == t.name ]
+        if len(rtest):
+            dtc = rheo_to_scores(dtc,rtest[0])
+        elif dtc.rheobase is None:
+            dtc.rheobase = - 1.0
+    return dtcpop
+
 
 def score_proc(dtc,t,score):
     dtc.score[str(t)] = {}
@@ -295,6 +337,42 @@ def format_test(dtc):
 
 
 
+def protocol_key(current):
+    # A hashable description of a square current injection protocol.
+    return tuple( (k, float(current[k])) for k in ('amplitude','delay','duration') )
+
+@tracing.traced()
+def simulate_protocol(dtc, current):
+    # Run one square current protocol on the model described by dtc.
+    model = mint_generic_model(dtc.backend)
+    model.set_attrs(**dtc.attrs)
+    model.set_run_params(t_stop = current['delay'] + current['duration'] + 200.0*pq.ms)
+    model.inject_square_current(current)
+    return model.get_membrane_potential()
+
+def protocol_models(dtc, tests):
+    # Evaluation planner: group the tests by their injected_square_current
+    # protocol (see format_test), simulate each distinct protocol only once,
+    # and give every test in the group the same StaticModel replaying that
+    # trace (so that its APs are also only extracted once).
+    # For the standard NeuroElectro suite this is one active (rheobase) and
+    # one passive (-10 pA) simulation, rather than one per test.
+    # Returns a dictionary from test index to model. Tests without a square
+    # current protocol, and rheobase tests, get no entry.
+    traces = {}
+    models = {}
+    for k,t in enumerate(tests):
+        if str('RheobaseTest') == t.name or str('RheobaseTestP') == t.name:
+            continue
+        if 'injected_square_current' not in dtc.vtest.get(k,{}):
+            continue
+        current = dtc.vtest[k]['injected_square_current']
+        key = protocol_key(current)
+        if key not in traces:
+            traces[key] = StaticModel(simulate_protocol(dtc, current))
+        models[k] = traces[key]
+    return models
+
 def allocate_worst(dtc,tests):
     # If the model fails tests, and cannot produce model driven data
     # Allocate the worst score available.
@@ -317,10 +395,11 @@ def nunit_evaluation_df(dtc):
     if dtc.rheobase == -1.0 or type(dtc.rheobase) is type(None):
         dtc = allocate_worst(tests,dtc)
     else:
+        models = protocol_models(dtc, tests)
         for k,t in enumerate(tests):
             if str('RheobaseTest') != t.name and str('RheobaseTestP') != t.name:
                 t.params = dtc.vtest[k]
-                score, dtc= bridge_judge((t,dtc))
+                score, dtc= bridge_judge((t,dtc), model = models.get(k))
                 if score is not None:
                     if score.norm_score is not None:
                         dtc.scores[str(t)] = 1.0 - score.norm_score
@@ -342,6 +421,7 @@ def nunit_evaluation_df(dtc):
     return dtc
 
 
+@tracing.traced()
 def nunit_evaluation(dtc):
     # Inputs single data transport container modules, and neuroelectro observations that
     # inform test error error_criterion
@@ -354,10 +434,12 @@ def nunit_evaluation(dtc):
     if dtc.rheobase == -1.0 or type(dtc.rheobase) is type(None):
         dtc = allocate_worst(tests,dtc)
     else:
+        # One simulation per distinct protocol, shared by its tests.
+        models = protocol_models(dtc, tests)
         for k,t in enumerate(tests):
             if str('RheobaseTest') != t.name and str('RheobaseTestP') != t.name:
                 t.params = dtc.vtest[k]
-                score, dtc= bridge_judge((t,dtc))
+                score, dtc= bridge_judge((t,dtc), model = models.get(k))
                 if score is not None:
                     if score.norm_score is not None:
                         dtc.scores[str(t)] = 1.0 - score.norm_score
@@ -421,9 +503,8 @@ def update_dtc_pop(pop, td):
         _backend = pop[0].backend
     if isinstance(pop, Iterable):# and type(pop[0]) is not type(str('')):
         xargs = zip(pop,repeat(td),repeat(_backend))
-        npart = np.min([multiprocessing.cpu_count(),len(pop)])
-        bag = db.from_sequence(xargs, npartitions = npart)
-        dtcpop = list(bag.map(transform).compute())
+        # transform is far cheaper than pickling DataTCs to dask and back.
+        dtcpop = list(map(transform,xargs))
         assert len(dtcpop) == len(pop)
     else:
         for p in pop:
@@ -504,6 +585,7 @@ def init_pop(pop, td, tests):
 
     return pop, dtcpop
 
+@tracing.traced()
 def obtain_rheobase(pop, td, tests):
     '''
     Calculate rheobase for a given population pop
@@ -511,7 +593,10 @@ def obtain_rheobase(pop, td, tests):
     and rheobase test rt
     '''
     pop, dtcpop = init_pop(pop, td, tests)
-    dtcpop = list(map(dtc_to_rheo,dtcpop))
+    if get_batch_simulator(dtcpop[0].backend) is not None:
+        dtcpop = dtcpop_to_rheo(dtcpop)
+    else:
+        dtcpop = list(map(dtc_to_rheo,dtcpop))
     for ind,d in zip(pop,dtcpop):
         if type(d.rheobase) is not type(1.0):
             ind.rheobase = d.rheobase
@@ -584,14 +669,14 @@ def filtered(pop,dtcpop):
     return (pop,dtcpop)
 
 
+@tracing.traced()
 def parallel_route(pop,dtcpop,tests,td):
     for d in dtcpop:
         d.tests = copy.copy(tests)
     dtcpop = list(map(format_test,dtcpop))
-    #import pdb; pdb.set_trace()
     npart = np.min([multiprocessing.cpu_count(),len(dtcpop)])
-    dtcbag = db.from_sequence(dtcpop, npartitions = npart)
-    dtcpop = list(dtcbag.map(nunit_evaluation).compute())
+    # Only parameter vectors go out to the workers, and score vectors back.
+    dtcpop = transport.evaluate(dtcpop, tests, npartitions = npart)
     for i,d in enumerate(dtcpop):
         if not hasattr(pop[i],'dtc'):
             pop[i] = WSListIndividual(pop[i])
@@ -601,11 +686,16 @@ def parallel_route(pop,dtcpop,tests,td):
     invalid_dtc_not = [ i for i in pop if not hasattr(i,'dtc') ]
     return pop, dtcpop
 
+class RheobaseNotFound(Exception):
+    '''No model of a population has a rheobase, so none can be scored'''
+
+
 def make_up_lost(pop,dtcpop,td):
     before = len(pop)
     (pop,dtcpop) = filtered(pop,dtcpop)
     after = len(pop)
-    assert after>0
+    if not after:
+        raise RheobaseNotFound('None of %d models has a rheobase' % before)
     delta = before-after
     if delta:
         cnt = 0
@@ -639,6 +729,7 @@ def test_runner(pop,td,tests,single_spike=True):
     return pop,dtcpop
 
 
+@tracing.traced()
 def update_deap_pop(pop, tests, td, backend = None,hc = None):
     '''
     Inputs a population of genes (pop).
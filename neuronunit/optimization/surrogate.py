@@ -0,0 +1,158 @@
+"""Surrogate models that pre-screen GA offspring before they are simulated.
+
+Most offspring bred by the GA are dominated, and many have no rheobase at
+all, yet each one costs a rheobase search and a run of the test suite.  A
+Surrogate is trained online on every individual evaluated so far, and
+predicts the errors (fitness values) of new offspring and the probability
+that a rheobase will be found for them, so that only the most promising
+fraction of the offspring is simulated.
+"""
+
+import math
+
+import numpy as np
+
+
+class Surrogate(object):
+    """Random-feature Gaussian process over the genes of a GA.
+
+    Errors are modelled by Bayesian linear regression on random Fourier
+    features of an RBF kernel (i.e. an approximate GP, one output per
+    objective), and the probability of a valid rheobase by kernel-weighted
+    counts of past successes and failures.  Genes are scaled to [0, 1] by
+    the parameter bounds, so length_scale is relative to the search range.
+    """
+
+    # Per-generation statistics, see record().
+    fields = ['screened', 'simulated', 'hit_rate', 'saved_s']
+
+    def __init__(self, lower, upper, fraction=0.5, min_samples=10,
+                 n_features=256, length_scale=0.2, noise=0.05, kappa=1.0,
+                 seed=None):
+        self.lower = np.asarray(lower, dtype=float)
+        self.upper = np.asarray(upper, dtype=float)
+        self.fraction = fraction
+        self.min_samples = min_samples
+        self.length_scale = length_scale
+        self.noise = noise
+        self.kappa = kappa
+        rng = np.random.RandomState(seed)
+        self.W = rng.normal(scale=1.0/length_scale,
+                            size=(len(self.lower), n_features))
+        self.b = rng.uniform(0, 2*np.pi, size=n_features)
+        self.X = np.empty((0, len(self.lower)))  # Genes, scaled
+        self.valid = np.empty(0, dtype=bool)     # Rheobase found
+        self.Y = None                            # Errors of valid genes
+        self.seconds = []                        # Wall time per evaluation
+        self.fitted = None
+        self._reset_counts()
+
+    def _reset_counts(self):
+        self.screened = 0
+        self.rejected = 0
+        self.simulated = 0
+        self.hits = 0
+
+    def scale(self, genes):
+        """Genes (of one individual per row) as a 2D array, scaled to
+        [0, 1] by the parameter bounds."""
+        genes = np.array([np.ravel(g) for g in genes], dtype=float)
+        span = np.where(self.upper > self.lower, self.upper - self.lower, 1.0)
+        return (genes - self.lower) / span
+
+    def features(self, X):
+        return math.sqrt(2.0/self.W.shape[1]) * np.cos(X.dot(self.W) + self.b)
+
+    @property
+    def ready(self):
+        """Whether enough individuals were evaluated to screen offspring."""
+        return self.Y is not None and len(self.Y) >= self.min_samples
+
+    def update(self, individuals, seconds=None):
+        """Add evaluated individuals to the training data, and refit.
+
+        Individuals without a valid fitness are those for which no rheobase
+        was found.  seconds is the wall time taken to evaluate them, from
+        which the time saved by screening is estimated.
+        """
+        individuals = list(individuals)
+        if not individuals:
+            return
+        X = self.scale(individuals)
+        valid = np.array([ind.fitness.valid for ind in individuals])
+        Y = np.array([ind.fitness.values for ind in individuals
+                      if ind.fitness.valid], dtype=float)
+        if len(Y):
+            # A hit is a valid individual better than the median so far.
+            if self.Y is not None and len(self.Y):
+                median = np.median(self.Y.sum(axis=1))
+                self.hits += int(np.sum(Y.sum(axis=1) < median))
+            self.Y = Y if self.Y is None else np.vstack([self.Y, Y])
+        self.X = np.vstack([self.X, X])
+        self.valid = np.concatenate([self.valid, valid])
+        self.simulated += len(individuals)
+        if seconds is not None:
+            self.seconds.append(seconds / float(len(individuals)))
+        self.fit()
+
+    def fit(self):
+        """Fit the regression on the valid individuals evaluated so far."""
+        if self.Y is None or not len(self.Y):
+            return
+        Z = self.features(self.X[self.valid])
+        self.y_mean = self.Y.mean(axis=0)
+        A = Z.T.dot(Z) + self.noise * np.eye(Z.shape[1])
+        self.A_inv = np.linalg.inv(A)
+        self.w = self.A_inv.dot(Z.T.dot(self.Y - self.y_mean))
+        self.fitted = len(self.Y)
+
+    def predict(self, genes):
+        """Predicted errors, their standard deviation (one column per
+        objective), and the probability of a valid rheobase, for each row
+        of genes."""
+        X = self.scale(genes)
+        Z = self.features(X)
+        mean = Z.dot(self.w) + self.y_mean
+        var = self.noise * np.sum(Z.dot(self.A_inv) * Z, axis=1)
+        std = np.sqrt(np.maximum(var, 0))[:, np.newaxis] \
+            * np.ones_like(mean)
+        # Kernel-weighted rate of valid rheobases, shrunk towards 1/2.
+        d2 = ((X[:, np.newaxis, :] - self.X[np.newaxis, :, :])**2).sum(axis=2)
+        k = np.exp(-0.5 * d2 / self.length_scale**2)
+        p_valid = (k.dot(self.valid) + 0.5) / (k.sum(axis=1) + 1.0)
+        return mean, std, p_valid
+
+    def expected_error(self, genes):
+        """Optimistic (lower confidence bound) summed error of each row of
+        genes, with the worst error seen so far if no rheobase is found."""
+        mean, std, p_valid = self.predict(genes)
+        lcb = mean.sum(axis=1) - self.kappa * np.sqrt((std**2).sum(axis=1))
+        worst = self.Y.sum(axis=1).max()
+        return p_valid * lcb + (1 - p_valid) * worst
+
+    def screen(self, offspring):
+        """The most promising fraction of offspring, to be simulated.
+
+        All offspring are kept until min_samples individuals with a valid
+        rheobase have been evaluated.
+        """
+        offspring = list(offspring)
+        self.screened += len(offspring)
+        if not self.ready or len(offspring) < 2:
+            return offspring
+        n_keep = max(1, int(math.ceil(self.fraction * len(offspring))))
+        order = np.argsort(self.expected_error(offspring))
+        self.rejected += len(offspring) - n_keep
+        return [offspring[i] for i in sorted(order[:n_keep])]
+
+    def record(self):
+        """Statistics since the last call: offspring screened and simulated,
+        the rate of hits among simulated offspring, and the estimated
+        simulation time saved by not simulating rejected offspring."""
+        seconds = np.mean(self.seconds) if self.seconds else 0.0
+        stats = {'screened': self.screened,
+                 'simulated': self.simulated,
+                 'hit_rate': self.hits / float(max(self.simulated, 1)),
+                 'saved_s': self.rejected * seconds}
+        self._reset_counts()
+        return stats
@@ -0,0 +1,155 @@
+"""Compact transport of individuals between the optimizer and dask workers.
+
+Rather than pickling whole DataTC objects (with their tests, formatted test
+parameters and score dictionaries) once per individual, only a parameter
+vector and a rheobase are sent out, and only a vector of scores (and
+optionally the path of a memory mapped voltage trace) is sent back.
+The test suite itself is sent once per partition, not once per individual.
+"""
+
+import os
+
+import numpy as np
+import quantities as pq
+import dask
+import dask.bag as db
+
+from neuronunit import tracing
+from neuronunit.optimization.data_transport_container import DataTC
+
+
+@tracing.traced()
+def pack(dtcpop):
+    '''
+    Reduce a population of DataTCs to compact payloads.
+    Outputs the attribute names, shared by every individual, and a list of
+    (index, attribute vector, rheobase) tuples.
+    A rheobase of -1.0 means that no rheobase was found.
+    '''
+    keys = list(dtcpop[0].attrs.keys())
+    payloads = []
+    for i, dtc in enumerate(dtcpop):
+        vector = np.array([float(dtc.attrs[k]) for k in keys])
+        rheobase = dtc.rheobase
+        if isinstance(rheobase, dict):
+            rheobase = rheobase['value']
+        rheobase = -1.0 if rheobase is None else float(rheobase)
+        payloads.append((i, vector, rheobase))
+    return keys, payloads
+
+
+def unpack(payload, keys, backend):
+    '''
+    Rebuild a lightweight DataTC, on a worker, from a compact payload.
+    '''
+    index, vector, rheobase = payload
+    dtc = DataTC()
+    dtc.attrs = dict(zip(keys, vector.tolist()))
+    dtc.backend = backend
+    dtc.rheobase = -1.0 if rheobase == -1.0 else rheobase*pq.pA
+    dtc.scores = {}
+    dtc.score = {}
+    return dtc
+
+
+def write_vm(dtc, vm_dir, index):
+    '''
+    Simulate the rheobase current injection of an individual, and store the
+    trace as a float32 .npy file that the caller can memory map.
+    Outputs the path of the file and the sampling period in ms.
+    '''
+    from neuronunit.optimization.optimization_management import \
+        mint_generic_model, active_values
+    model = mint_generic_model(dtc.backend)
+    model.set_attrs(**dtc.attrs)
+    current = active_values({}, dtc.rheobase)['injected_square_current']
+    model.inject_square_current(current)
+    vm = model.get_membrane_potential()
+    path = os.path.join(vm_dir, 'vm_%d.npy' % index)
+    buffer = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32,
+                                       shape=(len(vm),))
+    buffer[:] = np.asarray(vm.magnitude).ravel()
+    buffer.flush()
+    del buffer
+    return path, float(vm.sampling_period.rescale(pq.ms))
+
+
+@tracing.traced('partition')
+def evaluate_partition(payloads, keys, tests, backend, vm_dir=None):
+    '''
+    Evaluate one partition of compact payloads on a worker.
+    Outputs a list of (index, score vector, vm) tuples, where the score
+    vector is ordered as tests, with NaN for tests that were not scored
+    here (e.g. rheobase tests), and vm is None unless vm_dir is given.
+    '''
+    from neuronunit.optimization.optimization_management import \
+        format_test, nunit_evaluation
+    from neuronunit.models.backends import warm_up
+    # Compile the backend's kernels once per worker, up front.
+    warm_up([backend])
+    results = []
+    for payload in payloads:
+        with tracing.span('individual', index=payload[0]):
+            dtc = unpack(payload, keys, backend)
+            dtc.tests = tests
+            dtc = format_test(dtc)
+            dtc = nunit_evaluation(dtc)
+            scores = np.array([dtc.scores.get(str(t), np.nan)
+                               for t in tests], dtype=float)
+            vm = None
+            if vm_dir is not None and payload[2] > 0:
+                vm = write_vm(dtc, vm_dir, payload[0])
+        results.append((payload[0], scores, vm))
+    return results
+
+
+def merge(dtcpop, results, tests):
+    '''
+    Write compact results back into the DataTCs they came from.
+    Scores computed elsewhere (e.g. the rheobase test score) are kept.
+    '''
+    names = [str(t) for t in tests]
+    for index, scores, vm in results:
+        dtc = dtcpop[index]
+        if dtc.scores is None:
+            dtc.scores = {}
+        for name, score in zip(names, scores):
+            if not np.isnan(score):
+                dtc.scores[name] = float(score)
+        if vm is not None:
+            dtc.vm_path, dtc.vm_dt = vm
+        dtc.get_ss()
+    return dtcpop
+
+
+def load_vm(dtc):
+    '''
+    Memory map the voltage trace written by a worker, without copying it.
+    '''
+    if getattr(dtc, 'vm_path', None) is None:
+        return None
+    return np.load(dtc.vm_path, mmap_mode='r')
+
+
+def evaluate(dtcpop, tests, npartitions=None, vm_dir=None):
+    '''
+    Score a population of DataTCs with tests, on dask workers.
+    The DataTCs themselves stay in this process, only compact payloads
+    and results cross process boundaries.
+    If vm_dir is given, workers also leave the rheobase current trace of
+    every individual there, see load_vm.
+    '''
+    if not len(dtcpop):
+        return dtcpop
+    if npartitions is None:
+        npartitions = len(dtcpop)
+    keys, payloads = pack(dtcpop)
+    # A single graph node, rather than one copy of the tests per individual.
+    shared_tests = dask.delayed(tests, pure=True)
+    bag = db.from_sequence(payloads, npartitions=npartitions)
+    # Beyond the partition spans of the workers, this is the time taken by
+    # dask to schedule the partitions and to move them between processes.
+    with tracing.span('dask', npartitions=npartitions, n=len(payloads)):
+        results = bag.map_partitions(evaluate_partition, keys, shared_tests,
+                                     dtcpop[0].backend, vm_dir).compute()
+    return merge(dtcpop, list(results), tests)
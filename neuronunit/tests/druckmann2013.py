@@ -6,7 +6,9 @@ AP analysis details (from suplementary info): https://github.com/scidash/neuronu
 Numbers in class names refer to the numbers in the publication table
 """
 
-from elephant.spike_train_generation import threshold_detection
+import hashlib
+from collections import OrderedDict
+
 from neo import AnalogSignal
 from numba import jit
 from .base import np, pq, ncap, VmTest, scores
@@ -30,7 +32,6 @@ debug = False #True
 
 
 
-@jit
 def get_diff_spikes(vm):
     differentiated = np.diff(vm)
     spikes = len([np.any(differentiated) > 0.000143667327364])
@@ -74,10 +75,12 @@ class Druckmann2013AP:
 
         :return: the amplitude value
         """
-        v_begin, _ = self.get_beginning()
-        v_peak, _ = self.get_peak()
+        if not hasattr(self, 'amplitude'):
+            v_begin, _ = self.get_beginning()
+            v_peak, _ = self.get_peak()
+            self.amplitude = v_peak - v_begin
 
-        return (v_peak - v_begin)
+        return self.amplitude
 
     def get_halfwidth(self):
         """
@@ -88,19 +91,21 @@ class Druckmann2013AP:
 
         :return:
         """
-        v_begin, _ = self.get_beginning()
-        amp = self.get_amplitude()
-        half_v = v_begin + amp / 2.0
+        if not hasattr(self, 'halfwidth'):
+            v_begin, _ = self.get_beginning()
+            amp = self.get_amplitude()
+            half_v = v_begin + amp / 2.0
 
-        above_half_v = np.where(self.waveform.magnitude > half_v)[0]
+            above_half_v = np.where(self.waveform.magnitude > half_v)[0]
 
-        half_start = self.waveform.times[above_half_v[0]]
-        half_end = self.waveform.times[above_half_v[-1]]
+            half_start = self.waveform.times[above_half_v[0]]
+            half_end = self.waveform.times[above_half_v[-1]]
 
-        half_width = half_end - half_start
-        half_width.units = pq.ms
+            half_width = half_end - half_start
+            half_width.units = pq.ms
+            self.halfwidth = half_width
 
-        return half_width
+        return self.halfwidth
 
 
     def get_peak(self):
@@ -118,18 +123,21 @@ class Druckmann2013AP:
         return self.peak['value'], self.peak['time']
 
     def get_trough(self):
-        peak_v, peak_t = self.get_peak()
+        if not hasattr(self, 'trough'):
+            peak_v, peak_t = self.get_peak()
 
-        post_peak_waveform = self.waveform.magnitude[np.where(self.waveform.times > (peak_t - self.begin_time))]
-        post_peak_waveform = AnalogSignal(post_peak_waveform, units=self.waveform.units, sampling_period=self.waveform.sampling_period)
+            post_peak_waveform = self.waveform.magnitude[np.where(self.waveform.times > (peak_t - self.begin_time))]
+            post_peak_waveform = AnalogSignal(post_peak_waveform, units=self.waveform.units, sampling_period=self.waveform.sampling_period)
 
 
-        value = post_peak_waveform.min()
-        time = peak_t + post_peak_waveform.times[np.where(post_peak_waveform.magnitude == value)[0]]
-        time = time[0]
-        time.units = pq.ms
+            value = post_peak_waveform.min()
+            time = peak_t + post_peak_waveform.times[np.where(post_peak_waveform.magnitude == value)[0]]
+            time = time[0]
+            time.units = pq.ms
+            self.trough = { 'value': value, 'time': time }
+
+        return self.trough['value'], self.trough['time']
 
-        return value, time
 def isolate_code_block(threshold_crosses,start_time,dvdt_threshold_crosses,dvdt_zero_crosses,vm):
     '''
     The introduction of this function is was not syntactically necissated. The reason for this functions existence 
@@ -182,6 +190,165 @@ def isolate_code_block(threshold_crosses,start_time,dvdt_threshold_crosses,dvdt_
     return vm_chopped, threshold_crosses, ap_beginnings, vm_mag, vm_times
 
 
+class Druckmann2013FeatureExtractor:
+    """
+    Finds the APs of one membrane potential trace, as defined in Druckmann 2013,
+    and tabulates their features.
+
+    Every Druckmann2013Test asks for the APs of the trace produced by its
+    stimulus. Extractors are therefore kept, per trace and per analysis
+    parameters, in a small cache, so that all the tests run against one trace
+    share a single AP detection, and the features of each AP are only computed
+    once (Druckmann2013AP keeps them).
+    """
+
+    cache_size = 16
+    _cache = OrderedDict()
+
+    def __init__(self, vm, delay, duration, threshold=-20 * pq.mV,
+                 beginning_threshold=12.0 * pq.mV/pq.ms):
+        self.vm = vm
+        self.delay = delay
+        self.duration = duration
+        self.threshold = threshold
+        self.beginning_threshold = beginning_threshold
+
+        self._aps = None
+        self._table = None
+
+    @staticmethod
+    def key(vm, params):
+        """
+        A key identifying the trace by content, and the analysis parameters.
+        """
+        digest = hashlib.sha1(np.ascontiguousarray(vm.magnitude)).hexdigest()
+        current = params['injected_square_current']
+        return (digest, str(vm.sampling_period), str(current['delay']),
+                str(current['duration']), str(params['threshold']),
+                str(params['beginning_threshold']))
+
+    @classmethod
+    def get(cls, vm, params):
+        """
+        The (possibly cached) extractor for a trace and a test's params.
+        """
+        key = cls.key(vm, params)
+        if key in cls._cache:
+            cls._cache.move_to_end(key)
+            return cls._cache[key]
+
+        current = params['injected_square_current']
+        extractor = cls(vm, current['delay'], current['duration'],
+                        threshold=params['threshold'],
+                        beginning_threshold=params['beginning_threshold'])
+        cls._cache[key] = extractor
+        while len(cls._cache) > cls.cache_size:
+            cls._cache.popitem(last=False)
+        return extractor
+
+    @classmethod
+    def clear_cache(cls):
+        cls._cache.clear()
+
+    @staticmethod
+    def crossing_times(signal, threshold):
+        """
+        Times at which signal goes above threshold, as threshold_detection
+        would report them, from a single pass over the raw samples.
+        """
+        indices = ncap.spike_functions.get_spike_indices(signal, threshold=threshold)
+        return signal.times[indices]
+
+    @property
+    def aps(self):
+        """
+        Spikes were detected by a crossing of a voltage threshold (-20 mV).
+
+        :return: a list of Druckman2013APs
+        """
+        if self._aps is None:
+            self._aps = self.extract()
+        return self._aps
+
+    def extract(self):
+        vm = self.vm
+
+        vm_times = vm.times
+        start_time = self.delay.rescale('sec')
+        end_time = start_time + self.duration.rescale('sec')
+        vm = AnalogSignal(vm.magnitude[np.where(vm_times <= end_time)], sampling_period=vm.sampling_period, units=vm.units)
+        try:
+            dvdt = np.array(np.append([0], get_diff(vm, axis=0))) * pq.mV / vm.sampling_period
+        except:
+            dvdt = np.array(np.append([0], get_diff(vm))) * pq.mV / vm.sampling_period
+        dvdt = AnalogSignal(dvdt, sampling_period=vm.sampling_period)
+
+        threshold_crosses = self.crossing_times(vm, self.threshold)
+        dvdt_threshold_crosses = self.crossing_times(dvdt, self.beginning_threshold)
+        dvdt_zero_crosses = self.crossing_times(dvdt, 0 * pq.mV/pq.ms)
+
+        vm_chopped, threshold_crosses, ap_beginnings, vm_mag, vm_times = isolate_code_block(
+            threshold_crosses, \
+            start_time,dvdt_threshold_crosses,dvdt_zero_crosses,vm \
+        )
+        ap_waveforms = []
+        for i, b in enumerate(ap_beginnings):
+            if i != len(ap_beginnings)-1:
+                waveform = vm_chopped[i+1]
+            else:
+                # Keep up to 100ms of the last AP
+                waveform = vm_mag[np.where((vm_times >= b) & (vm_times < b + 100.0*pq.ms))]
+
+            waveform = AnalogSignal(waveform, units=vm.units, sampling_rate=vm.sampling_rate)
+
+            ap_waveforms.append(waveform)
+
+        # Pass in the AP waveforms and the times when they occured
+        return [Druckmann2013AP(ap_waveforms[i], ap_beginnings[i]) for i in range(len(ap_beginnings))]
+
+    @property
+    def ap_times(self):
+        """
+        AP beginning times, in ms, as a plain array.
+        """
+        return np.array([float(ap.get_beginning()[1]) for ap in self.aps])
+
+    @property
+    def isis(self):
+        """
+        Inter-spike intervals between AP beginnings, in ms.
+        """
+        return np.diff(self.ap_times)
+
+    @property
+    def table(self):
+        """
+        The features of every AP, one array per feature, with times in ms
+        and voltages in the units of the trace.
+        """
+        if self._table is None:
+            aps = self.aps
+
+            def column(values):
+                # Features may be 0-d or (1,) shaped quantities.
+                return np.array([np.asarray(v, dtype=float).ravel()[0] for v in values])
+
+            peaks = [ap.get_peak() for ap in aps]
+            troughs = [ap.get_trough() for ap in aps]
+            self._table = {
+                'begin_time': self.ap_times,
+                'begin_v': column(ap.get_beginning()[0] for ap in aps),
+                'peak_time': column(t for _, t in peaks),
+                'peak_v': column(v for v, _ in peaks),
+                'trough_time': column(t for _, t in troughs),
+                'trough_v': column(v for v, _ in troughs),
+                'amplitude': column(ap.get_amplitude() for ap in aps),
+                'halfwidth': column(ap.get_halfwidth() for ap in aps),
+                'isi': self.isis,
+            }
+        return self._table
+
+
 class Druckmann2013Test(VmTest):
     """
     All tests inheriting from this class assume that the subject model:
@@ -243,6 +410,14 @@ class Druckmann2013Test(VmTest):
     def current_length(self):
         return self.params['injected_square_current']['duration']
 
+    def get_feature_extractor(self, model):
+        """
+        :param model: model which provides the waveform to analyse
+        :return: the Druckmann2013FeatureExtractor of its current waveform
+        """
+        vm = model.get_membrane_potential()
+        return Druckmann2013FeatureExtractor.get(vm, self.params)
+
     def get_APs(self, model):
         """
         Spikes were detected by a crossing of a voltage threshold (-20 mV).
@@ -250,54 +425,12 @@ class Druckmann2013Test(VmTest):
         :param model: model which provides the waveform to analyse
         :return: a list of Druckman2013APs
         """
-
-        vm = model.get_membrane_potential()
-
-        vm_times = vm.times
-        start_time = self.params['injected_square_current']['delay'].rescale('sec')
-        end_time = start_time + self.params['injected_square_current']['duration'].rescale('sec')
-        vm = AnalogSignal(vm.magnitude[np.where(vm_times <= end_time)], sampling_period=vm.sampling_period, units=vm.units)
-        try:
-            dvdt = np.array(np.append([0], get_diff(vm, axis=0))) * pq.mV / vm.sampling_period
-        except:
-            dvdt = np.array(np.append([0], get_diff(vm))) * pq.mV / vm.sampling_period
-        dvdt = AnalogSignal(dvdt, sampling_period=vm.sampling_period)
-
-        threshold_crosses = threshold_detection(vm,threshold=self.params['threshold'])
-        dvdt_threshold_crosses = threshold_detection(dvdt,threshold=self.params['beginning_threshold'])
-        dvdt_zero_crosses = threshold_detection(dvdt, threshold=0 * pq.mV/pq.ms)
-
-        vm_chopped, threshold_crosses, ap_beginnings, vm_mag, vm_times = isolate_code_block(
-            threshold_crosses, \
-            start_time,dvdt_threshold_crosses,dvdt_zero_crosses,vm \
-        )
-        ap_waveforms = []
-        for i, b in enumerate(ap_beginnings):
-            if i != len(ap_beginnings)-1:
-                waveform = vm_chopped[i+1]
-            else:
-                # Keep up to 100ms of the last AP
-                waveform = vm_mag[np.where((vm_times >= b) & (vm_times < b + 100.0*pq.ms))]
-
-            waveform = AnalogSignal(waveform, units=vm.units, sampling_rate=vm.sampling_rate)
-
-            ap_waveforms.append(waveform)
-
-        # Pass in the AP waveforms and the times when they occured
-        self.APs = []
-        for i, b in enumerate(ap_beginnings):
-            self.APs.append(Druckmann2013AP(ap_waveforms[i], ap_beginnings[i]))
+        self.APs = self.get_feature_extractor(model).aps
 
         return self.APs
 
     def get_ISIs(self, model=None):
-        aps = self.get_APs(model)
-
-        ap_times = np.array([ap.get_beginning()[1] for ap in aps])
-
-        isis = get_diff(ap_times)# np.diff(ap_times)
-
-        return isis
+        return self.get_feature_extractor(model).isis
 
 
 class AP12AmplitudeDropTest(Druckmann2013Test):
@@ -355,9 +488,10 @@ class AP1SSAmplitudeChangeTest(Druckmann2013Test):
         start_latter_3rd = current_start + self.current_length() * 2.0 / 3.0
         end_latter_3rd = current_start + self.current_length()
 
-        aps = self.get_APs(model)
+        extractor = self.get_feature_extractor(model)
+        aps = extractor.aps
         amps = np.array([ap.get_amplitude() for ap in aps]) * pq.mV
-        ap_times = np.array([ap.get_beginning()[1] for ap in aps]) * pq.ms
+        ap_times = extractor.ap_times * pq.ms
 
         ss_aps = np.where(
             (ap_times >= start_latter_3rd) &
@@ -1081,8 +1215,9 @@ class InitialAccommodationMeanTest(Druckmann2013Test):
         start_3rd_5th = current_start + self.current_length() * 2/5.0
         end_3rd_5th   = current_start + self.current_length() * 3/5.0
 
-        aps = self.get_APs(model)
-        ap_times = np.array([ap.get_beginning()[1] for ap in aps])
+        extractor = self.get_feature_extractor(model)
+        aps = extractor.aps
+        ap_times = extractor.ap_times
 
         ap_count15 = np.where((ap_times >= start_1st_5th) & (ap_times <= end_1st_5th))[0]
         ap_count35 = np.where((ap_times >= start_3rd_5th) & (ap_times <= end_3rd_5th))[0]
@@ -1127,8 +1262,9 @@ class SSAccommodationMeanTest(Druckmann2013Test):
         start_last_5th = current_start + self.current_length() * 4/5.0
         end_last_5th   = current_start + self.current_length()
 
-        aps = self.get_APs(model)
-        ap_times = np.array([ap.get_beginning()[1] for ap in aps])
+        extractor = self.get_feature_extractor(model)
+        aps = extractor.aps
+        ap_times = extractor.ap_times
 
         ap_count15 = np.where((ap_times >= start_1st_5th)  & (ap_times <= end_1st_5th))[0]
         ap_count55 = np.where((ap_times >= start_last_5th) & (ap_times <= end_last_5th))[0]
@@ -1178,8 +1314,9 @@ class AccommodationRateToSSTest(Druckmann2013Test):
         start_last_5th = current_start + self.current_length() * 4/5.0
         end_last_5th   = current_start + self.current_length()
 
-        aps = self.get_APs(model)
-        ap_times = np.array([ap.get_beginning()[1] for ap in aps])
+        extractor = self.get_feature_extractor(model)
+        aps = extractor.aps
+        ap_times = extractor.ap_times
 
         aps_15 = np.where((ap_times >= start_1st_5th)  & (ap_times <= end_1st_5th))[0]
         aps_55 = np.where((ap_times >= start_last_5th) & (ap_times <= end_last_5th))[0]
@@ -1236,8 +1373,9 @@ class AccommodationAtSSMeanTest(Druckmann2013Test):
 
         model.inject_square_current(self.params['injected_square_current'])
 
-        aps = self.get_APs(model)
-        ap_times = np.array([ap.get_beginning()[1] for ap in aps])
+        extractor = self.get_feature_extractor(model)
+        aps = extractor.aps
+        ap_times = extractor.ap_times
 
         if len(aps) >= 4:
             isis = get_diff(ap_times)
@@ -1278,7 +1416,6 @@ class AccommodationAtSSMeanTest(Druckmann2013Test):
 
         return none_score
 
-    @jit
     def get_final_result(self, A, B, tau):
         return B / float(A) * 100.0
 
@@ -11,11 +11,16 @@ import copy
 import dask.bag as db
 
 import neuronunit
+from neuronunit import tracing
 from neuronunit.optimization.data_transport_container import DataTC
 from neuronunit.models.reduced import ReducedModel
+from neuronunit.models.backends import available_backends
+import neuronunit.capabilities.spike_functions as sf
 from .base import np, pq, ncap, VmTest, scores, AMPL, DELAY, DURATION
 
 N_CPUS = multiprocessing.cpu_count()
+# Current steps per bracket, at least one interior step (i.e. bisection).
+N_STEPS = max(N_CPUS, 2)
 TOLERANCE = 1  # Search tolerance in `self.units`, e.g. pA.
 DURATION = 1000*pq.ms
 STOP_TIME = DELAY + DURATION + 200*pq.ms
@@ -87,6 +92,7 @@ class RheobaseTest(VmTest):
         prediction['value'] = rheobase
         return prediction
 
+    @tracing.traced('rheobase_search', method='serial')
     def threshold_FI(self, model, units, guess=None):
         """Use binary search to generate an FI curve including rheobase."""
         lookup = {}  # A lookup table global to the function below.
@@ -183,6 +189,8 @@ class RheobaseTestP(RheobaseTest):
     ephysprop_name = 'Rheobase'
     score_type = scores.RatioScore
     get_rheobase_vm = True
+    # An optional RheobaseMemo used to seed the search bracket.
+    memo = None
 
     def condition_model(self, model):
         model.set_run_params(t_stop=STOP_TIME)
@@ -198,17 +206,20 @@ class RheobaseTestP(RheobaseTest):
         # this is not a perservering assignment, of value,
         # but rather a multi statement assertion that will be checked.
 
-        dtc = init_dtc(dtc)
-
         if model.orig_lems_file_path:
             dtc.model_path = model.orig_lems_file_path
             dtc.backend = model.backend
             assert os.path.isfile(dtc.model_path),\
                 "%s is not a file" % dtc.model_path
 
+        dtc = init_dtc(dtc, memo=self.memo)
+
         prediction = {}
 
-        rheobase = find_rheobase(self, dtc).rheobase
+        dtc = find_rheobase(self, dtc)
+        if self.memo is not None:
+            self.memo.add(dtc)
+        rheobase = dtc.rheobase
         if rheobase is not None:
             # Something like the below commented line must happen to set the
             # vm trace associated with the rheobase current.  One additional
@@ -258,14 +269,14 @@ def check_fix_range(dtc):
         assert sub.max() <= supra.min()
     elif len(sub) and len(supra):
         # Termination criterion
-        steps = np.linspace(sub.max(), supra.min(), N_CPUS+1)*pq.pA
+        steps = np.linspace(sub.max(), supra.min(), N_STEPS+1)*pq.pA
         steps = steps[1:-1]*pq.pA
     elif len(sub):
-        steps = np.linspace(sub.max(), 2*sub.max(), N_CPUS+1)*pq.pA
+        steps = np.linspace(sub.max(), 2*sub.max(), N_STEPS+1)*pq.pA
         steps = steps[1:-1]*pq.pA
     elif len(supra):
         steps = np.linspace(supra.min()-100, supra.min(),
-                            N_CPUS+1)*pq.pA
+                            N_STEPS+1)*pq.pA
         steps = steps[1:-1]*pq.pA
 
     dtc.current_steps = steps
@@ -284,6 +295,7 @@ def get_sub_supra(lookup):
     supra = np.array(sorted(list(set(supra))))
     return sub, supra
 
+@tracing.traced()
 def check_current(dtc):
     """Check the response to the proposed current and count spikes.
 
@@ -313,14 +325,22 @@ def check_current(dtc):
         uc = {'amplitude': ampl*pq.pA}
         current.update(uc)
         dtc.run_number += 1
+        # Only zero versus some spikes matters here, so backends that
+        # support it can end supra-threshold probes at the first spike.
+        model.set_run_params(stop_on_spikes=1)
         model.inject_square_current(current)
         dtc.previous = ampl
         n_spikes = model.get_spike_count()
         dtc.lookup[float(ampl)] = n_spikes
     return dtc
 
-def init_dtc(dtc):
+def init_dtc(dtc, memo=None):
     """Exploit memory of last model in genes."""
+    # A fresh model can still start from the rheobase of its nearest,
+    # previously evaluated, neighbour.
+    if dtc.initiated is False and memo is not None:
+        if memo.seed(dtc):
+            return dtc
     # check for memory and exploit it.
     if dtc.initiated is True:
         dtc = check_current(dtc)
@@ -354,9 +374,13 @@ def init_dtc(dtc):
         dtc.initiated = True
     return dtc
 
+@tracing.traced()
 def find_rheobase(self, dtc):
     assert os.path.isfile(dtc.model_path),\
         "%s is not a file" % dtc.model_path
+    if get_batch_simulator(dtc.backend) is not None:
+        # Fast backends simulate all of the current steps in one call.
+        return find_rheobase_population([dtc])[0]
     # If this it not the first pass/ first generation
     # then assume the rheobase value found before mutation still holds
     # until proven otherwise.
@@ -401,3 +425,177 @@ def find_rheobase(self, dtc):
                   (cnt, sub.max() if len(sub) else None,
                    supra.min() if len(supra) else None))
     return dtc
+
+def get_batch_simulator(backend):
+    """Get the batched simulator of a backend, if it has one.
+
+    Fast backends (RAW, HH) provide a `simulate_population` function, which
+    takes a list of attribute dictionaries, a square current and one
+    amplitude per row, and returns one voltage trace per row.
+    """
+    backend_class = available_backends.get(str(backend))
+    return getattr(backend_class, 'simulate_population', None)
+
+@tracing.traced()
+def find_rheobase_population(dtcpop, max_iters=40, memo=None):
+    """Search for the rheobase of a whole population at once.
+
+    For backends with a batched simulator (see get_batch_simulator).
+    On every pass the current steps of every unresolved model are simulated
+    in one batched call, spikes are counted with vectorized threshold
+    crossings, and each bracket is then narrowed with the same
+    check_fix_range logic as find_rheobase.
+    If a RheobaseMemo is given, it seeds the brackets and learns the results.
+    """
+    simulate_population = get_batch_simulator(dtcpop[0].backend)
+    for dtc in dtcpop:
+        if dtc.initiated is False:
+            dtc = init_dtc(dtc, memo=memo)
+    searching = [dtc for dtc in dtcpop if not dtc.boolean]
+    cnt = 0
+    while len(searching) and cnt < max_iters:
+        rows, amplitudes = [], []
+        for i, dtc in enumerate(searching):
+            for ampl in dtc.current_steps:
+                ampl = float(ampl)
+                if not np.isnan(ampl) and ampl not in dtc.lookup:
+                    rows.append(i)
+                    amplitudes.append(ampl)
+        if len(rows):
+            vms = simulate_population([searching[i].attrs for i in rows],
+                                      DEFAULT_INJECTED_SQUARE_CURRENT,
+                                      amplitudes=amplitudes,
+                                      stop_on_spikes=1)
+            n_spikes = sf.get_spike_counts(vms)
+            for i, ampl, n in zip(rows, amplitudes, n_spikes):
+                searching[i].run_number += 1
+                searching[i].lookup[ampl] = int(n)
+
+        unresolved = []
+        for dtc in searching:
+            dtc = check_fix_range(dtc)
+            if dtc.boolean:
+                continue
+            sub, supra = get_sub_supra(dtc.lookup)
+            if len(supra) and len(sub):
+                delta = float(supra.min()) - float(sub.max())
+                if delta < TOLERANCE or (str(supra.min()) ==
+                                         str(sub.max())):
+                    dtc.rheobase = supra.min()*pq.pA
+                    dtc.boolean = True
+                    continue
+            if len(sub) and sub.max() > 1500.0:
+                dtc.rheobase = None
+                dtc.boolean = False
+                continue
+            unresolved.append(dtc)
+        searching = unresolved
+        cnt += 1
+    if memo is not None:
+        for dtc in dtcpop:
+            memo.add(dtc)
+    return dtcpop
+
+
+class RheobaseMemo(object):
+    """A shared memory of previous rheobase searches.
+
+    Every search probes with the same stimulus protocol, so a rheobase is a
+    function of the model (its backend, model file and constant parameters)
+    and its attribute values. Every search that succeeds is stored together
+    with its lookup table, in a table per model, and indexed by its attribute
+    vector. A new model of the same kind (e.g. a GA offspring)
+    then starts its search from a tight bracket around the rheobase of its
+    nearest stored neighbour, instead of the blind initial bracket, and an
+    exact match (e.g. a surviving elite) is not searched at all.
+    """
+
+    def __init__(self, spread=0.1, min_spread=0.01, max_size=100000):
+        # Half width of the seeded bracket, as a fraction of the rheobase,
+        # for a neighbour one (scaled) unit away, and its lower bound.
+        self.spread = spread
+        self.min_spread = min_spread
+        self.max_size = max_size
+        self.tables = {}
+
+    def _table(self, dtc):
+        keys = tuple(sorted(dtc.attrs.keys()))
+        # Models only share a table if they differ in attribute values alone.
+        constants = tuple(sorted((k, str(v))
+                                 for k, v in (dtc.constants or {}).items()))
+        model = (str(dtc.backend), getattr(dtc, 'model_path', None),
+                 constants)
+        table = self.tables.setdefault(model + (keys,),
+                                       {'points': [], 'rheobases': [],
+                                        'lookups': []})
+        point = [float(dtc.attrs[k]) for k in keys]
+        return table, point
+
+    def __len__(self):
+        return sum(len(t['points']) for t in self.tables.values())
+
+    def add(self, dtc):
+        """Remember a finished rheobase search."""
+        if not dtc.attrs or not dtc.boolean or dtc.rheobase is None:
+            return
+        rheobase = float(dtc.rheobase)
+        if rheobase <= 0:
+            return
+        table, point = self._table(dtc)
+        if len(table['points']) >= self.max_size:
+            for key in table:
+                del table[key][0]
+        table['points'].append(point)
+        table['rheobases'].append(rheobase)
+        table['lookups'].append(dict(dtc.lookup))
+
+    def nearest(self, dtc):
+        """Get (distance, rheobase, lookup) of the nearest stored neighbour.
+
+        Distances are measured after scaling every attribute by its spread
+        across the stored models. Returns None if nothing is stored yet.
+        """
+        if not dtc.attrs:
+            return None
+        table, point = self._table(dtc)
+        if not len(table['points']):
+            return None
+        points = np.array(table['points'])
+        scale = points.std(axis=0)
+        scale[scale == 0] = 1.0
+        distances = np.sqrt((((points - point)/scale)**2).sum(axis=1))
+        i = int(np.argmin(distances))
+        return (distances[i], table['rheobases'][i], table['lookups'][i])
+
+    def seed(self, dtc):
+        """Seed the search of dtc from its nearest neighbour.
+
+        Returns True if dtc was seeded.
+        """
+        neighbour = self.nearest(dtc)
+        if neighbour is None:
+            return False
+        distance, rheobase, lookup = neighbour
+        dtc.initiated = True
+        if distance == 0:
+            dtc.lookup.update(lookup)
+            dtc.rheobase = rheobase*pq.pA
+            dtc.boolean = True
+        else:
+            dtc.boolean = False
+            # The closer the neighbour, the tighter the bracket.
+            width = min(self.spread, max(self.min_spread,
+                                         self.spread*distance))
+            steps = np.linspace(rheobase*(1.0-width),
+                                rheobase*(1.0+width), max(N_CPUS-2, 2))
+            # Guard steps, so that a miss still yields a bracket, rather
+            # than the much wider expansion done by check_fix_range.
+            guard = min(4*width, 0.9)
+            steps = np.hstack([rheobase*(1.0-guard), steps,
+                               rheobase*(1.0+guard)])
+            dtc.current_steps = [i*pq.pA for i in steps]
+        return True
+
+
+# Shared by the optimization code, across individuals and generations.
+RHEOBASE_MEMO = RheobaseMemo()
@@ -0,0 +1,278 @@
+"""Timing spans of the stages of an optimization.
+
+When a GA run is slow, the spans recorded here tell where the time goes:
+rheobase searches, simulations, predictions, scoring, and dask (the
+difference between a 'dask' span and the 'partition' spans run under it
+being scheduling and pickling).  Spans nest, and record the wall and CPU
+time of every stage, the process and thread that ran it, and arguments
+such as the test or individual concerned.
+
+Tracing is off unless enable() was called, or the NU_TRACE environment
+variable names a trace directory; the environment variable is inherited
+by worker processes, which then trace too.  Every process appends the
+spans it records to a file of its own in that directory, and gather()
+collects them, so that spans recorded on dask workers are aggregated with
+those of the optimizer.  While tracing is off, span() and functions
+decorated with traced() cost one global lookup.
+
+    from neuronunit import tracing
+    path = tracing.enable()
+    ...  # e.g. SciUnitOptimization(...).run(trace='ga.json')
+    print(tracing.summarize(tracing.gather()))
+    tracing.write_chrome_trace('trace.json')  # For chrome://tracing
+"""
+
+import functools
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class Span(object):
+    """A timed stage, used as a context manager."""
+
+    __slots__ = ('tracer', 'name', 'args', 'parent', 'ts', 't0', 'c0')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        self.parent = stack[-1].name if stack else None
+        stack.append(self)
+        self.ts = time.time()
+        self.t0 = time.perf_counter()
+        self.c0 = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        wall = time.perf_counter() - self.t0
+        cpu = time.thread_time() - self.c0
+        stack = self.tracer.stack()
+        stack.pop()
+        self.tracer.spans.append({
+            'name': self.name, 'parent': self.parent, 'args': self.args,
+            'ts': self.ts, 'wall': wall, 'cpu': cpu,
+            'pid': os.getpid(), 'tid': threading.get_ident(),
+            'error': exc_type is not None})
+        if not stack:
+            self.tracer.flush()
+        return False
+
+
+class _NoSpan(object):
+    """The span returned while tracing is off, which does nothing."""
+
+    __slots__ = ()
+    args = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Tracer(object):
+    """Records the spans of this process in a trace directory.
+
+    Finished spans are buffered, and appended to this process's file once
+    the outermost span of a thread ends.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.pid = os.getpid()
+        self.spans = []
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.offsets = {}   # Bytes of each file already read by gather()
+        self.gathered = []  # Spans read by gather()
+
+    def stack(self):
+        """The spans open in this thread, innermost last."""
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def file(self):
+        return os.path.join(self.path, 'spans-%d.jsonl' % os.getpid())
+
+    def flush(self):
+        """Append the buffered spans to the file of this process."""
+        with self.lock:
+            if os.getpid() != self.pid:
+                # In a forked worker, spans buffered (and gathered) by the
+                # parent are the parent's to write.
+                self.pid = os.getpid()
+                self.spans = [s for s in self.spans if s['pid'] == self.pid]
+                self.offsets = {}
+                self.gathered = []
+            spans, self.spans = self.spans, []
+            if spans:
+                with open(self.file(), 'a') as f:
+                    f.write(''.join(json.dumps(s, default=str) + '\n'
+                                    for s in spans))
+
+    def gather(self):
+        """Spans written by any process since the last call."""
+        self.flush()
+        new = []
+        for path in sorted(glob.glob(os.path.join(self.path,
+                                                  'spans-*.jsonl'))):
+            with open(path) as f:
+                f.seek(self.offsets.get(path, 0))
+                lines = f.readlines()
+                # A line still being written is read next time.
+                if lines and not lines[-1].endswith('\n'):
+                    lines.pop()
+                self.offsets[path] = self.offsets.get(path, 0) + \
+                    sum(len(line.encode('utf-8')) for line in lines)
+            new += [json.loads(line) for line in lines]
+        new.sort(key=lambda s: s['ts'])
+        self.gathered += new
+        return new
+
+
+_tracer = None
+_checked = False
+
+
+def get_tracer():
+    """The Tracer of this process, or None if tracing is off.
+
+    Off unless enable() was called, or the NU_TRACE environment variable
+    names a trace directory.
+    """
+    global _tracer, _checked
+    if not _checked:
+        _checked = True
+        if _tracer is None and os.environ.get('NU_TRACE'):
+            _tracer = Tracer(os.environ['NU_TRACE'])
+    return _tracer
+
+
+def enable(path=None):
+    """Trace this process and its future workers into directory path (by
+    default a new temporary directory), which is returned.
+
+    Workers of a dask.distributed cluster that are already running can be
+    enabled with client.run(tracing.enable, path), given a shared path.
+    """
+    global _tracer, _checked
+    if path is None:
+        path = tempfile.mkdtemp(prefix='nu_trace_')
+    os.environ['NU_TRACE'] = path
+    if _tracer is None or _tracer.path != path:
+        _tracer = Tracer(path)
+    _checked = True
+    return path
+
+
+def disable():
+    """Stop tracing this process and its future workers."""
+    global _tracer, _checked
+    if _tracer is not None:
+        _tracer.flush()
+    os.environ.pop('NU_TRACE', None)
+    _tracer = None
+    _checked = True
+
+
+def enabled():
+    return (_tracer if _checked else get_tracer()) is not None
+
+
+def span(name, **args):
+    """A context manager timing the stage name, e.g.
+
+        with tracing.span('rheobase', backend='RAW'):
+            ...
+
+    Arguments describe the stage in the trace; more can be added to the
+    args of the span while it is open."""
+    tracer = _tracer if _checked else get_tracer()
+    if tracer is None:
+        return _NO_SPAN
+    return Span(tracer, name, args)
+
+
+def traced(name=None, **args):
+    """Decorator timing every call of a function as a span, named after
+    the function unless name is given."""
+    def decorator(f):
+        label = name or f.__name__
+
+        @functools.wraps(f)
+        def wrapper(*a, **kw):
+            tracer = _tracer if _checked else get_tracer()
+            if tracer is None:
+                return f(*a, **kw)
+            with Span(tracer, label, dict(args)):
+                return f(*a, **kw)
+        return wrapper
+    return decorator
+
+
+def gather():
+    """Spans recorded by this process and its workers since the last call
+    (or [] if tracing is off), in order of their start."""
+    tracer = get_tracer()
+    if tracer is None:
+        return []
+    return tracer.gather()
+
+
+def summarize(spans):
+    """Number of calls, and total wall and CPU seconds, of each stage."""
+    summary = {}
+    for s in spans:
+        stage = summary.setdefault(s['name'], {'n': 0, 'wall': 0.0,
+                                               'cpu': 0.0})
+        stage['n'] += 1
+        stage['wall'] += s['wall']
+        stage['cpu'] += s['cpu']
+    return summary
+
+
+def record():
+    """Summary of the spans recorded since the last call, e.g. for a
+    generation of the GA."""
+    return summarize(gather())
+
+
+def chrome_events(spans):
+    """Spans as complete ('X') events of the Chrome trace format."""
+    events = []
+    for s in spans:
+        args = dict(s['args'], cpu_ms=s['cpu'] * 1e3)
+        if s['error']:
+            args['error'] = True
+        events.append({'name': s['name'], 'cat': s['parent'] or 'top',
+                       'ph': 'X', 'ts': s['ts'] * 1e6,
+                       'dur': s['wall'] * 1e6, 'pid': s['pid'],
+                       'tid': s['tid'], 'args': args})
+    return events
+
+
+def write_chrome_trace(path, spans=None):
+    """Write spans (by default every span gathered so far) as a Chrome
+    trace, to be opened with chrome://tracing or Perfetto."""
+    if spans is None:
+        gather()
+        tracer = get_tracer()
+        spans = tracer.gathered if tracer is not None else []
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': chrome_events(spans),
+                   'displayTimeUnit': 'ms'}, f, default=str)
+    return path
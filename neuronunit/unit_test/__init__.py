@@ -11,7 +11,8 @@ from .base import *
 from .import_tests import ImportTestCase
 from .doc_tests import DocumentationTestCase
 from .resource_tests import NeuroElectroTestCase, BlueBrainTestCase,\
-                            AIBSTestCase
+                            AIBSTestCase, NeuroElectroStoreTestCase,\
+                            NeuroMLDBCacheTestCase
 from .model_tests import ReducedModelTestCase, ExtraCapabilitiesTestCase
 from .observation_tests import ObservationsTestCase
 from .test_tests import TestsPassiveTestCase, TestsWaveformTestCase,\
@@ -20,10 +21,23 @@ from .test_tests import TestsPassiveTestCase, TestsWaveformTestCase,\
 from .misc_tests import EphysPropertiesTestCase
 from .sciunit_tests import SciUnitTestCase
 from .cache_tests import BackendCacheTestCase
+from .spike_function_tests import SpikeFunctionsTestCase
+from .backend_tests import RAWPopulationTestCase, HHPopulationTestCase,\
+                           KernelWarmUpTestCase,\
+                           NEURONResampleTestCase, TraceCacheTestCase,\
+                           NEURONArtifactCacheTestCase, JNeuroMLPoolTestCase
+from .optimization_management_tests import TransportTestCase,\
+                                           ProtocolPlannerTestCase,\
+                                           AsyncEvolutionTestCase,\
+                                           SurrogateTestCase,\
+                                           StreamingGridTestCase,\
+                                           AdaptiveGridTestCase
+from .benchmark_tests import BenchmarkRunnerTestCase
+from .tracing_tests import TracingTestCase
 
 from .test_druckmann2013 import Model1TestCase, Model2TestCase, \
     Model3TestCase, Model4TestCase, Model5TestCase, \
     Model6TestCase, Model7TestCase, Model8TestCase, Model9TestCase, \
-    Model10TestCase, Model11TestCase
+    Model10TestCase, Model11TestCase, FeatureExtractorTestCase
 
 from .test_morphology import MorphologyTestCase
@@ -0,0 +1,433 @@
+"""Tests of NeuronUnit simulator backends"""
+
+from .base import *
+import shutil
+import numpy as np
+
+
+class RAWPopulationTestCase(unittest.TestCase):
+    """Testing the batched Izhikevich integrator of the RAW backend"""
+
+    def setUp(self):
+        from neuronunit.models.backends import rawpy
+        self.rawpy = rawpy
+        self.attrs = [dict(rawpy.PARAM_DEFAULTS),
+                      dict(rawpy.PARAM_DEFAULTS, a=0.03, k=0.7)]
+        self.current = {'amplitude': 300.0, 'delay': 100.0,
+                        'duration': 1000.0}
+
+    def test_population_matches_serial(self):
+        vms = self.rawpy.simulate_population(self.attrs, self.current)
+        self.assertEqual(vms.shape[0], len(self.attrs))
+        pulse = self.rawpy.get_pulse(100.0, 1000.0, 1300.0, 0.025)
+        for attrs, row in zip(self.attrs, vms):
+            attrs = dict(attrs)
+            attrs['Iext'] = 300.0*pulse
+            attrs['dt'] = 0.025
+            vm = self.rawpy.get_vm(**attrs)
+            np.testing.assert_allclose(row, np.array(vm).ravel())
+
+    def test_population_rheobase(self):
+        from neuronunit.optimization.data_transport_container import DataTC
+        from neuronunit.tests.fi import find_rheobase_population
+        import neuronunit.capabilities.spike_functions as sf
+        dtcpop = []
+        for attrs in self.attrs:
+            dtc = DataTC()
+            dtc.attrs = attrs
+            dtc.backend = 'RAW'
+            dtcpop.append(dtc)
+        dtcpop = find_rheobase_population(dtcpop)
+        for dtc in dtcpop:
+            self.assertTrue(dtc.boolean)
+            rheobase = float(dtc.rheobase)
+            vms = self.rawpy.simulate_population(
+                      [dtc.attrs, dtc.attrs], self.current,
+                      amplitudes=[rheobase, rheobase-1.0])
+            n_spikes = sf.get_spike_counts(vms)
+            self.assertGreater(n_spikes[0], 0)
+            self.assertEqual(n_spikes[1], 0)
+
+    def test_rheobase_memo(self):
+        from neuronunit.optimization.data_transport_container import DataTC
+        from neuronunit.tests.fi import find_rheobase_population, \
+                                        RheobaseMemo, TOLERANCE
+
+        def make_dtcpop(scale=1.0):
+            dtcpop = []
+            for attrs in self.attrs:
+                dtc = DataTC()
+                dtc.attrs = dict(attrs, a=attrs['a']*scale)
+                dtc.backend = 'RAW'
+                dtcpop.append(dtc)
+            return dtcpop
+        memo = RheobaseMemo()
+        parents = find_rheobase_population(make_dtcpop(), memo=memo)
+        self.assertEqual(len(memo), len(parents))
+        # Unchanged individuals reuse the stored rheobase.
+        elites = find_rheobase_population(make_dtcpop(), memo=memo)
+        for parent, elite in zip(parents, elites):
+            self.assertEqual(elite.run_number, 0)
+            self.assertEqual(float(elite.rheobase), float(parent.rheobase))
+        # Nearby individuals search less than from the blind bracket.
+        blind = find_rheobase_population(make_dtcpop(1.02))
+        seeded = find_rheobase_population(make_dtcpop(1.02), memo=memo)
+        for b, s in zip(blind, seeded):
+            self.assertLess(s.run_number, b.run_number)
+            self.assertLess(abs(float(s.rheobase) - float(b.rheobase)),
+                            TOLERANCE)
+        # Other models, with the same attributes, are not seeded.
+        for key, value in [('model_path', 'other.xml'),
+                           ('constants', {'C': 50.0})]:
+            dtc = make_dtcpop()[0]
+            setattr(dtc, key, value)
+            self.assertIsNone(memo.nearest(dtc))
+
+    def test_stop_on_spikes(self):
+        import neuronunit.capabilities.spike_functions as sf
+        amplitudes = [200.0, 400.0]
+        full = self.rawpy.simulate_population(self.attrs, self.current,
+                                              amplitudes=amplitudes)
+        short = self.rawpy.simulate_population(self.attrs, self.current,
+                                               amplitudes=amplitudes,
+                                               stop_on_spikes=1)
+        self.assertLess(short.shape[1], full.shape[1])
+        np.testing.assert_array_equal(sf.get_spike_counts(short), [1, 1])
+        # Up to the first spike, the traces are the same.
+        first = np.argmax(full > 0, axis=1)
+        for row_full, row_short, i in zip(full, short, first):
+            np.testing.assert_array_equal(row_full[:i+2], row_short[:i+2])
+
+
+class HHPopulationTestCase(unittest.TestCase):
+    """Testing the batched integrator of the HH backend"""
+
+    def setUp(self):
+        from neuronunit.models.backends import hhrawf
+        self.hhrawf = hhrawf
+
+    def test_population_spike_counts(self):
+        import neuronunit.capabilities.spike_functions as sf
+        attrs = dict(self.hhrawf.PARAM_DEFAULTS)
+        current = {'amplitude': 10.0, 'delay': 100.0, 'duration': 1000.0}
+        vms = self.hhrawf.simulate_population([attrs, attrs], current,
+                                              amplitudes=[10.0, 0.0])
+        n_spikes = sf.get_spike_counts(vms)
+        self.assertGreater(n_spikes[0], 0)
+        self.assertEqual(n_spikes[1], 0)
+
+    def test_stop_on_spikes(self):
+        import neuronunit.capabilities.spike_functions as sf
+        attrs = dict(self.hhrawf.PARAM_DEFAULTS)
+        current = {'amplitude': 10.0, 'delay': 100.0, 'duration': 1000.0}
+        vms = self.hhrawf.simulate_population([attrs], current,
+                                              stop_on_spikes=2)
+        self.assertLess(vms.shape[1], 10000)
+        self.assertGreaterEqual(sf.get_spike_counts(vms)[0], 2)
+
+    def test_matches_odeint(self):
+        from scipy.integrate import odeint
+        import quantities as pq
+        import neuronunit.capabilities.spike_functions as sf
+        attrs = [dict(self.hhrawf.PARAM_DEFAULTS),
+                 dict(self.hhrawf.PARAM_DEFAULTS, g_K=30.0, C_m=1.5)]
+        amplitudes = [10.0, 10.0, 0.0]
+        current = {'amplitude': 10.0, 'delay': 100.0, 'duration': 200.0}
+        vms = self.hhrawf.simulate_population(attrs + attrs[:1], current,
+                                              amplitudes=amplitudes)
+        T = np.linspace(0.0, 500.0, 10000)
+        Y = np.repeat([-65.0, 0.05, 0.6, 0.32], 3)
+        ref = odeint(self.hhrawf.dALLdt_population, Y, T,
+                     args=(self.hhrawf.attrs_to_params(attrs + attrs[:1]),
+                           np.array(amplitudes), (100.0, 200.0, 500.0)),
+                     rtol=1e-8, atol=1e-8)[:, 0:3].T
+        # The same spikes, within one sample (0.05 ms).
+        for row, ref_row in zip(vms, ref):
+            np.testing.assert_allclose(sf.get_spike_indices(row*pq.mV),
+                                       sf.get_spike_indices(ref_row*pq.mV),
+                                       atol=1)
+        np.testing.assert_allclose(vms[2], ref[2], atol=1e-3)
+
+
+class KernelWarmUpTestCase(unittest.TestCase):
+    """Testing the compilation of backend kernels ahead of simulations"""
+
+    def test_kernel_digest(self):
+        import hashlib
+        from neuronunit.models.backends import rawpy
+        from neuronunit.models.backends.base import kernel_digest
+        # Covers the whole module, helpers inlined into the kernels included.
+        with open(rawpy.__file__.replace('.pyc', '.py'), 'rb') as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        self.assertEqual(kernel_digest(rawpy.izhikevich), digest)
+        self.assertEqual(kernel_digest(rawpy.get_vm_population), digest)
+
+    def test_warm_up(self):
+        from neuronunit.models.backends import warm_up, rawpy, hhrawf
+        warm_up(['RAW', 'HH'])
+        for module, kernel in ((rawpy, '_izhikevich'),
+                               (rawpy, '_get_vm_population'),
+                               (hhrawf, '_integrate_population')):
+            kernel = getattr(module, kernel)
+            # Either built ahead of time, or already JIT compiled.
+            self.assertTrue(not hasattr(kernel, 'signatures') or
+                            len(kernel.signatures) > 0)
+        # Warmed up kernels are the ones simulations use.
+        n_signatures = len(getattr(hhrawf._integrate_population,
+                                   'signatures', []))
+        hhrawf.simulate_population([hhrawf.PARAM_DEFAULTS],
+                                   {'amplitude': 1.0, 'delay': 1.0,
+                                    'duration': 1.0})
+        self.assertEqual(len(getattr(hhrawf._integrate_population,
+                                     'signatures', [])), n_signatures)
+
+
+class NEURONResampleTestCase(unittest.TestCase):
+    """Testing the fixed step resampling of NEURON's variable step output"""
+
+    def setUp(self):
+        from neuronunit.models.backends.base import NEURON_SUPPORT
+        if not NEURON_SUPPORT:
+            self.skipTest("NEURON is not installed")
+
+    def test_resample(self):
+        from neuronunit.models.backends.neuron import resample
+        times = np.array([0.0, 0.3, 0.35, 1.0, 2.2, 2.5])
+        values = np.array([-65.0, -60.0, -20.0, 30.0, -70.0, -65.0])
+        fixed = resample(times, values, 0.1)
+        self.assertEqual(len(fixed), 26)
+        np.testing.assert_allclose(fixed[[0, 3, 10, 22, 25]],
+                                   [-65.0, -60.0, 30.0, -70.0, -65.0])
+        np.testing.assert_allclose(fixed, np.interp(0.1*np.arange(26),
+                                                    times, values))
+
+
+class TraceCacheTestCase(unittest.TestCase):
+    """Testing the persistent simulation trace cache"""
+
+    def setUp(self):
+        import tempfile
+        import quantities as pq
+        from neo.core import AnalogSignal
+        from neuronunit.models.backends.base import TraceCache
+        self.cache = TraceCache(tempfile.mkdtemp())
+        self.vm = AnalogSignal(np.random.randn(1000), units=pq.mV,
+                               sampling_period=0.025*pq.ms)
+        self.current = {'amplitude': 10*pq.pA, 'delay': 100*pq.ms,
+                        'duration': 1000*pq.ms}
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.cache.path)
+
+    def test_key_is_stable(self):
+        key1 = self.cache.key('RAW', {'a': 0.01, 'b': 15}, {}, self.current)
+        key2 = self.cache.key('RAW', {'b': 15.0, 'a': 0.01}, {},
+                              dict(self.current))
+        key3 = self.cache.key('HH', {'a': 0.01, 'b': 15}, {}, self.current)
+        self.assertEqual(key1, key2)
+        self.assertNotEqual(key1, key3)
+
+    def test_get_set_evict(self):
+        key = self.cache.key('RAW', {'a': 0.01}, {}, self.current)
+        self.assertIsNone(self.cache.get(key))
+        self.cache.set(key, self.vm)
+        vm = self.cache.get(key)
+        np.testing.assert_allclose(vm.magnitude, self.vm.magnitude)
+        self.assertEqual(vm.sampling_period, self.vm.sampling_period)
+        self.assertEqual(self.cache.stats['hits'], 1)
+        self.assertEqual(self.cache.stats['misses'], 1)
+        self.cache.max_bytes = self.cache.n_bytes
+        self.cache.set('other', self.vm)
+        self.assertIsNone(self.cache.get(key))
+        self.assertEqual(self.cache.stats['evictions'], 1)
+
+
+class NEURONArtifactCacheTestCase(unittest.TestCase):
+    """Testing the cache of LEMS->NEURON conversions and compiled
+    mechanisms"""
+
+    def setUp(self):
+        import tempfile
+        from neuronunit.models.backends.neuron import NEURONArtifactCache
+        self.cache = NEURONArtifactCache(tempfile.mkdtemp())
+        self.model_dir = tempfile.mkdtemp()
+        self.lems = os.path.join(self.model_dir, 'LEMS_cell.xml')
+        self.nml = os.path.join(self.model_dir, 'cell.nml')
+        for path in (self.lems, self.nml):
+            with open(path, 'w') as f:
+                f.write('<%s/>' % os.path.basename(path))
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.cache.path)
+        shutil.rmtree(self.model_dir)
+
+    def test_key(self):
+        key = self.cache.key([self.lems, self.nml], version='7.8')
+        self.assertEqual(key, self.cache.key([self.lems, self.nml],
+                                             version='7.8'))
+        self.assertNotEqual(key, self.cache.key([self.lems, self.nml],
+                                                version='8.0'))
+        with open(self.nml, 'a') as f:
+            f.write(' ')
+        self.assertNotEqual(key, self.cache.key([self.lems, self.nml],
+                                                version='7.8'))
+
+    def test_store_restore(self):
+        import tempfile
+        from neuronunit.models.backends.neuron import mechanism_dirs
+        key = self.cache.key([self.lems, self.nml], version='7.8')
+        self.assertFalse(self.cache.restore(key, self.model_dir))
+        with open(os.path.join(self.model_dir, 'LEMS_cell_nrn.py'), 'w') as f:
+            f.write('# generated')
+        os.makedirs(os.path.join(self.model_dir, 'x86_64', '.libs'))
+        open(os.path.join(self.model_dir, 'x86_64', '.libs',
+                          'libnrnmech.so'), 'w').close()
+        self.assertEqual(mechanism_dirs(self.model_dir), {'x86_64'})
+        self.cache.store(key, self.model_dir, ['LEMS_cell_nrn.py', 'x86_64'])
+
+        other_dir = tempfile.mkdtemp()
+        try:
+            self.assertTrue(self.cache.restore(key, other_dir))
+            self.assertTrue(os.path.isfile(os.path.join(other_dir,
+                                                        'LEMS_cell_nrn.py')))
+            self.assertTrue(os.path.islink(os.path.join(other_dir, 'x86_64')))
+            self.assertEqual(mechanism_dirs(other_dir), {'x86_64'})
+            # Restoring again is harmless.
+            self.assertTrue(self.cache.restore(key, other_dir))
+        finally:
+            import shutil
+            shutil.rmtree(other_dir)
+        self.assertEqual(self.cache.stats, {'hits': 2, 'misses': 1})
+
+    def test_build(self):
+        key = self.cache.key([self.lems, self.nml], version='7.8')
+
+        def generate(lems_file_path, directory):
+            # Only the model files are there to convert.
+            self.assertEqual(sorted(os.listdir(directory)),
+                             ['LEMS_cell.xml', 'cell.nml'])
+            self.assertEqual(os.path.dirname(lems_file_path), directory)
+            # Written meanwhile by another model sharing the directory.
+            with open(os.path.join(self.model_dir, 'other_nrn.py'), 'w') as f:
+                f.write('# other')
+            with open(os.path.join(directory, 'LEMS_cell_nrn.py'), 'w') as f:
+                f.write('# generated')
+
+        self.assertTrue(self.cache.build(key, [self.lems, self.nml],
+                                         self.model_dir, generate))
+        self.assertEqual(os.listdir(self.cache._dir(key)),
+                         ['LEMS_cell_nrn.py'])
+        self.assertTrue(self.cache.install(key, self.model_dir))
+        self.assertTrue(os.path.isfile(os.path.join(self.model_dir,
+                                                    'LEMS_cell_nrn.py')))
+        # Nothing but the entry is left in the cache.
+        self.assertEqual(os.listdir(self.cache.path), [key])
+        self.assertEqual(self.cache.stats, {'hits': 0, 'misses': 0})
+
+
+class JNeuroMLPoolTestCase(unittest.TestCase):
+    """Testing the pool of long-lived jNeuroML workers"""
+
+    class FakeWorker(object):
+        started = 0
+
+        def __init__(self, max_memory=None, timeout=None):
+            type(self).started += 1
+            self.closed = False
+
+        def run(self, lems_file_path):
+            if lems_file_path == 'broken.xml':
+                raise RuntimeError('no reply')
+            return {'t': [0.0], 'v': [-0.065]}
+
+        def close(self):
+            self.closed = True
+
+    def setUp(self):
+        from neuronunit.models.backends import jNeuroML
+        self.module = jNeuroML
+        self.worker_class = jNeuroML.JNeuroMLWorker
+        jNeuroML.JNeuroMLWorker = self.FakeWorker
+        self.FakeWorker.started = 0
+
+    def tearDown(self):
+        self.module.JNeuroMLWorker = self.worker_class
+
+    def test_workers_are_reused(self):
+        pool = self.module.JNeuroMLPool(size=2)
+        for i in range(5):
+            self.assertEqual(pool.run('model.xml')['v'], [-0.065])
+        self.assertEqual(self.FakeWorker.started, 1)
+        self.assertRaises(RuntimeError, pool.run, 'broken.xml')
+        # A failed worker is replaced, and the pool stays in use.
+        self.assertEqual(len(pool.workers), 0)
+        self.assertFalse(pool.disabled)
+        pool.run('model.xml')
+        workers = list(pool.workers)
+        pool.close()
+        self.assertTrue(all(worker.closed for worker in workers))
+
+    def test_disabled_if_never_working(self):
+        pool = self.module.JNeuroMLPool(size=2)
+        self.assertRaises(RuntimeError, pool.run, 'broken.xml')
+        self.assertTrue(pool.disabled)
+
+    def test_opt_in(self):
+        old = (self.module._pool, os.environ.pop('NU_JNML_POOL_SIZE', None))
+        self.module._pool = None
+        try:
+            self.assertIsNone(self.module.get_jnml_pool())
+        finally:
+            self.module._pool = old[0]
+            if old[1] is not None:
+                os.environ['NU_JNML_POOL_SIZE'] = old[1]
+
+    def test_timeout(self):
+        import queue
+        import subprocess
+        import tempfile
+        import threading
+        worker = self.worker_class.__new__(self.worker_class)
+        worker.timeout = 0.5
+        worker.dir = tempfile.mkdtemp()
+        # A server that never replies.
+        worker.process = subprocess.Popen(
+            [sys.executable, '-c', 'import time; time.sleep(60)'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            universal_newlines=True)
+        worker.replies = queue.Queue()
+        reader = threading.Thread(target=worker._read_replies)
+        reader.daemon = True
+        reader.start()
+        self.assertRaises(RuntimeError, worker.run, 'model.xml')
+        worker.process.wait(timeout=5)
+        self.assertFalse(worker.alive)
+        worker.close()
+
+    @unittest.skipIf(shutil.which('java') is None, "Java is not installed")
+    def test_server(self):
+        import tempfile
+        from pyneuroml import pynml
+        path = os.path.realpath(os.path.join(os.path.dirname(__file__), '..',
+                                             'models', 'NeuroML2',
+                                             'LEMS_2007One.xml'))
+        worker = self.worker_class()
+        try:
+            results = worker.run(path)
+        finally:
+            worker.close()
+        exec_in_dir = tempfile.mkdtemp()
+        expected = pynml.run_lems_with_jneuroml(
+            path, paths_to_include=[os.path.dirname(path)], nogui=True,
+            load_saved_data=True, plot=False, exec_in_dir=exec_in_dir,
+            exit_on_fail=False, verbose=False)
+        shutil.rmtree(exec_in_dir, ignore_errors=True)
+        self.assertEqual(set(results), set(expected))
+        for key in expected:
+            np.testing.assert_allclose(results[key], expected[key])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""Tests of the NeuronUnit benchmark runner"""
+
+from .base import *
+
+
+class BenchmarkRunnerTestCase(unittest.TestCase):
+    """Testing the timing, skipping and comparison of benchmarks"""
+
+    def test_run(self):
+        from neuronunit.benchmarks import Benchmark
+
+        class Sleep(object):
+            params = [0.0, 0.01]
+            param_names = ['seconds']
+            calls = []
+
+            def setup(self, seconds):
+                if seconds > 0.005:
+                    raise NotImplementedError("too slow")
+
+            def time_sleep(self, seconds):
+                self.calls.append(seconds)
+
+        result = Benchmark('fake', Sleep, 'time_sleep', (0.0,)).run(repeat=3)
+        self.assertEqual(result['name'], 'fake.Sleep.time_sleep(0.0)')
+        self.assertEqual(result['params'], {'seconds': 0.0})
+        self.assertIsNone(result['error'])
+        self.assertEqual(len(result['samples']), 3)
+        self.assertEqual(len(Sleep.calls), 4)  # Including the warm-up
+        self.assertLessEqual(result['min'], result['median'])
+
+        result = Benchmark('fake', Sleep, 'time_sleep', (0.01,)).run()
+        self.assertTrue(result['skipped'])
+        self.assertNotIn('min', result)
+
+    def test_compare(self):
+        from neuronunit.benchmarks import compare
+        old = {'results': {'a': {'min': 1.0}, 'b': {'min': 1.0},
+                           'c': {'min': 1.0}}}
+        new = {'results': {'a': {'min': 1.05}, 'b': {'min': 2.0},
+                           'd': {'min': 1.0}}}
+        rows, regressions = compare(old, new, factor=1.1)
+        self.assertEqual([row[0] for row in rows], ['a', 'b'])
+        self.assertEqual(regressions, ['b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -14,6 +14,44 @@ class ImportTestCase(unittest.TestCase):
                                  'backends','unit_test'],
                            verbose=True)
 
+    def test_import_is_lazy(self):
+        """Importing neuronunit.models spawns no processes, and imports
+        no simulator backends, until one is asked for by name"""
+        import subprocess
+        import sys
+        code = '\n'.join([
+            "import os, subprocess, sys, time",
+            "spawned = []",
+            "os.system = lambda *args: spawned.append(args)",
+            "subprocess.Popen.__init__ = lambda *args, **kw: spawned.append(args)",
+            "start = time.time()",
+            "import neuronunit.models",
+            "elapsed = time.time() - start",
+            "modules = [name for name in sys.modules",
+            "           if name.startswith('neuronunit.models.backends.')",
+            "           or name in ('neuron', 'elephant')]",
+            "print('%f|%d|%s' % (elapsed, len(spawned), ' '.join(modules)))"])
+        out = subprocess.check_output([sys.executable, '-c', code])
+        elapsed, n_spawned, modules = \
+            out.decode().strip().split('\n')[-1].split('|')
+        print("import neuronunit.models took %.2f s" % float(elapsed))
+        self.assertEqual(int(n_spawned), 0)
+        self.assertEqual(modules.split(), ['neuronunit.models.backends.base'])
+
+        from neuronunit.models.backends import available_backends
+        self.assertIn('RAW', available_backends)
+        self.assertIsNone(available_backends.get('NoSuchSimulator'))
+
+    def test_failed_backend(self):
+        from neuronunit.models.backends import BackendRegistry
+        registry = BackendRegistry({'Broken': ('no_such_module', 'Backend')})
+        with self.assertLogs('neuronunit.models.backends', 'WARNING') as log:
+            self.assertNotIn('Broken', registry)
+        self.assertIn('ModuleNotFoundError', log.output[0])
+        # Reported once; the reason stays attached to later lookups.
+        with self.assertRaises(KeyError) as cm:
+            registry['Broken']
+        self.assertIsInstance(cm.exception.__cause__, ImportError)
 
 
 if __name__ == '__main__':
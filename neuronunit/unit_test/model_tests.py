@@ -22,6 +22,46 @@ class ReducedModelTestCase(unittest.TestCase):
     def test_reducedmodel_jneuroml(self):
         model = self.ReducedModel(self.path, backend='jNeuroML')
 
+    def test_lems_edits_in_memory(self):
+        import quantities as pq
+        model = self.ReducedModel(self.path, backend='jNeuroML')
+        nml_path = model.get_model_file_paths()[1]
+        with open(nml_path) as f:
+            before = f.read()
+        model.set_attrs(izhikevich2007Cell={'a': '0.05 per_ms'})
+        model.inject_square_current({'amplitude': 200*pq.pA,
+                                     'delay': 10*pq.ms,
+                                     'duration': 500*pq.ms})
+        # Nothing is written to disk until a simulator needs the files.
+        with open(nml_path) as f:
+            self.assertEqual(f.read(), before)
+        cell = model.get_parsed_nodes(nml_path, 'izhikevich2007Cell')[0]
+        self.assertEqual(cell.attrib['a'], '0.05 per_ms')
+        self.assertTrue(model.has_pulse_generator())
+        model.write_lems_files()
+        model.forget_parsed_trees()
+        cell = model.get_parsed_nodes(nml_path, 'izhikevich2007Cell')[0]
+        pg = model.get_parsed_nodes(nml_path, 'pulseGenerator')[0]
+        self.assertEqual(cell.attrib['a'], '0.05 per_ms')
+        self.assertEqual(pg.attrib['amplitude'], str(200*pq.pA))
+        with open(model.orig_lems_file_path.replace('LEMS_2007One.xml',
+                                                    'Izh2007One.net.nml')) \
+                as f:
+            self.assertNotIn('0.05 per_ms', f.read())
+
+    def test_lems_edits_pickled(self):
+        import pickle
+        model = self.ReducedModel(self.path, backend='jNeuroML')
+        model.set_attrs(izhikevich2007Cell={'a': '0.0777 per_ms'})
+        # Edits still in memory are written out for the copy to read.
+        copied = pickle.loads(pickle.dumps(model))
+        copied.write_lems_files()
+        nml_path = copied.get_model_file_paths()[1]
+        cell = copied.get_parsed_nodes(nml_path, 'izhikevich2007Cell')[0]
+        self.assertEqual(cell.attrib['a'], '0.0777 per_ms')
+        with open(nml_path) as f:
+            self.assertIn('0.0777 per_ms', f.read())
+
     @unittest.skip("Ignoring NEURON until we make it an install requirement")#If(OSX,"NEURON unreliable on OSX")
     def test_reducedmodel_neuron(self):
         model = self.ReducedModel(self.path, backend='NEURON')
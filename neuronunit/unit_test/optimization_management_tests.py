@@ -0,0 +1,359 @@
+"""Tests of the NeuronUnit optimization management code"""
+
+from .base import *
+import numpy as np
+
+
+class TransportTestCase(unittest.TestCase):
+    """Testing the compact transport of individuals to workers"""
+
+    def setUp(self):
+        from neuronunit.optimization.data_transport_container import DataTC
+        self.dtcpop = []
+        for i in range(4):
+            dtc = DataTC()
+            dtc.attrs = {'a': 0.01*(i+1), 'b': 15.0}
+            dtc.rheobase = None if i == 3 else float(100+i)
+            dtc.backend = 'RAW'
+            dtc.scores = {'RheobaseTestP': 0.5}
+            self.dtcpop.append(dtc)
+
+    def test_pack_unpack(self):
+        from neuronunit.optimization import transport
+        keys, payloads = transport.pack(self.dtcpop)
+        self.assertEqual(keys, ['a', 'b'])
+        for dtc, payload in zip(self.dtcpop, payloads):
+            clone = transport.unpack(payload, keys, 'RAW')
+            self.assertEqual(clone.attrs, dtc.attrs)
+            if dtc.rheobase is None:
+                self.assertEqual(clone.rheobase, -1.0)
+            else:
+                self.assertEqual(float(clone.rheobase), dtc.rheobase)
+
+    def test_merge(self):
+        from neuronunit.optimization import transport
+        tests = ['RheobaseTestP', 'InputResistanceTest']
+        results = [(i, np.array([np.nan, 0.25]), None)
+                   for i in range(len(self.dtcpop))]
+        dtcpop = transport.merge(self.dtcpop, results, tests)
+        for dtc in dtcpop:
+            self.assertEqual(dtc.scores, {'RheobaseTestP': 0.5,
+                                          'InputResistanceTest': 0.25})
+            self.assertEqual(dtc.summed, 0.75)
+
+
+class RheobasePopulationTestCase(unittest.TestCase):
+    """Testing the population rheobase search and its scoring"""
+
+    def test_dtcpop_to_rheo(self):
+        import quantities as pq
+        from neuronunit.models.backends import rawpy
+        from neuronunit.optimization.data_transport_container import DataTC
+        from neuronunit.optimization.optimization_management import \
+            dtcpop_to_rheo
+        from neuronunit.tests.fi import RheobaseTestP
+        dtcpop = []
+        for a in [0.02, 0.03]:
+            rtest = RheobaseTestP(observation={'mean': 200*pq.pA,
+                                               'std': 50*pq.pA, 'n': 10},
+                                  name='RheobaseTestP')
+            # As built by get_neab, with no current to update.
+            rtest.params.pop('injected_square_current', None)
+            dtc = DataTC()
+            dtc.attrs = dict(rawpy.PARAM_DEFAULTS, a=a)
+            dtc.backend = 'RAW'
+            dtc.tests = [rtest]
+            dtcpop.append(dtc)
+        for dtc in dtcpop_to_rheo(dtcpop):
+            rtest = dtc.tests[0]
+            self.assertGreater(float(dtc.rheobase), 0)
+            self.assertEqual(
+                rtest.params['injected_square_current']['amplitude'],
+                dtc.rheobase)
+            self.assertIn('delay', rtest.params['injected_square_current'])
+            self.assertIn('RheobaseTestP', dtc.scores)
+
+
+class ProtocolPlannerTestCase(unittest.TestCase):
+    """Testing that tests sharing a stimulus share one simulation"""
+
+    def test_one_simulation_per_protocol(self):
+        import quantities as pq
+        from neo.core import AnalogSignal
+        from neuronunit.optimization import optimization_management as om
+        from neuronunit.optimization.data_transport_container import DataTC
+
+        class FakeTest(object):
+            def __init__(self, name):
+                self.name = name
+        names = ['RheobaseTestP', 'InjectedCurrentAPWidthTest',
+                 'InjectedCurrentAPAmplitudeTest',
+                 'InjectedCurrentAPThresholdTest', 'RestingPotentialTest',
+                 'InputResistanceTest', 'TimeConstantTest',
+                 'CapacitanceTest']
+        dtc = DataTC()
+        dtc.tests = [FakeTest(name) for name in names]
+        dtc.rheobase = 100*pq.pA
+        dtc = om.format_test(dtc)
+        simulated = []
+
+        def simulate_protocol(dtc, current):
+            simulated.append(current)
+            return AnalogSignal(np.zeros(10), units=pq.mV,
+                                sampling_period=1*pq.ms)
+        original = om.simulate_protocol
+        om.simulate_protocol = simulate_protocol
+        try:
+            models = om.protocol_models(dtc, dtc.tests)
+        finally:
+            om.simulate_protocol = original
+        self.assertEqual(len(simulated), 2)
+        self.assertEqual(sorted(models.keys()), list(range(1, 8)))
+        self.assertIs(models[1], models[3])
+        self.assertIs(models[4], models[7])
+        self.assertIsNot(models[1], models[4])
+
+
+class AsyncEvolutionTestCase(unittest.TestCase):
+    """Testing the steady-state evolutionary loop"""
+
+    def test_async_evolution(self):
+        import random
+        import dask
+        import deap.base
+        import deap.tools
+        import deap.algorithms
+        from neuronunit.optimization import algorithms
+        from neuronunit.optimization.bp_opt import WSListIndividual
+        from neuronunit.optimization.optimization_management import \
+            RheobaseNotFound
+
+        def evaluate(pop):
+            if pop[0][0] > 0.95:
+                raise RheobaseNotFound('no rheobase')
+            if pop[0][0] < 0:
+                raise ValueError('a bug')
+            for ind in pop:
+                # Where, and with which dask scheduler, it was evaluated.
+                ind.pid = os.getpid()
+                ind.scheduler = dask.config.get('scheduler', None)
+            return pop, [(ind[0]**2 + ind[1]**2, (ind[0]-1)**2 + ind[1]**2)
+                         for ind in pop]
+        toolbox = deap.base.Toolbox()
+        toolbox.register("evaluate", evaluate)
+        toolbox.register("mate", deap.tools.cxSimulatedBinaryBounded,
+                         eta=10, low=[0, 0], up=[1, 1])
+        toolbox.register("mutate", deap.tools.mutPolynomialBounded,
+                         eta=10, low=[0, 0], up=[1, 1], indpb=0.5)
+        toolbox.register("variate", deap.algorithms.varAnd)
+        random.seed(1)
+        mu, ngen = 8, 5
+        pop = [WSListIndividual([random.random(), random.random()],
+                                obj_size=2) for i in range(mu)]
+        hof = deap.tools.HallOfFame(mu)
+        pf = deap.tools.ParetoFront()
+        pop, hof, pf, log, history, gen_vs_pop = \
+            algorithms.eaAlphaMuPlusLambdaAsync(pop, toolbox, mu, 1.0, 1.0,
+                                                ngen, halloffame=hof, pf=pf,
+                                                selection='selNSGA',
+                                                max_in_flight=3)
+        self.assertEqual(len(pop), mu)
+        self.assertEqual(log.select('gen'), list(range(1, ngen+1)))
+        self.assertEqual(sum(log.select('nevals')), mu*ngen)
+        self.assertEqual(len(gen_vs_pop), ngen)
+        # Failed evaluations are dropped; the rest are all recorded.
+        self.assertLessEqual(len(history.genealogy_history), mu*ngen)
+        self.assertTrue(all(ind.fitness.valid for ind in pop))
+        self.assertTrue(len(hof) and len(pf))
+        for ind in pf:
+            self.assertFalse(any(other.fitness.dominates(ind.fitness)
+                                 for other in pf))
+        # In worker processes, each computing dask collections itself.
+        self.assertTrue(all(ind.pid != os.getpid() for ind in pop))
+        self.assertTrue(all(ind.scheduler == 'synchronous' for ind in pop))
+        self.assertIsNone(dask.config.get('scheduler', None))
+
+        # Other errors are raised, rather than dropping individuals, and so
+        # is losing every individual.
+        for gene, error in [(-1.0, ValueError), (1.0, RheobaseNotFound)]:
+            pop = [WSListIndividual([gene, 0.5], obj_size=2)
+                   for i in range(mu)]
+            self.assertRaises(error, algorithms.eaAlphaMuPlusLambdaAsync,
+                              pop, toolbox, mu, 1.0, 1.0, 1,
+                              selection='selNSGA', max_in_flight=2)
+
+    def test_sciunit_optimization(self):
+        import quantities as pq
+        from neuronunit.optimization.bp_opt import SciUnitOptimization
+        from neuronunit.optimization.model_parameters import model_params
+        from neuronunit.tests import passive, waveform
+        from neuronunit.tests.fi import RheobaseTestP
+        observations = [
+            (RheobaseTestP, {'mean': 200*pq.pA, 'std': 50*pq.pA, 'n': 10}),
+            (passive.InputResistanceTest,
+             {'mean': 120*pq.MOhm, 'std': 60*pq.MOhm, 'n': 10}),
+            (waveform.InjectedCurrentAPWidthTest,
+             {'mean': 1.2*pq.ms, 'std': 0.4*pq.ms, 'n': 10})]
+        tests = [cls(observation=obs, name=cls.__name__)
+                 for cls, obs in observations]
+        provided_dict = {k: model_params[k] for k in ['a', 'b', 'vr']}
+        mu, ngen = 8, 2
+        optimization = SciUnitOptimization(
+            error_criterion=tests, backend='RAW', selection='selNSGA',
+            offspring_size=mu, seed=1, nparams=len(provided_dict),
+            provided_dict=provided_dict)
+        results = optimization.run(max_ngen=ngen, asynchronous=True,
+                                   max_in_flight=2)
+        log = results['log']
+        self.assertEqual(log.select('gen'), list(range(1, ngen+1)))
+        self.assertEqual(sum(log.select('nevals')), mu*ngen)
+        self.assertTrue(0 < len(results['pop']) <= mu)
+        self.assertTrue(all(ind.fitness.valid for ind in results['pop']))
+        self.assertTrue(all(len(ind.fitness.values) == len(tests)
+                            for ind in results['hof']))
+
+
+class SurrogateTestCase(unittest.TestCase):
+    """Testing the surrogate screening of offspring"""
+
+    def test_screening(self):
+        import deap.base
+        import deap.creator
+        from neuronunit.optimization.surrogate import Surrogate
+
+        class Fitness(deap.base.Fitness):
+            weights = (-1.0, -1.0)
+
+        class Individual(list):
+            def __init__(self, genes, no_rheobase=False):
+                super(Individual, self).__init__(genes)
+                self.fitness = Fitness()
+                if not no_rheobase:
+                    self.fitness.values = (genes[0]**2, (genes[1]-5)**2)
+
+        rng = np.random.RandomState(0)
+        # Genes above 8 in the first dimension have no rheobase.
+        genes = rng.uniform(0, 10, size=(80, 2))
+        surrogate = Surrogate([0, 0], [10, 10], fraction=0.25, seed=0)
+        self.assertFalse(surrogate.ready)
+        surrogate.update([Individual(list(g), g[0] > 8) for g in genes],
+                         seconds=8.0)
+        self.assertTrue(surrogate.ready)
+        mean, std, p_valid = surrogate.predict([[1, 5], [9.8, 5], [6, 1]])
+        self.assertLess(mean[0].sum(), mean[2].sum())
+        self.assertGreater(p_valid[0], 0.8)
+        self.assertLess(p_valid[1], 0.5)
+
+        offspring = [Individual(list(g), True)
+                     for g in rng.uniform(0, 10, size=(40, 2))]
+        kept = surrogate.screen(offspring)
+        self.assertEqual(len(kept), 10)
+        error = lambda g: g[0]**2 + (g[1]-5)**2
+        self.assertLess(np.mean([error(g) for g in kept]),
+                        np.mean([error(g) for g in offspring]))
+        record = surrogate.record()
+        self.assertEqual(sorted(record), sorted(Surrogate.fields))
+        self.assertEqual(record['screened'], 40)
+        self.assertEqual(record['simulated'], 80)
+        self.assertAlmostEqual(record['saved_s'], 30*0.1)
+        self.assertEqual(surrogate.record()['screened'], 0)
+
+
+class StreamingGridTestCase(unittest.TestCase):
+    """Testing the resumable, chunked grid search"""
+
+    def test_resume(self):
+        import tempfile
+        from sklearn.model_selection import ParameterGrid
+        from neuronunit.optimization import exhaustive_search as es
+        from neuronunit.optimization.data_transport_container import DataTC
+
+        evaluated = []
+
+        def update_deap_pop(pop, tests, td):
+            if len(evaluated) == 3:
+                evaluated.append(None)
+                raise KeyboardInterrupt
+            for p in pop:
+                p.dtc = DataTC()
+                p.dtc.attrs = dict(zip(td, p))
+                p.dtc.scores = {'test': p[0] + p[1]}
+                p.dtc.rheobase = 1.0
+            evaluated.append(len(pop))
+            return pop
+        ranges = {'a': [0.0, 1.0], 'b': [10.0, 20.0], 'c': [5.0, 6.0]}
+        path = os.path.join(tempfile.mkdtemp(), 'grid')
+        original = es.update_deap_pop
+        es.update_deap_pop = update_deap_pop
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                es.run_streaming_grid(5, None, ranges, ['a', 'b'], path,
+                                      chunk_size=4)
+            # The finished chunks were kept, and only the rest are done.
+            dtcs = list(es.run_streaming_grid(5, None, ranges, ['a', 'b'],
+                                              path, chunk_size=4))
+            with self.assertRaises(ValueError):
+                es.run_streaming_grid(5, None, ranges, ['a', 'b'], path,
+                                      chunk_size=8)
+        finally:
+            es.update_deap_pop = original
+        self.assertEqual(evaluated, [4, 4, 4, None, 4, 4, 4, 1])
+        grid = ParameterGrid(es.grid_subset(5, ranges, ['a', 'b']))
+        self.assertEqual([d.attrs for d in dtcs], list(grid))
+        self.assertEqual([d.summed for d in dtcs],
+                         [g['a'] + g['b'] for g in grid])
+
+
+class AdaptiveGridTestCase(unittest.TestCase):
+    """Testing the adaptive refinement of grid searches"""
+
+    def test_refinement(self):
+        import itertools
+        from neuronunit.optimization import exhaustive_search as es
+        from neuronunit.optimization.data_transport_container import DataTC
+        from neuronunit.optimization.results_analysis import min_max
+
+        def error(a, b, c):
+            return abs(a-0.3) + 3*(b-0.7)**2 + 2*abs(c-0.55)
+        evaluated = []
+
+        def update_deap_pop(pop, tests, td):
+            for p in pop:
+                evaluated.append(tuple(p))
+                attrs = dict(zip(td, p))
+                if attrs['a'] > 0.9:
+                    continue  # No rheobase
+                p.dtc = DataTC()
+                p.dtc.attrs = attrs
+                p.dtc.scores = {'test': error(**attrs)}
+            return pop
+        ranges = {k: [0.0, 1.0] for k in ['a', 'b', 'c', 'd']}
+        original = es.update_deap_pop
+        es.update_deap_pop = update_deap_pop
+        try:
+            grid = es.run_adaptive_grid(3, None, ranges, ['a', 'b', 'c'],
+                                        max_depth=3)
+        finally:
+            es.update_deap_pop = original
+        # The uniform grid of the same (finest) resolution has 17**3 points.
+        xs = np.linspace(0, 1, 17)
+        best = min(error(*x) for x in itertools.product(xs, xs, xs)
+                   if x[0] <= 0.9)
+        self.assertLess(len(evaluated), 0.25 * 17**3)
+        self.assertEqual(len(evaluated), len(set(evaluated)))
+        self.assertAlmostEqual(grid.minimum().summed, best)
+        self.assertEqual(grid.locate(grid.minimum().attrs).depth, 3)
+
+        # A fixed parameter is located at the lowest cells along it.
+        fixed = es.AdaptiveGrid({'a': (0.0, 1.0), 'b': (2.0, 2.0)})
+        cell = fixed.locate({'a': 0.2, 'b': 2.0})
+        self.assertIsNotNone(cell)
+        self.assertTrue(cell.contains((3, 0)))
+        self.assertEqual(fixed.attrs((3, 0))['b'], 2.0)
+        pop = grid.population()
+        self.assertEqual(len(pop), len(grid.genealogy_history))
+        self.assertAlmostEqual(min_max(pop)[0][1], best)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@
 
 
 from .base import *
+import numpy as np
 
 
 class NeuroElectroTestCase(unittest.TestCase):
@@ -24,6 +25,211 @@ class NeuroElectroTestCase(unittest.TestCase):
         x.check()
         
 
+class NeuroElectroStoreTestCase(unittest.TestCase):
+    """Testing observations looked up in the local NeuroElectro store"""
+
+    def setUp(self):
+        import tempfile
+        neuron = {'id': 85, 'nlex_id': 'sao830368389',
+                  'name': 'Hippocampus CA1 pyramidal cell'}
+        ir = {'id': 2, 'name': 'input resistance'}
+        rmp = {'id': 3, 'name': 'resting membrane potential'}
+        pages = {
+            'nes': [{'objects': [
+                {'n': neuron, 'e': ir, 'value_mean': 120.0,
+                 'value_sd': 60.0, 'num_articles': 40},
+                {'n': neuron, 'e': rmp, 'value_mean': -65.0,
+                 'value_sd': 5.0, 'num_articles': 50}]}],
+            'nedm': [{'meta': {'next': '/api/1/nedm/?page=2'}, 'objects': [
+                {'ncm': {'n': neuron}, 'ecm': {'e': ir}, 'val': 100.0,
+                 'err': 10.0, 'n': 10, 'val_norm': None, 'err_norm': None,
+                 'error_type': 'sd', 'source': 'a'}]},
+                {'objects': [
+                {'ncm': {'n': neuron}, 'ecm': {'e': ir}, 'val': 200.0,
+                 'err': 10.0, 'n': 10, 'val_norm': None, 'err_norm': None,
+                 'error_type': 'sd', 'source': 'b'}]}]}
+        self.urls = []
+
+        class Store(neuroelectro.NeuroElectroStore):
+            def fetch(store, url):
+                if store.offline:
+                    return super(Store, store).fetch(url)
+                self.urls.append(url)
+                kind = 'nedm' if 'nedm' in url else 'nes'
+                return pages[kind][1 if 'page=2' in url else 0]
+
+        self.directory = tempfile.mkdtemp()
+        self.store = Store(os.path.join(self.directory, 'ne.sqlite'))
+        self.old_store = neuroelectro._store
+        neuroelectro._store = self.store
+
+    def tearDown(self):
+        neuroelectro._store = self.old_store
+        self.store.close()
+
+    def test_prefetch(self):
+        import quantities as pq
+        from neuronunit.tests.passive import InputResistanceTest
+        self.assertEqual(neuroelectro.prefetch(['sao830368389']), 4)
+        self.assertEqual(len(self.urls), 3)
+        self.assertEqual(neuroelectro.prefetch(['sao830368389']), 0)
+        self.assertEqual(len(self.urls), 3)
+
+        self.store.offline = True
+        x = neuroelectro.NeuroElectroSummary(
+            neuron={'nlex_id': 'sao830368389'},
+            ephysprop={'name': 'Input Resistance'})
+        x.get_values(quiet=True)
+        self.assertEqual((x.mean, x.std, x.n), (120.0, 60.0, 40))
+
+        # Looked up by any of the neuron's identifiers.
+        obs = InputResistanceTest.neuroelectro_summary_observation({'id': 85})
+        self.assertEqual(obs['mean'], 120.0*pq.MOhm)
+        x = neuroelectro.NeuroElectroDataMap(
+            neuron={'nlex_id': 'sao830368389'},
+            ephysprop={'name': 'Input Resistance'})
+        x.get_one_match = False
+        data = x.get_values(params={'limit': 999}, quiet=True)
+        self.assertEqual([item['val'] for item in data], [100.0, 200.0])
+        self.assertEqual(len(self.urls), 3)
+
+        x = neuroelectro.NeuroElectroSummary(
+            neuron={'nlex_id': 'nifext_50'},
+            ephysprop={'name': 'Input Resistance'})
+        self.assertRaises(neuroelectro.NeuroElectroError, x.get_values,
+                          quiet=True)
+
+    def test_default_store(self):
+        import tempfile
+        home = tempfile.mkdtemp()
+        environ = dict(os.environ)
+        os.environ['HOME'] = home
+        os.environ.pop('NU_NEUROELECTRO_STORE', None)
+        neuroelectro._store = None
+        try:
+            store = neuroelectro.get_store()
+            store.close()
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+        # In a per-user cache, not the working directory.
+        self.assertEqual(store.path, os.path.join(home, '.cache', 'neuronunit',
+                                                  'neuroelectro.sqlite'))
+        self.assertTrue(os.path.isfile(store.path))
+
+    def test_neuron_criteria(self):
+        from neuronunit.optimization import get_neab
+        neuroelectro.prefetch(['sao830368389'])
+        self.store.offline = True
+        tests, observations = get_neab.get_neuron_criteria(
+            {'nlex_id': 'sao830368389'})
+        self.assertIn('Input Resistance', observations)
+        # A neuron that cannot be prefetched fails test by test.
+        tests, observations = get_neab.get_neuron_criteria(
+            {'nlex_id': 'nifext_50'})
+        self.assertEqual((tests, observations), ([], {}))
+
+    def test_pooled(self):
+        neuroelectro.prefetch(['sao830368389'])
+        self.store.offline = True
+        x = neuroelectro.NeuroElectroPooledSummary(
+            neuron={'nlex_id': 'sao830368389'},
+            ephysprop={'name': 'Input Resistance'})
+        x.get_values(quiet=True)
+        self.assertEqual((x.mean, x.std, x.n), (150.0, 10.0, 20))
+        self.assertEqual(self.store.pooled_observations(),
+                         {('sao830368389', 'input resistance'):
+                          {'mean': 150.0, 'std': 10.0, 'n': 20}})
+
+        # Missing N, SD and SEM filled in within each group.
+        neuron = {'id': 1, 'nlex_id': None}
+        records = [
+            {'ncm': {'n': neuron}, 'ecm': {'e': {'name': name}}, 'val': val,
+             'err': err, 'n': n, 'error_type': error_type}
+            for name, val, err, n, error_type in [
+                ('a', 10.0, 2.0, 4, 'sem'), ('a', 20.0, None, None, 'sd'),
+                ('b', 1.0, None, 5, 'sd')]]
+        pooled = neuroelectro.pooled_observations(records)
+        self.assertEqual(list(pooled), [('1', 'a')])
+        self.assertEqual((pooled[('1', 'a')]['mean'],
+                          pooled[('1', 'a')]['std'],
+                          pooled[('1', 'a')]['n']), (15.0, 4.0, 8))
+
+
+class NeuroMLDBCacheTestCase(unittest.TestCase):
+    """Testing the fetching and caching of NeuroML-DB waveforms"""
+
+    def setUp(self):
+        import tempfile
+        from neuronunit import neuromldb
+        self.neuromldb = neuromldb
+        self.old_cache = neuromldb._cache
+        neuromldb._cache = neuromldb.WaveformCache(tempfile.mkdtemp())
+        self.urls = []
+        waveforms = [
+            {'ID': 1, 'Protocol_ID': 'STEADY_STATE', 'Variable_Name': 'Voltage',
+             'Starts_From_Steady_State': 0, 'Waveform_Label': '0 nA'},
+            {'ID': 2, 'Protocol_ID': 'LONG_SQUARE', 'Variable_Name': 'Voltage',
+             'Starts_From_Steady_State': 1, 'Waveform_Label': '0.5 nA'},
+            {'ID': 3, 'Protocol_ID': 'LONG_SQUARE', 'Variable_Name': 'Current',
+             'Starts_From_Steady_State': 1, 'Waveform_Label': '0.5 nA'}]
+        responses = {
+            'model': {'waveform_list': waveforms},
+            1: {'Times': '0,0.02', 'Variable_Values': '-65,-64'},
+            2: {'Times': '0.03,0,0.01', 'Variable_Values': '-40,-70,-50'}}
+
+        class Model(neuromldb.NeuroMLDBModel):
+            def read_api_url(model, url):
+                self.urls.append(url)
+                if 'model?' in url:
+                    return responses['model']
+                return responses[int(url.split('=')[-1])]
+        self.Model = Model
+
+    def tearDown(self):
+        self.neuromldb._cache = self.old_cache
+
+    def test_waveforms(self):
+        model = self.Model()
+        model.fetch_waveforms()
+        self.assertEqual(len(self.urls), 3)  # The list, and 2 Voltage waveforms
+        signal = model.fetch_waveform_as_AnalogSignal(2)
+        np.testing.assert_allclose(np.array(signal).ravel(),
+                                   [-65, -64.5, -70, -50, -45], rtol=1e-6)
+        self.assertEqual(len(model.get_steady_state_waveform()), 2)
+        self.assertEqual(len(self.urls), 3)
+
+        # Another model reads the waveforms from the on-disk cache.
+        model = self.Model()
+        model.fetch_waveform_as_AnalogSignal(2)
+        self.assertEqual(len(self.urls), 4)  # Only the list
+        self.assertEqual(model.waveform_arrays[(2, 0.01)].dtype, np.float32)
+
+    def test_old_pickle(self):
+        import pickle
+        model = self.neuromldb.NeuroMLDBModel()
+        del model.waveform_arrays
+        model = pickle.loads(pickle.dumps(model))
+        self.assertEqual(model.waveform_arrays, {})
+
+    def test_default_cache(self):
+        import tempfile
+        home = tempfile.mkdtemp()
+        environ = dict(os.environ)
+        os.environ['HOME'] = home
+        os.environ.pop('NU_NEUROMLDB_CACHE', None)
+        self.neuromldb._cache = None
+        try:
+            cache = self.neuromldb.get_cache()
+        finally:
+            os.environ.clear()
+            os.environ.update(environ)
+        # In a per-user cache, not the working directory.
+        self.assertEqual(cache.path, os.path.join(home, '.cache', 'neuronunit',
+                                                  'neuromldb'))
+        self.assertTrue(os.path.isdir(cache.path))
+
+
 class BlueBrainTestCase(NotebookTools,
                         unittest.TestCase):
      
@@ -0,0 +1,60 @@
+"""Tests of spike detection and spike waveform features"""
+
+from .base import *
+import numpy as np
+import quantities as pq
+import neo
+
+
+class SpikeFunctionsTestCase(unittest.TestCase):
+    """Testing the vectorized spike waveform functions"""
+
+    def setUp(self):
+        v = -65.0*np.ones(2000)
+        self.spikes = [400, 1200]
+        for i in self.spikes:
+            v[i:i+5] = [-20, 10, 30, 5, -40]
+        self.vm = neo.core.AnalogSignal(v, units=pq.mV,
+                                        sampling_period=0.1*pq.ms)
+
+    def test_spike_indices(self):
+        import neuronunit.capabilities.spike_functions as sf
+        indices = sf.get_spike_indices(self.vm)
+        np.testing.assert_array_equal(indices, [i+1 for i in self.spikes])
+        train = sf.get_spike_train(self.vm)
+        np.testing.assert_allclose(self.vm.times[indices].magnitude,
+                                   train.rescale(pq.s).magnitude)
+        counts = sf.get_spike_counts(np.vstack([self.vm.magnitude.ravel(),
+                                                -65.0*np.ones(2000)]))
+        np.testing.assert_array_equal(counts, [2, 0])
+
+    def test_spike_waveforms(self):
+        import neuronunit.capabilities.spike_functions as sf
+        sw = sf.get_spike_waveforms(self.vm)
+        self.assertEqual(sw.shape, (100, 2))
+        for column, i in zip(sw.T, self.spikes):
+            snippet = self.vm.time_slice(self.vm.times[i+1]-5*pq.ms,
+                                         self.vm.times[i+1]+5*pq.ms)
+            np.testing.assert_array_equal(column, snippet.magnitude.ravel())
+        amplitudes = sf.spikes2amplitudes(sw)
+        np.testing.assert_allclose(amplitudes.rescale(pq.mV).magnitude,
+                                   [30, 30])
+        widths = sf.spikes2widths(sw)
+        np.testing.assert_allclose(widths.rescale(pq.ms).magnitude, [0.3, 0.3])
+        thresholds = sf.spikes2thresholds(sw)
+        np.testing.assert_allclose(thresholds.rescale(pq.mV).magnitude,
+                                   [-42.5, -42.5])
+
+    def test_no_spikes(self):
+        import neuronunit.capabilities.spike_functions as sf
+        vm = neo.core.AnalogSignal(-65.0*np.ones(1000), units=pq.mV,
+                                   sampling_period=0.1*pq.ms)
+        sw = sf.get_spike_waveforms(vm)
+        self.assertEqual(sw.shape[1], 0)
+        self.assertEqual(len(sf.spikes2amplitudes(sw)), 0)
+        self.assertEqual(len(sf.spikes2widths(sw)), 0)
+        self.assertEqual(len(sf.spikes2thresholds(sw)), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
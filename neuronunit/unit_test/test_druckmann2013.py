@@ -112,6 +112,7 @@ class Druckmann2013BaseTestCase:
                 # Clear AnalogSignal versions (to reduce file size) and pickle the model (to speed up unit tests)
                 model.vm = None
                 model.nmldb_model.waveform_signals = {}
+                model.nmldb_model.waveform_arrays = {}
                 model.nmldb_model.steady_state_waveform = None
 
             import pickle
@@ -797,5 +798,42 @@ class Model11TestCase(Druckmann2013BaseTestCase.BaseTest):
 
         super(Model11TestCase, self).setUp()
 
+class FeatureExtractorTestCase(unittest.TestCase):
+    """Testing that Druckmann 2013 tests share one AP extraction per trace"""
+
+    class Model:
+        def __init__(self):
+            import numpy as np
+            from neo import AnalogSignal
+            v = -65.0 * np.ones(140000)
+            # A spike every 50 ms during the 2s current step
+            for i in range(42000, 118000, 2000):
+                v[i:i+8] = [-50, -20, 10, 30, 20, -20, -60, -70]
+            self.vm = AnalogSignal(v, units=pq.mV, sampling_period=0.025 * pq.ms)
+
+        def inject_square_current(self, current):
+            pass
+
+        def get_membrane_potential(self):
+            return self.vm
+
+    def test_shared_extraction(self):
+        from numpy import testing
+        Druckmann2013FeatureExtractor.clear_cache()
+        model = self.Model()
+        test1 = AP1AmplitudeTest(1 * pq.nA)
+        test2 = ISIMedianTest(1 * pq.nA)
+
+        aps = test1.get_APs(model)
+        self.assertEqual(len(aps), 38)
+        self.assertIs(test2.get_APs(model), aps)
+        self.assertEqual(len(Druckmann2013FeatureExtractor._cache), 1)
+
+        table = test1.get_feature_extractor(model).table
+        testing.assert_allclose(table['isi'], 50.0)
+        testing.assert_allclose(table['peak_v'], 30.0)
+        self.assertAlmostEqual(float(test2.generate_prediction(model)['mean']), 50.0)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
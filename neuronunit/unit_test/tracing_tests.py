@@ -0,0 +1,76 @@
+"""Tests of the timing spans of NeuronUnit"""
+
+from .base import *
+import json
+import subprocess
+import sys
+import tempfile
+
+
+class TracingTestCase(unittest.TestCase):
+    """Testing the recording and aggregation of timing spans"""
+
+    def setUp(self):
+        from neuronunit import tracing
+        self.tracing = tracing
+        tracing.disable()
+
+    def tearDown(self):
+        self.tracing.disable()
+
+    def test_disabled(self):
+        tracing = self.tracing
+
+        @tracing.traced()
+        def add(a, b):
+            return a + b
+
+        with tracing.span('stage', x=1) as s:
+            self.assertEqual(add(1, 2), 3)
+        self.assertIs(s, tracing._NO_SPAN)
+        self.assertEqual(tracing.gather(), [])
+
+    def test_spans(self):
+        tracing = self.tracing
+        directory = tempfile.mkdtemp()
+        self.assertEqual(tracing.enable(directory), directory)
+
+        @tracing.traced(backend='fake')
+        def simulate():
+            sum(range(10000))
+
+        with tracing.span('evaluation', index=3):
+            for i in range(2):
+                simulate()
+        # A worker process, inheriting the trace directory.
+        subprocess.check_call([sys.executable, '-c',
+                               "from neuronunit import tracing\n"
+                               "with tracing.span('worker'): pass"])
+
+        spans = tracing.gather()
+        self.assertEqual([s['name'] for s in spans],
+                         ['evaluation', 'simulate', 'simulate', 'worker'])
+        evaluation, simulate = spans[0], spans[1]
+        self.assertEqual(evaluation['args'], {'index': 3})
+        self.assertEqual(simulate['parent'], 'evaluation')
+        self.assertEqual(simulate['args'], {'backend': 'fake'})
+        self.assertGreaterEqual(evaluation['wall'], simulate['wall'])
+        self.assertNotEqual(spans[3]['pid'], evaluation['pid'])
+        self.assertEqual(tracing.gather(), [])  # Only new spans
+
+        summary = tracing.summarize(spans)
+        self.assertEqual(summary['simulate']['n'], 2)
+        self.assertEqual(set(summary['simulate']), {'n', 'wall', 'cpu'})
+
+        path = tracing.write_chrome_trace(os.path.join(directory,
+                                                       'trace.json'))
+        with open(path) as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual(len(events), 4)
+        self.assertEqual(events[1]['ph'], 'X')
+        self.assertEqual(events[1]['cat'], 'evaluation')
+        self.assertIn('cpu_ms', events[1]['args'])
+
+
+if __name__ == '__main__':
+    unittest.main()